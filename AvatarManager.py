@@ -12,23 +12,120 @@ import PySide2.QtCore as QtCore
 import PySide2.QtWidgets as QtWidgets
 import PySide2.QtGui as QtGui
 from PySide2.QtGui import QPixmap, QPainter, QColor, QBrush, QPen, QFont
+import time
 import random
 import hashlib
+from collections import OrderedDict
+from NukeChatStorage import replaceFile, readJson, updateJsonFile
+
+class AvatarDecodeTask(QtCore.QRunnable):
+    """Loads one avatar as a QImage on a worker thread"""
+
+    def __init__(self, loader, key, version, thumbnail_path, avatar_path):
+        super(AvatarDecodeTask, self).__init__()
+        self.loader = loader
+        self.key = key
+        self.version = version
+        self.thumbnail_path = thumbnail_path
+        self.avatar_path = avatar_path
+
+    def run(self):
+        image = QtGui.QImage()
+        try:
+            # Pre-rendered thumbnail if there is one, otherwise scale and round the avatar
+            if self.thumbnail_path:
+                image = QtGui.QImage(self.thumbnail_path)
+            if image.isNull():
+                source = QtGui.QImage(self.avatar_path)
+                if not source.isNull():
+                    image = self.loader.avatar_manager._render_rounded(source, self.key[1])
+        except Exception as e:
+            print(f"Error loading avatar: {str(e)}")
+        self.loader._imageDecoded.emit(self.key, self.version, image)
+
+
+class AvatarLoader(QtCore.QObject):
+    """Decodes avatars in a QThreadPool and hands the finished pixmaps to the GUI thread"""
+
+    # Emitted with the user ID and size when an avatar requested with request_avatar is ready
+    avatarLoaded = QtCore.Signal(str, int)
+    # Internal: a decoded image from a worker thread (key, version, QImage)
+    _imageDecoded = QtCore.Signal(object, object, object)
+
+    def __init__(self, avatar_manager, parent=None, max_threads=2):
+        """
+        Initializes the avatar loader
+
+        Args:
+            avatar_manager (AvatarManager): The manager whose cache receives the avatars
+            parent (QObject, optional): Parent object
+            max_threads (int): Number of worker threads
+        """
+        super(AvatarLoader, self).__init__(parent)
+        self.avatar_manager = avatar_manager
+        self.pool = QtCore.QThreadPool(self)
+        self.pool.setMaxThreadCount(max_threads)
+        # Keys of the avatars being decoded, so each one is only requested once
+        self._pending = set()
+        self._imageDecoded.connect(self._on_image_decoded)
+
+    def request(self, key, version, thumbnail_path, avatar_path):
+        """Starts decoding an avatar unless it is already being decoded"""
+        if key in self._pending:
+            return
+        self._pending.add(key)
+        self.pool.start(AvatarDecodeTask(self, key, version, thumbnail_path, avatar_path))
+
+    def _on_image_decoded(self, key, version, image):
+        """GUI thread: converts the image to a pixmap and caches it"""
+        self._pending.discard(key)
+        user_id, size = key
+        if image.isNull():
+            pixmap = self.avatar_manager.create_default_avatar(user_id, size)
+        else:
+            pixmap = QtGui.QPixmap.fromImage(image)
+        self.avatar_manager._put_cached(key, version, pixmap)
+        self.avatarLoaded.emit(user_id, size)
+
 
 class AvatarManager:
     """Management class for user avatars"""
 
-    def __init__(self, db_folder):
+    # Sizes used by NukeChat (toast, message list, settings preview, upload dialog);
+    # save_avatar writes a pre-rounded thumbnail for each of them
+    THUMBNAIL_SIZES = (40, 50, 70, 120)
+    # Increase when the thumbnail rendering changes, older thumbnails are then ignored
+    THUMBNAIL_VERSION = 1
+    # How often the manifest file is checked for changes by other sessions (seconds)
+    MANIFEST_CHECK_INTERVAL = 5.0
+
+    def __init__(self, db_folder, cache_size=256):
         """
         Initializes the avatar management class
 
         Args:
             db_folder (str): The main folder path where avatar files will be stored
+            cache_size (int): Maximum number of finished avatar pixmaps kept in memory
         """
         self.db_folder = db_folder
 
+        # LRU cache of finished (rounded) pixmaps: key -> (source file hash, pixmap)
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+
         # Create the avatar folder path
         self.avatar_folder = os.path.join(self.db_folder, "avatars")
+        self.thumbnail_folder = os.path.join(self.avatar_folder, "thumbs")
+
+        # Manifest of the existing avatars (user ID -> file, size, hash), so lookups are
+        # answered from memory instead of checking the share for every user
+        self.manifest_file = os.path.join(self.avatar_folder, "manifest.json")
+        self._manifest = {}
+        self._manifest_mtime = None
+        self._manifest_checked = 0.0
+
+        # Decodes avatars in the background for request_avatar
+        self.loader = AvatarLoader(self)
 
         # Create the avatar folder if it doesn't exist
         if not os.path.exists(self.avatar_folder):
@@ -62,40 +159,227 @@ class AvatarManager:
         Returns:
             QPixmap: The avatar image (default avatar if file does not exist)
         """
-        avatar_path = self.get_avatar_path(user_id)
+        entry = self.get_manifest().get(user_id)
+        version = entry.get("hash") if entry else None
+
+        # Reuse the finished pixmap as long as the file hasn't changed
+        key = (user_id, size)
+        pixmap = self._get_cached(key, version)
+        if pixmap is None:
+            if entry is not None:
+                # Pre-rendered thumbnails need no scaling or painting
+                if entry.get("thumbnails") == self.THUMBNAIL_VERSION:
+                    pixmap = self._load_thumbnail(user_id, size)
+                if pixmap is None:
+                    pixmap = self._render_avatar(self.get_avatar_path(user_id), user_id, size)
+            else:
+                pixmap = self.create_default_avatar(user_id, size)
+            self._put_cached(key, version, pixmap)
+        return pixmap
 
-        # Load the file if it exists
-        if os.path.exists(avatar_path):
-            original_pixmap = QtGui.QPixmap(avatar_path)
+    def request_avatar(self, user_id, size=50):
+        """
+        Returns the avatar of a user without loading it on the calling (GUI) thread
 
-            # Create a rounded avatar
-            rounded_pixmap = QtGui.QPixmap(size, size)
-            rounded_pixmap.fill(QtCore.Qt.transparent)
+        If the finished avatar is not cached yet, it is decoded in the background and the
+        initials placeholder is returned; loader.avatarLoaded is emitted once it is ready.
 
-            painter = QtGui.QPainter(rounded_pixmap)
-            painter.setRenderHint(QtGui.QPainter.Antialiasing, True)
-            painter.setRenderHint(QtGui.QPainter.SmoothPixmapTransform, True)
+        Args:
+            user_id (str): The unique user ID
+            size (int): The size of the avatar image (in pixels)
 
-            # Create a circular mask
-            path = QtGui.QPainterPath()
-            path.addEllipse(0, 0, size, size)
-            painter.setClipPath(path)
+        Returns:
+            QPixmap: The avatar image, or the default avatar as placeholder
+        """
+        entry = self.get_manifest().get(user_id)
+        if entry is None:
+            # No avatar file, the default avatar is painted right away
+            return self.load_avatar(user_id, size)
+
+        key = (user_id, size)
+        version = entry.get("hash")
+        pixmap = self._get_cached(key, version)
+        if pixmap is not None:
+            return pixmap
+
+        thumbnail_path = None
+        if entry.get("thumbnails") == self.THUMBNAIL_VERSION and size in self.THUMBNAIL_SIZES:
+            thumbnail_path = self.get_thumbnail_path(user_id, size)
+        self.loader.request(key, version, thumbnail_path, self.get_avatar_path(user_id))
+        return self.create_default_avatar(user_id, size)
+
+    def get_manifest(self):
+        """
+        Returns the avatar manifest (user ID -> {"file", "size", "hash", "thumbnails"})
 
-            # Scale and draw the original image
-            scaled_pixmap = original_pixmap.scaled(size, size, QtCore.Qt.KeepAspectRatio,
-                                                   QtCore.Qt.SmoothTransformation)
+        The manifest file is re-read only when its mtime changes, and its mtime is checked
+        at most every MANIFEST_CHECK_INTERVAL seconds.
+        """
+        now = time.time()
+        if now - self._manifest_checked < self.MANIFEST_CHECK_INTERVAL:
+            return self._manifest
+        self._manifest_checked = now
+
+        try:
+            mtime = os.stat(self.manifest_file).st_mtime_ns
+        except OSError:
+            # No manifest yet (avatars saved by an older version) - create it once
+            self._manifest = self.rebuild_manifest()
+            return self._manifest
+
+        if mtime != self._manifest_mtime:
+            self._manifest = readJson(self.manifest_file, {})
+            self._manifest_mtime = mtime
+        return self._manifest
+
+    def rebuild_manifest(self):
+        """
+        Creates the manifest from the avatar files in the avatar folder
+
+        Returns:
+            dict: The new manifest
+        """
+        manifest = {}
+        try:
+            for file_name in os.listdir(self.avatar_folder):
+                if file_name.endswith(".png"):
+                    user_id = file_name[:-4]
+                    thumbnails = None
+                    if all(os.path.exists(self.get_thumbnail_path(user_id, size))
+                           for size in self.THUMBNAIL_SIZES):
+                        thumbnails = self.THUMBNAIL_VERSION
+                    manifest[user_id] = self._manifest_entry(user_id, thumbnails)
+        except OSError as e:
+            print(f"Error reading avatar folder: {str(e)}")
+            return manifest
+
+        def update(data):
+            # Keep entries written by another session in the meantime
+            for user_id, entry in manifest.items():
+                data.setdefault(user_id, entry)
+            return dict(data)
+
+        try:
+            return updateJsonFile(self.manifest_file, update, indent=4)
+        except Exception as e:
+            print(f"Error writing avatar manifest: {str(e)}")
+            return manifest
+
+    def _manifest_entry(self, user_id, thumbnails=None):
+        """Describes an avatar file for the manifest"""
+        avatar_path = self.get_avatar_path(user_id)
+        with open(avatar_path, 'rb') as file:
+            data = file.read()
+        entry = {
+            "file": os.path.basename(avatar_path),
+            "size": len(data),
+            "hash": hashlib.md5(data).hexdigest()
+        }
+        if thumbnails is not None:
+            entry["thumbnails"] = thumbnails
+        return entry
+
+    def _update_manifest(self, user_id, entry):
+        """Sets (or removes, if entry is None) the manifest entry of a user"""
+        def update(data):
+            if entry is None:
+                data.pop(user_id, None)
+            else:
+                data[user_id] = entry
 
-            # Draw the image centered
-            x_offset = (size - scaled_pixmap.width()) // 2
-            y_offset = (size - scaled_pixmap.height()) // 2
-            painter.drawPixmap(x_offset, y_offset, scaled_pixmap)
+        updateJsonFile(self.manifest_file, update, indent=4)
+        # Read the changed manifest on the next lookup
+        self._manifest_checked = 0.0
 
-            painter.end()
-            return rounded_pixmap
+    def _render_avatar(self, avatar_path, user_id, size):
+        """Loads an avatar file and returns it as a rounded pixmap"""
+        # Load the file if it exists
+        if os.path.exists(avatar_path):
+            return QtGui.QPixmap.fromImage(self._render_rounded(QtGui.QImage(avatar_path), size))
         else:
             # Create a default avatar
             return self.create_default_avatar(user_id, size)
 
+    def _render_rounded(self, image, size):
+        """
+        Scales an image into a circle
+
+        Args:
+            image (QImage): The original avatar image
+            size (int): The size of the avatar image (in pixels)
+
+        Returns:
+            QImage: The rounded avatar image
+        """
+        # Create a rounded avatar
+        rounded_image = QtGui.QImage(size, size, QtGui.QImage.Format_ARGB32_Premultiplied)
+        rounded_image.fill(QtCore.Qt.transparent)
+
+        painter = QtGui.QPainter(rounded_image)
+        painter.setRenderHint(QtGui.QPainter.Antialiasing, True)
+        painter.setRenderHint(QtGui.QPainter.SmoothPixmapTransform, True)
+
+        # Create a circular mask
+        path = QtGui.QPainterPath()
+        path.addEllipse(0, 0, size, size)
+        painter.setClipPath(path)
+
+        # Scale and draw the original image
+        scaled_image = image.scaled(size, size, QtCore.Qt.KeepAspectRatio,
+                                    QtCore.Qt.SmoothTransformation)
+
+        # Draw the image centered
+        x_offset = (size - scaled_image.width()) // 2
+        y_offset = (size - scaled_image.height()) // 2
+        painter.drawImage(x_offset, y_offset, scaled_image)
+
+        painter.end()
+        return rounded_image
+
+    def get_thumbnail_path(self, user_id, size):
+        """
+        Returns the path of a pre-rendered avatar thumbnail
+
+        Args:
+            user_id (str): The unique user ID
+            size (int): The size of the thumbnail (in pixels)
+
+        Returns:
+            str: The full path of the thumbnail file
+        """
+        return os.path.join(self.thumbnail_folder, f"{user_id}_{size}_v{self.THUMBNAIL_VERSION}.png")
+
+    def _load_thumbnail(self, user_id, size):
+        """
+        Loads a pre-rendered thumbnail
+
+        Returns:
+            QPixmap: The thumbnail, None if there is none for this size
+        """
+        if size not in self.THUMBNAIL_SIZES:
+            return None
+        pixmap = QtGui.QPixmap(self.get_thumbnail_path(user_id, size))
+        return None if pixmap.isNull() else pixmap
+
+    def _save_thumbnails(self, user_id, image):
+        """Writes pre-rounded thumbnails of an avatar for the standard sizes"""
+        if not os.path.exists(self.thumbnail_folder):
+            os.makedirs(self.thumbnail_folder)
+
+        for size in self.THUMBNAIL_SIZES:
+            thumbnail_path = self.get_thumbnail_path(user_id, size)
+            temp_path = f"{thumbnail_path}.{os.getpid()}.tmp"
+            if not self._render_rounded(image, size).save(temp_path, "PNG"):
+                raise IOError(f"Could not write {thumbnail_path}")
+            replaceFile(temp_path, thumbnail_path)
+
+    def _delete_thumbnails(self, user_id):
+        """Removes the thumbnails of an avatar"""
+        for size in self.THUMBNAIL_SIZES:
+            thumbnail_path = self.get_thumbnail_path(user_id, size)
+            if os.path.exists(thumbnail_path):
+                os.remove(thumbnail_path)
+
     def create_default_avatar(self, user_id, size=50, username=None):
         """
         Creates a default avatar (initials on a colored background)
@@ -108,6 +392,15 @@ class AvatarManager:
         Returns:
             QPixmap: The created default avatar image
         """
+        key = ("default", user_id, size, username)
+        pixmap = self._get_cached(key, None)
+        if pixmap is None:
+            pixmap = self._render_default_avatar(user_id, size, username)
+            self._put_cached(key, None, pixmap)
+        return pixmap
+
+    def _render_default_avatar(self, user_id, size, username):
+        """Paints a default avatar"""
         pixmap = QtGui.QPixmap(size, size)
         pixmap.fill(QtCore.Qt.transparent)
 
@@ -148,6 +441,34 @@ class AvatarManager:
         painter.end()
         return pixmap
 
+    def _get_cached(self, key, version):
+        """Returns a cached pixmap if it was made from the same file version (None otherwise)"""
+        entry = self._cache.get(key)
+        if entry is None or entry[0] != version:
+            return None
+        self._cache.move_to_end(key)
+        return entry[1]
+
+    def _put_cached(self, key, version, pixmap):
+        """Adds a pixmap to the cache, dropping the least recently used ones"""
+        self._cache[key] = (version, pixmap)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def invalidate(self, user_id=None):
+        """
+        Removes cached avatars
+
+        Args:
+            user_id (str, optional): Only remove the avatars of this user
+        """
+        if user_id is None:
+            self._cache.clear()
+            return
+        for key in [key for key in self._cache if key[0] == user_id]:
+            del self._cache[key]
+
     def _get_initials(self, name):
         """
         Extracts initials from a name
@@ -222,8 +543,24 @@ class AvatarManager:
             if pixmap.width() > 150 or pixmap.height() > 150:
                 pixmap = pixmap.scaled(150, 150, QtCore.Qt.KeepAspectRatio, QtCore.Qt.SmoothTransformation)
 
-            # Save as PNG
-            return pixmap.save(avatar_path, "PNG")
+            # Save as PNG to a temporary file and move it into place, so other sessions
+            # never load a partially written avatar
+            temp_path = f"{avatar_path}.{os.getpid()}.tmp"
+            if not pixmap.save(temp_path, "PNG"):
+                return False
+            replaceFile(temp_path, avatar_path)
+
+            # Thumbnails are only listed in the manifest once they are written
+            thumbnails = None
+            try:
+                self._save_thumbnails(user_id, pixmap.toImage())
+                thumbnails = self.THUMBNAIL_VERSION
+            except Exception as e:
+                print(f"Error saving avatar thumbnails: {str(e)}")
+
+            self._update_manifest(user_id, self._manifest_entry(user_id, thumbnails))
+            self.invalidate(user_id)
+            return True
         except Exception as e:
             print(f"Error saving avatar: {str(e)}")
             return False
@@ -242,6 +579,9 @@ class AvatarManager:
             avatar_path = self.get_avatar_path(user_id)
             if os.path.exists(avatar_path):
                 os.remove(avatar_path)
+                self._update_manifest(user_id, None)
+                self._delete_thumbnails(user_id)
+                self.invalidate(user_id)
                 return True
             return False
         except Exception as e:
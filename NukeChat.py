@@ -5,15 +5,23 @@ import datetime
 import time
 import random
 import json
+import uuid
 import nuke
 import hashlib
 import PySide2.QtCore as QtCore
 import PySide2.QtWidgets as QtWidgets
-import PySide2.QtGui as QtGui
 from PySide2.QtGui import QIcon, QPixmap, QPainter, QColor, QBrush, QPen, QFont
 from nukescripts import panels
-from NukeChatClipboardSharing import ScriptBubbleWidget, ClipboardHandler, encodeScriptData, decodeScriptData
+from NukeChatClipboardSharing import ClipboardHandler, encodeScriptData
 from AvatarManager import AvatarManager, AvatarUploadDialog
+from NukeChatStorage import updateJsonFile
+from NukeChatOutbox import Outbox
+from NukeChatWatcher import ChangeWatcher
+from NukeChatScheduler import IOScheduler
+from NukeChatMessageView import MessageListView
+from NukeChatBeacon import Beacon, channelForFolder
+from NukeChatBackend import createBackend, lastSeq
+from NukeChatSearch import SearchQuery
 
 class ToastNotification(QtWidgets.QWidget):
     """Notification window that appears briefly in the bottom right corner of the screen"""
@@ -142,265 +150,55 @@ class ToastNotification(QtWidgets.QWidget):
     def fadeOut(self):
         """Start fade-out animation"""
         self.fade_out_anim.start()
-class MessageWidget(QtWidgets.QWidget):
-    def __init__(self, username, timestamp, message, is_self=False, parent=None, row_index=0):
-        super(MessageWidget, self).__init__(parent)
 
-        # Make row color alternate - dark gray and slightly darker gray
-        if row_index % 2 == 0:
-            bg_color = "#333333"
-        else:
-            bg_color = "#2D2D2D"
-
-        # Set the entire widget background
-        self.setStyleSheet(f"background-color: {bg_color}; color: white;")
-
-        # Expand main layout and make it fill the entire area
-        main_layout = QtWidgets.QHBoxLayout(self)
-        main_layout.setContentsMargins(0, 0, 0, 0)
-        main_layout.setSpacing(0)  # No spacing
-
-        # Content container - expanded to cover the full width
-        container = QtWidgets.QWidget()
-        container.setStyleSheet(f"background-color: {bg_color};")
-        container.setSizePolicy(QtWidgets.QSizePolicy.Expanding, QtWidgets.QSizePolicy.Preferred)
-        container_layout = QtWidgets.QHBoxLayout(container)
-
-        # Our own messages on the right, others on the left
-        if is_self:
-            container_layout.addStretch(1)  # Add empty space to align right
-
-        # Use AvatarManager for avatar
-        avatar_label = QtWidgets.QLabel()
-        avatar_label.setFixedSize(50, 50)
-
-        # Get AvatarManager reference from parent
-        avatar_manager = None
-        if parent and hasattr(parent, 'avatar_manager'):
-            avatar_manager = parent.avatar_manager
-        else:
-            # If can't access directly, try to get from main application
-            main_app = QtWidgets.QApplication.instance()
-            for widget in main_app.topLevelWidgets():
-                if hasattr(widget, 'avatar_manager'):
-                    avatar_manager = widget.avatar_manager
-                    break
-
-        # Try to extract computer name from username
-        user_parts = username.split(' - ')
-        if len(user_parts) > 1 and user_parts[1].startswith('(') and user_parts[1].endswith(')'):
-            # Username format: "Name - (computer_name)"
-            hostname = user_parts[1][1:-1]  # Remove parentheses
-            user_id = hostname  # Use computer name as user ID
-        else:
-            # Plain username - use username directly as user ID
-            user_id = username.replace(" ", "_").lower()  # Replace spaces with underscores
-
-        if avatar_manager:
-            # Load avatar using AvatarManager
-            avatar_pixmap = avatar_manager.load_avatar(user_id, 50)
-        else:
-            # If AvatarManager not found, create default avatar
-            script_dir = os.path.dirname(os.path.abspath(__file__))
-            db_folder = os.path.join(script_dir, "db")
-            avatar_path = os.path.join(db_folder, "avatar.png")
-
-            if os.path.exists(avatar_path):
-                # Load avatar file if it exists
-                avatar_pixmap = QtGui.QPixmap(avatar_path)
-                avatar_pixmap = avatar_pixmap.scaled(50, 50, QtCore.Qt.KeepAspectRatio, QtCore.Qt.SmoothTransformation)
-            else:
-                # Otherwise create default gray circle
-                avatar_pixmap = QtGui.QPixmap(50, 50)
-                avatar_pixmap.fill(QtCore.Qt.transparent)
-
-                painter = QtGui.QPainter(avatar_pixmap)
-                painter.setRenderHint(QtGui.QPainter.Antialiasing)
-                painter.setBrush(QtGui.QBrush(QtGui.QColor("#555555")))
-                painter.setPen(QtCore.Qt.NoPen)
-                painter.drawEllipse(0, 0, 50, 50)
-                painter.end()
-
-        avatar_label.setPixmap(avatar_pixmap)
-
-        # Avatar on the right for our messages, on the left for others
-        if is_self:
-            container_layout.addLayout(self._createMessageLayout(username, timestamp, message, True))
-            container_layout.addWidget(avatar_label)
-        else:
-            container_layout.addWidget(avatar_label)
-            container_layout.addLayout(self._createMessageLayout(username, timestamp, message, False))
 
-        if not is_self:
-            container_layout.addStretch(1)  # Add empty space to align left
+class SearchTask(QtCore.QRunnable):
+    """Runs a search in the backend on a worker thread and streams the results to the panel"""
 
-        # Add container to main layout and make it cover the full width
-        main_layout.addWidget(container, 1)  # 1 = stretch factor
+    def __init__(self, panel, generation, search, user, exclude_user):
+        super(SearchTask, self).__init__()
+        self.panel = panel
+        self.generation = generation
+        self.search = search
+        self.user = user
+        self.exclude_user = exclude_user
 
-    def _createMessageLayout(self, username, timestamp, message, is_self):
-        """Creates message content layout"""
-        message_layout = QtWidgets.QVBoxLayout()
-        message_layout.setSpacing(4)
+    def cancelled(self):
+        """A newer search was started"""
+        return self.generation != self.panel.search_generation
 
-        # Title (Username and timestamp) layout
-        header_layout = QtWidgets.QHBoxLayout()
-
-        # Align right for our messages, left for others
-        if is_self:
-            header_layout.addStretch(1)
-
-        # Username (without bubble)
-        username_label = QtWidgets.QLabel(username.upper())
-        username_label.setStyleSheet("font-weight: bold; color: white;")
-        header_layout.addWidget(username_label)
-
-        # Only get the time information (timestamp: "YYYY-MM-DD HH:MM:SS" format)
-        try:
-            dt_obj = datetime.datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S")
-            time_str = dt_obj.strftime("%H:%M")
-        except:
-            time_str = timestamp.split(" ")[-1] if " " in timestamp else timestamp
-
-        # Bubble for time info
-        time_bubble = QtWidgets.QWidget()
-        time_bubble.setStyleSheet("""
-            background-color: #444444;
-            border-radius: 8px;
-            padding: 2px;
-        """)
-        time_layout = QtWidgets.QHBoxLayout(time_bubble)
-        time_layout.setContentsMargins(8, 2, 8, 2)
-
-        time_label = QtWidgets.QLabel(time_str)
-        time_label.setStyleSheet("color: #aaaaaa; font-size: 10px;")
-        time_layout.addWidget(time_label)
-
-        header_layout.addWidget(time_bubble)
-
-        if not is_self:
-            header_layout.addStretch(1)
-
-        message_layout.addLayout(header_layout)
-
-        # Check message content - normal message, script message, or expression message?
-        if "[SCRIPT_DATA]" in message and "[/SCRIPT_DATA]" in message:
-            # Process script message
-            self._processScriptMessage(message_layout, message, is_self)
-        elif "[EXPRESSION_DATA]" in message and "[/EXPRESSION_DATA]" in message:
-            # Process expression message
-            self._processExpressionMessage(message_layout, message, is_self)
-        else:
-            # Normal text message
-            message_label = QtWidgets.QLabel(message)
-            message_label.setWordWrap(True)
-            message_label.setStyleSheet("color: white;")
-
-            # Align right for our messages, left for others
-            if is_self:
-                message_label.setAlignment(QtCore.Qt.AlignRight)
-            else:
-                message_label.setAlignment(QtCore.Qt.AlignLeft)
-
-            message_layout.addWidget(message_label)
-
-        return message_layout
-
-    def _processScriptMessage(self, message_layout, message, is_self):
-        """Processes and displays script message"""
+    def run(self):
+        if self.cancelled():
+            return
         try:
-            # Extract and decode script data
-            start_tag = "[SCRIPT_DATA]"
-            end_tag = "[/SCRIPT_DATA]"
-            start_idx = message.find(start_tag) + len(start_tag)
-            end_idx = message.find(end_tag)
-
-            if start_idx > -1 and end_idx > -1:
-                encoded_data = message[start_idx:end_idx]
-                script_data = decodeScriptData(encoded_data)
-
-                if script_data:
-                    # Create script bubble widget
-                    script_bubble = ScriptBubbleWidget(script_data, self)
-
-                    # Align right for our messages, left for others
-                    if is_self:
-                        message_layout.addWidget(script_bubble, 0, QtCore.Qt.AlignRight)
-                    else:
-                        message_layout.addWidget(script_bubble, 0, QtCore.Qt.AlignLeft)
-                else:
-                    # Show as normal message if decoding fails
-                    error_label = QtWidgets.QLabel("Could not decode script data!")
-                    error_label.setStyleSheet("color: #FF6666;")
-
-                    if is_self:
-                        error_label.setAlignment(QtCore.Qt.AlignRight)
-                    else:
-                        error_label.setAlignment(QtCore.Qt.AlignLeft)
-
-                    message_layout.addWidget(error_label)
-
-        except Exception as e:
-            # Show as normal message if error occurs
-            error_text = f"Script display error: {str(e)}"
-            error_label = QtWidgets.QLabel(error_text)
-            error_label.setStyleSheet("color: #FF6666;")
-
-            if is_self:
-                error_label.setAlignment(QtCore.Qt.AlignRight)
-            else:
-                error_label.setAlignment(QtCore.Qt.AlignLeft)
-
-            message_layout.addWidget(error_label)
-
-    def _processExpressionMessage(self, message_layout, message, is_self):
-        """Processes and displays expression message"""
-        try:
-            # Extract and decode expression data
-            start_tag = "[EXPRESSION_DATA]"
-            end_tag = "[/EXPRESSION_DATA]"
-            start_idx = message.find(start_tag) + len(start_tag)
-            end_idx = message.find(end_tag)
-
-            if start_idx > -1 and end_idx > -1:
-                encoded_data = message[start_idx:end_idx]
-                expression_data = decodeExpressionData(encoded_data)
-
-                if expression_data:
-                    # Create expression bubble widget
-                    from ExpressionHandler import ExpressionBubbleWidget
-                    expression_bubble = ExpressionBubbleWidget(expression_data, self)
-
-                    # Align right for our messages, left for others
-                    if is_self:
-                        message_layout.addWidget(expression_bubble, 0, QtCore.Qt.AlignRight)
-                    else:
-                        message_layout.addWidget(expression_bubble, 0, QtCore.Qt.AlignLeft)
-                else:
-                    # Show as normal message if decoding fails
-                    error_label = QtWidgets.QLabel("Could not decode expression data!")
-                    error_label.setStyleSheet("color: #FF6666;")
-
-                    if is_self:
-                        error_label.setAlignment(QtCore.Qt.AlignRight)
-                    else:
-                        error_label.setAlignment(QtCore.Qt.AlignLeft)
-
-                    message_layout.addWidget(error_label)
-
+            batches = self.panel.backend.queryMessageBatches(self.search, self.user, self.exclude_user)
+            if batches is None:
+                # Not supported by the backend, the loaded messages are filtered instead
+                self.panel.searchResults.emit(self.generation, None, True)
+                return
+            for batch in batches:
+                if self.cancelled():
+                    return
+                self.panel.searchResults.emit(self.generation, batch, False)
+            self.panel.searchResults.emit(self.generation, [], True)
         except Exception as e:
-            # Show as normal message if error occurs
-            error_text = f"Expression display error: {str(e)}"
-            error_label = QtWidgets.QLabel(error_text)
-            error_label.setStyleSheet("color: #FF6666;")
+            print(f"Search error: {str(e)}")
+            self.panel.searchResults.emit(self.generation, None, True)
 
-            if is_self:
-                error_label.setAlignment(QtCore.Qt.AlignRight)
-            else:
-                error_label.setAlignment(QtCore.Qt.AlignLeft)
-
-            message_layout.addWidget(error_label)
 
 class NukeChat(QtWidgets.QWidget):
+    # Number of messages loaded at startup and per "load older" step
+    HISTORY_PAGE_SIZE = 100
+
+    # Packets from the LAN beacon, emitted on the beacon thread and handled on the GUI thread
+    beaconReceived = QtCore.Signal(object)
+    # Events pushed by the backend (relay server), emitted on the backend thread
+    backendEvent = QtCore.Signal(object)
+    # Search results (generation, batch of messages, finished), emitted on the search thread
+    searchResults = QtCore.Signal(int, object, bool)
+    # Milliseconds after the last keystroke before searching
+    SEARCH_DELAY = 300
+
     def __init__(self, parent=None):
         QtWidgets.QWidget.__init__(self, parent)
 
@@ -411,9 +209,6 @@ class NukeChat(QtWidgets.QWidget):
         # Create object for avatar management (after network_folder is defined)
         self.avatar_manager = AvatarManager(self.network_folder)
 
-        self.onlineUsersTimer = QtCore.QTimer()
-        self.onlineUsersTimer.timeout.connect(self.updateOnlineUsers)
-
 
         # Create "db" folder if it doesn't exist
         if not os.path.exists(self.network_folder):
@@ -426,20 +221,18 @@ class NukeChat(QtWidgets.QWidget):
                 self.network_folder = os.path.dirname(os.path.abspath(__file__))
                 print(f"Using alternative location: {self.network_folder}")
 
-        # Path for message data
-        self.chat_file = os.path.join(self.network_folder, "nukechat_messages.json")
+        # The pages of messages read so far
+        self.messages = []
+        # History cursor of the oldest loaded message (its meaning depends on the backend)
+        self.history_start = 0
+        self.history_complete = True
+        # Sequence number of the newest message read, and of the newest one the user has seen
+        self.last_seq = 0
+        self.read_seq = 0
         # Path for user settings
         self.settings_file = os.path.join(self.network_folder, "nukechat_settings.json")
-        self.notifications_file = os.path.join(self.network_folder, "notifications.json")
-        # Path for presence file
-        self.presence_file = os.path.join(self.network_folder, "presence.json")
 
         self.config_file = None
-        # Print file location to screen
-        print("NukeChat JSON file will be saved to:", self.chat_file)
-
-        # To track last update time
-        self.last_update_time = 0
 
         # Unique user ID (machine name + random ID)
         self.user_id = f"{socket.gethostname()}_{random.randint(1000, 9999)}"
@@ -448,6 +241,15 @@ class NukeChat(QtWidgets.QWidget):
         self.custom_username = ""
         self.loadSettings()
 
+        # Storage/transport backend (NUKECHAT_BACKEND=files|sqlite|relay): the journal and
+        # JSON files in the "db" folder by default. Events pushed by the relay are handled
+        # on the GUI thread.
+        self.backendEvent.connect(self.onBackendEvent)
+        self.backend = createBackend(self.network_folder, self.user_id, self.getCurrentUser,
+                                     self.backendEvent.emit, self.HISTORY_PAGE_SIZE)
+        # Print storage location to screen
+        print(f"NukeChat backend: {self.backend.name}, data is saved to: {self.network_folder}")
+
         # Main layout
         self.setLayout(QtWidgets.QVBoxLayout())
         self.layout().setContentsMargins(0, 0, 0, 0)
@@ -579,13 +381,12 @@ class NukeChat(QtWidgets.QWidget):
         self.tabWidget.currentChanged.connect(self.tabChanged)
         self.statusLabel = QtWidgets.QLabel("Ready")
         # Area where messages will be displayed - change background to original
-        self.scrollArea = QtWidgets.QScrollArea()
-        self.scrollArea.setWidgetResizable(True)
-        self.scrollArea.setHorizontalScrollBarPolicy(QtCore.Qt.ScrollBarAlwaysOff)
-        self.scrollArea.setStyleSheet("""
-            QScrollArea {
+        self.messageView = MessageListView(self.avatar_manager)
+        self.messageView.setStyleSheet("""
+            QListView {
                 background-color: #282828;
                 border: none;
+                color: white;
             }
             QScrollBar:vertical {
                 background: #333333;
@@ -601,18 +402,8 @@ class NukeChat(QtWidgets.QWidget):
                 background: none;
             }
         """)
-
-        self.messagesContainer = QtWidgets.QWidget()
-        # Make the messages container background darker gray
-        self.messagesContainer.setStyleSheet("background-color: #282828;")
-        self.messagesLayout = QtWidgets.QVBoxLayout(self.messagesContainer)
-        self.messagesLayout.setContentsMargins(0, 0, 0, 0)
-        self.messagesLayout.setSpacing(0)
-        # Add stretch to show messages from bottom to top
-        self.messagesLayout.addStretch(1)
-
-        self.scrollArea.setWidget(self.messagesContainer)
-        self.messagesTabLayout.addWidget(self.scrollArea)
+        self.messageModel = self.messageView.message_model
+        self.messagesTabLayout.addWidget(self.messageView)
 
         # Settings tab
         self.settingsTab = QtWidgets.QWidget()
@@ -702,7 +493,8 @@ class NukeChat(QtWidgets.QWidget):
         # Load current avatar
         self.updateAvatarPreview()
 
-        self.settingsTabLayout.addStretch(1)  # Leave space at the bottom
+        # Online users, the section leaves the space at the bottom
+        self.settingsTabLayout.addWidget(self.createOnlineUsersSection(), 1)
 
         # Add tabs
         self.tabWidget.addTab(self.messagesTab, "Messages")
@@ -806,27 +598,97 @@ class NukeChat(QtWidgets.QWidget):
         self.searchInput.returnPressed.connect(self.searchMessages)
         self.filterCombo.currentIndexChanged.connect(self.filterMessages)
 
+        # Search as you type: the query runs once typing pauses, on a worker thread.
+        # A newer query cancels the running one, results are shown batch by batch.
+        self.searchTimer = QtCore.QTimer(self)
+        self.searchTimer.setSingleShot(True)
+        self.searchTimer.setInterval(self.SEARCH_DELAY)
+        self.searchTimer.timeout.connect(self.searchMessages)
+        self.searchInput.textChanged.connect(self.searchTimer.start)
+        self.searchResults.connect(self.onSearchResults)
+        self.search_pool = QtCore.QThreadPool(self)
+        self.search_pool.setMaxThreadCount(1)
+
         # Enter key to send - special key handler needed for QTextEdit
         self.messageInput.installEventFilter(self)
 
-        # Timer setup - regularly updates messages
-        self.updateTimer = QtCore.QTimer()
-        self.updateTimer.timeout.connect(self.checkForUpdates)
-        self.updateTimer.start(1000)  # Update every 1 second
-        self.notificationTimer = QtCore.QTimer()
-        self.notificationTimer.timeout.connect(self.checkNotifications)
-        self.notificationTimer.start(3000)  # Check notifications every 3 seconds
-        # Second timer - for presence updates
-        self.presenceTimer = QtCore.QTimer()
-        self.presenceTimer.timeout.connect(self.updatePresence)
-        self.presenceTimer.start(5000)  # Report our presence every 5 seconds
-
-        # Report our presence at startup
-        self.updatePresence()
-
-        # Load existing messages at startup
+        # One scheduler runs all periodic jobs: their file I/O is batched into a single tick
+        # on a background thread, results are applied on the GUI thread.
+        # Timing per job: print(self.scheduler.report())
+        self.scheduler = IOScheduler(self)
+
+        # Watch the backend's file for new messages - file system events on local disks,
+        # adaptive polling on network mounts. Backends that push updates have no file.
+        self.chatWatcher = None
+        watched_file = self.backend.watchedFile()
+        if watched_file is not None:
+            self.chatWatcher = ChangeWatcher(watched_file, self, scheduler=self.scheduler)
+            self.chatWatcher.changed.connect(self.checkForUpdates)
+
+        # Messages are read when the watcher reports a change, the interval is only a safety net
+        self.scheduler.addJob("messages", 60000, io=self.fetchNewMessages, apply=self.applyNewMessages)
+        # Report our presence every 5 seconds, then refresh the online users with one folder scan
+        self.scheduler.addJob("presence", 5000, io=self.updatePresence, apply=self.checkBeaconHealth)
+        self.scheduler.addJob("onlineUsers", 5000, io=self.fetchOnlineUsers, apply=self.updateOnlineUsers)
+        # The online users are only read while the Settings tab is shown
+        self.scheduler.setJobEnabled("onlineUsers", self.tabWidget.currentIndex() == 1)
+        # Check notifications every 3 seconds
+        self.scheduler.addJob("notifications", 3000, io=self.fetchNotifications, apply=self.displayNotifications)
+        # Older history pages, only run when the message view is scrolled to the top
+        self.scheduler.addJob("history", None, io=self.fetchOlderMessages, apply=self.applyOlderMessages)
+        self.messageView.verticalScrollBar().valueChanged.connect(self.onMessagesScrolled)
+
+        if self.backend.pushes_updates:
+            # Messages, online users and notifications are pushed, nothing is polled
+            for job in ("messages", "presence", "notifications"):
+                self.scheduler.setJobEnabled(job, False)
+
+        # Optional LAN beacons (NUKECHAT_BEACON=1): new-message hints and presence over UDP
+        # multicast. The shared folder is still polled as fallback if UDP is blocked.
+        self.beacon = None
+        self.beacon_peers = {}
+        if os.environ.get("NUKECHAT_BEACON", "").lower() in ("1", "true", "yes"):
+            self.beaconReceived.connect(self.onBeaconPacket)
+            beacon = Beacon(channelForFolder(self.network_folder), self.beaconReceived.emit)
+            if beacon.start():
+                self.beacon = beacon
+
+        # Search and filter variables
+        self.current_search = ""
+        self.current_filter = 0  # 0: All, 1: Mine, 2: Others
+        # Query of the active search (None: all messages are shown), the results found by
+        # the backend so far (None: the loaded messages are filtered), and the number of
+        # the latest search (older searches are cancelled)
+        self.search_query = None
+        self.search_results = None
+        self.search_generation = 0
+        self.search_received = False
+
+        # Outbox: messages are written by a background thread and shown as pending until
+        # confirmed. The outbox file is local so queued messages survive a crash.
+        self.pending_messages = {}
+        outbox_file = os.path.join(os.path.expanduser("~"), ".nuke", "NukeChat",
+                                   f"outbox_{socket.gethostname()}.json")
+        self.outbox = Outbox(outbox_file, self.deliverMessage, self)
+        self.outbox.messageSent.connect(self.onMessageSent)
+        self.outbox.messageFailed.connect(self.onMessageFailed)
+
+        # Load the most recent page of messages at startup, older pages are loaded on demand
+        self.loadRecentMessages()
         self.loadMessages()
 
+        # Resend messages left in the outbox by a session that crashed, then keep checking
+        # for sessions that stop while this one runs
+        self.replayOutbox()
+        self.scheduler.addJob("outbox", 60000, io=self.fetchAbandonedOutbox, apply=self.replayOutbox)
+
+        # Stop the background work when the panel goes away. Nuke deletes a closed panel
+        # without sending a closeEvent, so the destroyed signal and Nuke quitting are used too.
+        self.is_shut_down = False
+        self._shutdown_handler = lambda *args, shutdown=self.shutdown: shutdown()
+        self.destroyed.connect(self._shutdown_handler)
+        QtWidgets.QApplication.instance().aboutToQuit.connect(self._shutdown_handler)
+
         # General style
         self.setStyleSheet("""
                     QWidget {
@@ -834,10 +696,6 @@ class NukeChat(QtWidgets.QWidget):
                     }
                 """)
 
-        # Search and filter variables
-        self.current_search = ""
-        self.current_filter = 0  # 0: All, 1: Mine, 2: Others
-
         self.clipboard_handler = ClipboardHandler(self)
         # Add paste button (next to message input area)
         self.pasteScriptButton = QtWidgets.QPushButton()
@@ -862,16 +720,13 @@ class NukeChat(QtWidgets.QWidget):
         self.pasteScriptButton.setText("")  # Remove text, just show the icon
         self.notificationLayout.insertWidget(self.notificationLayout.count() - 1, self.pasteScriptButton)
 
-        # Timer for regular clipboard checking
-        self.clipboardCheckTimer = QtCore.QTimer(self)
-        self.clipboardCheckTimer.timeout.connect(self.checkClipboardForScript)
-        self.clipboardCheckTimer.start(1000)  # Check every second
+        # The clipboard is classified when its content changes instead of being polled
+        self.has_script_in_clipboard = False
+        self.clipboard_handler.scriptAvailabilityChanged.connect(self.checkClipboardForScript)
+        self.checkClipboardForScript(self.clipboard_handler.checkClipboard())
 
         self.sendButton.clicked.connect(self.handleSendAction)
 
-        self.loadOnlineUsers()
-        self.onlineUsersTimer.start(5000)
-
     def showAvatarDialog(self):
         """Shows avatar upload dialog"""
         hostname = socket.gethostname()
@@ -886,10 +741,10 @@ class NukeChat(QtWidgets.QWidget):
         pixmap = self.avatar_manager.load_avatar(hostname, 70)
         self.avatar_preview.setPixmap(pixmap)
 
-    def checkClipboardForScript(self):
-        """Checks if clipboard contains a Nuke script"""
-        # Check clipboard content and store result in a class variable
-        self.has_script_in_clipboard = self.clipboard_handler.checkClipboard()
+    def checkClipboardForScript(self, has_script):
+        """Shows whether the clipboard contains a Nuke script (called when the clipboard changed)"""
+        # Store result in a class variable
+        self.has_script_in_clipboard = has_script
 
         # If there's a Nuke script in the clipboard
         if self.has_script_in_clipboard:
@@ -998,10 +853,10 @@ class NukeChat(QtWidgets.QWidget):
                 # Send script message with special format
                 script_message = f"[SCRIPT_DATA]{encoded_data}[/SCRIPT_DATA]"
 
-                # Save and send message (use normal message sending function)
-                if self.saveMessage(script_message):
-                    # Update and display messages
-                    self.loadMessages()
+                # Queue message (use normal message sending function)
+                if self.queueMessage(script_message):
+                    # Display the pending message right away
+                    self.loadMessages(scroll_to_bottom=True)
 
                     # Update status bar
                     description = script_data.get("description", "")
@@ -1018,95 +873,118 @@ class NukeChat(QtWidgets.QWidget):
         except Exception as e:
             self.updateStatus(f"Error sending script message: {str(e)}")
 
-    def updateOnlineUsers(self):
-        """Updates online user list"""
-        # First clear current online users widget
-        while self.settingsTabLayout.count() > 2:  # Keep first two widgets
-            item = self.settingsTabLayout.takeAt(2)
-            if item.widget():
-                item.widget().deleteLater()
+    def updateOnlineUsers(self, online_users):
+        """Updates online user list, only the rows of users who joined or left are changed"""
+        if not self.settingsTab.isVisible():
+            # Nothing to update while the list can't be seen
+            return
 
-        # Reload online users
-        self.loadOnlineUsers()
+        # Stable order, each session gets its own row (same user may have several Nukes open)
+        keys = []
+        counts = {}
+        for user in sorted(online_users, key=lambda name: name.lower()):
+            counts[user] = counts.get(user, 0) + 1
+            keys.append((user, counts[user]))
+
+        if keys == self.online_user_keys:
+            return
 
-    def loadOnlineUsers(self):
-        """Loads and displays online users"""
         try:
-            # Area for online users
-            online_users_container = QtWidgets.QWidget()
-            online_users_layout = QtWidgets.QVBoxLayout(online_users_container)
-            online_users_layout.setContentsMargins(0, 0, 0, 0)
-            online_users_layout.setSpacing(10)
-
-            # Online users title
-            online_title = QtWidgets.QLabel("Currently Online")
-            online_title.setStyleSheet("""
-                        font-size: 16px;
+            # Remove users who left
+            new_keys = set(keys)
+            for key in [key for key in self.online_user_rows if key not in new_keys]:
+                row = self.online_user_rows.pop(key)
+                self.onlineUsersLayout.removeWidget(row)
+                row.deleteLater()
+
+            # Add users who joined, at their sorted position
+            for position, key in enumerate(keys):
+                if key not in self.online_user_rows:
+                    row = self.createOnlineUserRow(key[0])
+                    self.online_user_rows[key] = row
+                    self.onlineUsersLayout.insertWidget(position, row)
+
+            self.online_user_keys = keys
+            self.noUsersLabel.setVisible(not keys)
+        except Exception as e:
+            print(f"Error loading online users: {str(e)}")
+
+    def fetchOnlineUsers(self, context=None):
+        """Reads the names of the users active in the last 30 seconds (scheduler thread)"""
+        active_users = self.backend.activeUsers()
+
+        # Sessions only heard through the LAN beacon
+        current_time = time.time()
+        for uid, (user, last_seen) in list(self.beacon_peers.items()):
+            if uid not in active_users and current_time - last_seen < 30:
+                active_users[uid] = {"user": user, "last_seen": last_seen}
+
+        return [data["user"] for data in active_users.values()]
+
+    def createOnlineUsersSection(self):
+        """Creates the "Currently Online" section, its rows are added by updateOnlineUsers"""
+        # Area for online users
+        online_users_container = QtWidgets.QWidget()
+        online_users_layout = QtWidgets.QVBoxLayout(online_users_container)
+        online_users_layout.setContentsMargins(0, 0, 0, 0)
+        online_users_layout.setSpacing(10)
+
+        # Online users title
+        online_title = QtWidgets.QLabel("Currently Online")
+        online_title.setStyleSheet("""
+                    font-size: 16px;
+                    font-weight: bold;
+                    color: white;
+                    margin-bottom: 10px;
+                """)
+        online_users_layout.addWidget(online_title)
+
+        # Rows of the online users
+        self.onlineUsersLayout = QtWidgets.QVBoxLayout()
+        self.onlineUsersLayout.setSpacing(10)
+        online_users_layout.addLayout(self.onlineUsersLayout)
+        # Displayed rows: (user, session number) -> row widget
+        self.online_user_rows = {}
+        self.online_user_keys = None
+
+        # If no one is online
+        self.noUsersLabel = QtWidgets.QLabel("No users currently online")
+        self.noUsersLabel.setStyleSheet("""
+                    color: #888888;
+                    font-style: italic;
+                    padding: 10px;
+                """)
+        online_users_layout.addWidget(self.noUsersLabel)
+
+        online_users_layout.addStretch(1)
+        return online_users_container
+
+    def createOnlineUserRow(self, user):
+        """Creates the row of an online user"""
+        user_widget = QtWidgets.QWidget()
+        user_layout = QtWidgets.QHBoxLayout(user_widget)
+        user_layout.setContentsMargins(10, 5, 10, 5)
+        user_layout.setSpacing(10)
+
+        # Online user icon - colored circle with HTML
+        online_icon = QtWidgets.QLabel("•")
+        online_icon.setStyleSheet("""
+                        color: #00CC00;
+                        font-size: 24px;
                         font-weight: bold;
-                        color: white;
-                        margin-bottom: 10px;
                     """)
-            online_users_layout.addWidget(online_title)
-
-            # Read online users from presence file
-            online_users = []
-            current_time = time.time()
-            if os.path.exists(self.presence_file):
-                try:
-                    with open(self.presence_file, 'r', encoding='utf-8') as file:
-                        presence_data = json.load(file)
-
-                        # Find users active in last 30 seconds
-                        for uid, data in presence_data.items():
-                            if current_time - data["last_seen"] < 30:  # Active within 30 seconds
-                                online_users.append(data["user"])
-                except Exception as e:
-                    print(f"Error reading online users: {str(e)}")
-
-            if online_users:
-                # List online users
-                for user in online_users:
-                    user_widget = QtWidgets.QWidget()
-                    user_layout = QtWidgets.QHBoxLayout(user_widget)
-                    user_layout.setContentsMargins(10, 5, 10, 5)
-                    user_layout.setSpacing(10)
-
-                    # Online user icon - colored circle with HTML
-                    online_icon = QtWidgets.QLabel("•")
-                    online_icon.setStyleSheet("""
-                                    color: #00CC00;
-                                    font-size: 24px;
-                                    font-weight: bold;
-                                """)
-                    user_layout.addWidget(online_icon)
-
-                    # Username
-                    user_label = QtWidgets.QLabel(user)
-                    user_label.setStyleSheet("""
-                                color: white;
-                                font-size: 14px;
-                            """)
-                    user_layout.addWidget(user_label)
-
-                    user_layout.addStretch(1)
-                    online_users_layout.addWidget(user_widget)
-            else:
-                # If no one is online
-                no_users_label = QtWidgets.QLabel("No users currently online")
-                no_users_label.setStyleSheet("""
-                            color: #888888;
-                            font-style: italic;
-                            padding: 10px;
-                        """)
-                online_users_layout.addWidget(no_users_label)
+        user_layout.addWidget(online_icon)
 
-            online_users_layout.addStretch(1)
+        # Username
+        user_label = QtWidgets.QLabel(user)
+        user_label.setStyleSheet("""
+                    color: white;
+                    font-size: 14px;
+                """)
+        user_layout.addWidget(user_label)
 
-            # Add to existing settingsTabLayout
-            self.settingsTabLayout.addWidget(online_users_container)
-
-        except Exception as e:
-            print(f"Error loading online users: {str(e)}")
+        user_layout.addStretch(1)
+        return user_widget
 
     def eventFilter(self, obj, event):
         """Event filter to enable sending with Enter key in QTextEdit"""
@@ -1121,6 +999,43 @@ class NukeChat(QtWidgets.QWidget):
                 return True
         return super(NukeChat, self).eventFilter(obj, event)
 
+    def closeEvent(self, event):
+        """Releases the backend when the panel is closed as a window"""
+        self.shutdown()
+        super(NukeChat, self).closeEvent(event)
+
+    def shutdown(self):
+        """
+        Stops the scheduler, the beacon, the outbox thread and running searches and closes
+        the backend
+
+        Only Python objects are touched, so this also works while Qt deletes the widget.
+        """
+        if self.is_shut_down:
+            return
+        self.is_shut_down = True
+
+        # A running search stops before its next batch
+        self.search_generation += 1
+        self.scheduler.stop()
+
+        # Stop announcing this session on the LAN
+        if self.beacon is not None:
+            self.beacon.close()
+            self.beacon = None
+
+        # Leaves the online users, saves the search index, disconnects from the relay
+        for close in (self.outbox.close, self.backend.close):
+            try:
+                close()
+            except Exception as e:
+                print(f"Error closing NukeChat: {str(e)}")
+
+        try:
+            QtWidgets.QApplication.instance().aboutToQuit.disconnect(self._shutdown_handler)
+        except (RuntimeError, TypeError):
+            pass
+
     def loadSettings(self):
         """Load settings"""
         try:
@@ -1155,24 +1070,17 @@ class NukeChat(QtWidgets.QWidget):
             # Get entered username
             self.custom_username = self.usernameInput.text().strip()
 
-            # Load or create new config.json file
-            config = {}
-            if os.path.exists(self.config_file):
-                try:
-                    with open(self.config_file, 'r', encoding='utf-8') as file:
-                        config = json.load(file)
-                except:
-                    # Create new if file is corrupted
-                    config = {}
-
             # Save username for computer name
             hostname = socket.gethostname()
-            config[hostname] = self.custom_username
 
-            # Save to config.json
-            with open(self.config_file, 'w', encoding='utf-8') as file:
-                json.dump(config, file, ensure_ascii=False, indent=4)
+            def update(config):
+                config[hostname] = self.custom_username
+
+            # Update config.json (locked, a corrupted file is recreated)
+            updateJsonFile(self.config_file, update, indent=4)
 
+            # Backends that push presence show the new name to the other sessions right away
+            self.backend.userChanged()
             self.updateStatus("Username saved")
             self.updateAvatarPreview()
         except Exception as e:
@@ -1191,79 +1099,125 @@ class NukeChat(QtWidgets.QWidget):
         # Return to "Ready" message after 3 seconds (for important messages)
         QtCore.QTimer.singleShot(3000, lambda: self.statusLabel.setText("Ready"))
 
-    def updatePresence(self):
-        """Updates presence information"""
+    def updatePresence(self, context=None):
+        """Updates presence information (scheduler thread)"""
         try:
-            # Load current presence data
-            presence_data = {}
-            if os.path.exists(self.presence_file):
-                try:
-                    with open(self.presence_file, 'r', encoding='utf-8') as file:
-                        presence_data = json.load(file)
-                except:
-                    # File might be locked or corrupted, create new file
-                    presence_data = {}
-
-            # Add/update our presence
-            current_time = time.time()
-            presence_data[self.user_id] = {
-                "user": self.getCurrentUser(),
-                "last_seen": current_time
-            }
-
-            # Clean up old records (not active in last 30 seconds)
-            active_users = {}
-            for uid, data in presence_data.items():
-                if current_time - data["last_seen"] < 30:  # Remove ones older than 30 seconds
-                    active_users[uid] = data
+            if self.beacon is not None:
+                self.beacon.sendPresence(self.user_id, self.getCurrentUser())
 
-            # Save to file
-            with open(self.presence_file, 'w', encoding='utf-8') as file:
-                json.dump(active_users, file, ensure_ascii=False)
+            self.backend.heartbeat()
 
         except Exception as e:
-            self.updateStatus(f"Presence Error: {str(e)}")
+            print(f"Presence Error: {str(e)}")
+
+    def fetchNewMessages(self, context=None):
+        """Reads the messages added since the last read (scheduler thread, I/O only)"""
+        return self.backend.readSince()
+
+    def mergeNewMessages(self, result):
+        """Adds fetched messages to self.messages and returns the new ones"""
+        new_messages, reset, start = result
+        if reset:
+            # History was replaced, the backend started over with its last page
+            self.messages = new_messages
+            self.history_start = start
+            self.history_complete = start == 0
+            self.last_seq = lastSeq(new_messages)
+        else:
+            # Skip messages that were already read (e.g. the same message pushed twice)
+            new_messages = [msg for msg in new_messages
+                            if not isinstance(msg.get("seq"), int) or msg["seq"] > self.last_seq]
+            self.messages.extend(new_messages)
+            self.last_seq = lastSeq(new_messages, self.last_seq)
+
+        # Our pending messages are confirmed once they show up in the store
+        for msg in new_messages:
+            self.pending_messages.pop(msg.get("id"), None)
+
+        return [] if reset else new_messages
+
+    def loadRecentMessages(self):
+        """Reads the most recent page of messages synchronously (only at startup)"""
+        result = self.backend.readLatest()
+        if result is None:
+            # Pushed by the backend once connected
+            return
+        self.messages, self.history_start, self.history_complete = result
+        self.last_seq = self.read_seq = lastSeq(self.messages)
+
+    def onMessagesScrolled(self, value):
+        """Loads the previous page of history when the message view reaches the top"""
+        scroll_bar = self.messageView.verticalScrollBar()
+        if value > scroll_bar.minimum() or scroll_bar.maximum() == scroll_bar.minimum():
+            return
+        if self.history_complete or self.current_search or self.current_filter:
+            # Search and filter results already cover the whole history
+            return
+        self.scheduler.trigger("history")
+
+    def fetchOlderMessages(self, context=None):
+        """Reads the page of messages before the oldest loaded one (scheduler thread, I/O only)"""
+        start = self.history_start
+        result = self.backend.readPage(start)
+        if result is None:
+            # Answered by a "history" event
+            return None
+        messages, new_start, complete = result
+        return start, messages, new_start, complete
+
+    def applyOlderMessages(self, result):
+        """Inserts an older page above the displayed messages, keeping the scroll position"""
+        if result is None:
+            return
+        start, messages, new_start, complete = result
+        if start != self.history_start or self.history_complete:
+            # History was reloaded while the page was being read
+            return
+
+        self.messages[0:0] = messages
+        self.history_start = new_start
+        self.history_complete = complete
+
+        anchor = self.messageView.scrollAnchor()
+        self.loadMessages()
+        self.messageView.restoreScrollAnchor(anchor)
+        if messages:
+            self.updateStatus(f"Loaded {len(messages)} older messages")
 
     def checkForUpdates(self):
-        """Checks file for new messages"""
-        try:
-            if not os.path.exists(self.chat_file):
-                # Create empty JSON if file doesn't exist
-                with open(self.chat_file, 'w', encoding='utf-8') as file:
-                    json.dump([], file)
-                self.last_update_time = time.time()
-                return
-
-            # Check file last modification time
-            file_mod_time = os.path.getmtime(self.chat_file)
-
-            if file_mod_time > self.last_update_time:
-                # Save current message count
-                old_message_count = 0
-                if os.path.exists(self.chat_file):
-                    try:
-                        with open(self.chat_file, 'r', encoding='utf-8') as file:
-                            old_message_count = len(json.load(file))
-                    except:
-                        old_message_count = 0
+        """Checks the journal for new messages on the next scheduler tick"""
+        self.scheduler.trigger("messages")
 
-                # Load messages
+    def applyNewMessages(self, result):
+        """Displays the messages fetched by the scheduler"""
+        try:
+            reset = result[1]
+            new_messages = self.mergeNewMessages(result)
+
+            if new_messages or reset:
+                # Poll at the shortest interval again while the chat is active
+                if self.chatWatcher is not None:
+                    self.chatWatcher.notifyActivity()
+
+                if reset and self.search_query is not None:
+                    # History was replaced, search it again
+                    self.startSearch()
+                elif self.search_results is not None:
+                    # New messages matching the active search (the search may have found them
+                    # already if they were stored before it ran)
+                    found = {msg["id"] for msg in self.search_results if msg.get("id")}
+                    self.search_results.extend(msg for msg in new_messages
+                                               if msg.get("id") not in found and self.search_query.matches(msg))
+
+                # Display messages
                 self.loadMessages()
 
-                # Check new message count
-                new_message_count = 0
-                if os.path.exists(self.chat_file):
-                    try:
-                        with open(self.chat_file, 'r', encoding='utf-8') as file:
-                            new_message_count = len(json.load(file))
-                    except:
-                        new_message_count = 0
-
-                # Show notification if there are new messages
-                if new_message_count > old_message_count:
-                    self.showNotification(new_message_count - old_message_count)
+                # Show notification if there are new messages from other users
+                current_user = self.getCurrentUser()
+                new_message_count = len([msg for msg in new_messages if msg.get('user') != current_user])
+                if new_message_count > 0:
+                    self.showNotification(new_message_count)
 
-                self.last_update_time = file_mod_time
                 self.updateStatus("Messages Updated")
         except Exception as e:
             self.updateStatus(f"Update Error: {str(e)}")
@@ -1292,6 +1246,8 @@ class NukeChat(QtWidgets.QWidget):
 
     def resetNotification(self):
         """Resets notification indicator"""
+        # Everything read so far counts as seen
+        self.read_seq = self.last_seq
         self.tabWidget.setTabText(0, "Messages")
         self.statusLabel.setStyleSheet("color: rgba(170, 170, 170, 1); font-size: 14px;")
         self.statusLabel.setText("Ready")
@@ -1301,44 +1257,36 @@ class NukeChat(QtWidgets.QWidget):
         if index == 0:  # Reset notification when Messages tab is selected
             self.resetNotification()
 
-    def loadMessages(self):
-        """Loads messages from JSON file and displays them"""
+        # Online users are only read while the Settings tab is shown
+        # (tabs are added before the scheduler exists)
+        if getattr(self, "scheduler", None) is not None:
+            self.scheduler.setJobEnabled("onlineUsers", index == 1)
+            if index == 1:
+                self.scheduler.trigger("onlineUsers")
+
+    def loadMessages(self, scroll_to_bottom=False):
+        """
+        Displays the messages read from the journal
+
+        Only the difference to the displayed messages is applied to the view. The view
+        follows new messages if it was already at the bottom or scroll_to_bottom is set.
+        """
         try:
-            if os.path.exists(self.chat_file):
-                with open(self.chat_file, 'r', encoding='utf-8') as file:
-                    messages = json.load(file)
+            follow = scroll_to_bottom or self.messageView.isAtBottom()
 
-                # Apply search and filter
-                filtered_messages = self.applySearchAndFilter(messages)
+            # Apply search and filter
+            filtered_messages = self.applySearchAndFilter(self.messages)
 
-                # First clear current messages (except stretch)
-                while self.messagesLayout.count() > 1:
-                    item = self.messagesLayout.takeAt(0)
-                    if item.widget():
-                        item.widget().deleteLater()
+            # Our own messages that are still being sent
+            if self.pending_messages and not self.current_search and self.current_filter != 2:
+                filtered_messages = filtered_messages + list(self.pending_messages.values())
 
-                # Our own username
-                current_user = self.getCurrentUser()
+            # Rows are painted by the view's delegate, no widget per message
+            self.messageView.message_delegate.clearAvatarCache()
+            reset = self.messageModel.updateMessages(filtered_messages, self.getCurrentUser())
 
-                # Add new message widgets
-                for idx, msg in enumerate(filtered_messages):
-                    # Check if message belongs to us
-                    is_self = msg['user'] == current_user
-
-                    # Create message widget and pass self (NukeChat) as parent
-                    message_widget = MessageWidget(
-                        msg['user'],
-                        msg['timestamp'],
-                        msg['message'],
-                        is_self=is_self,
-                        parent=self,  # Passing self (NukeChat) here
-                        row_index=idx
-                    )
-
-                    # Add message at bottom (above stretch)
-                    self.messagesLayout.insertWidget(self.messagesLayout.count() - 1, message_widget)
-
-                # Scroll to bottom
+            # Scroll to bottom
+            if follow or reset:
                 self.scrollToBottom()
 
             self.updateStatus("Ready")
@@ -1347,177 +1295,248 @@ class NukeChat(QtWidgets.QWidget):
 
     def applySearchAndFilter(self, messages):
         """Applies search and filter criteria"""
-        filtered_messages = []
-        current_user = self.getCurrentUser()
-
-        for msg in messages:
-            # Apply filter
-            if self.current_filter == 1 and msg['user'] != current_user:  # Only my messages
-                continue
-            if self.current_filter == 2 and msg['user'] == current_user:  # Only other messages
-                continue
-
-            # Apply search
-            if self.current_search and self.current_search.lower() not in msg['message'].lower():
-                continue
+        if self.search_results is not None:
+            # Found by the backend (whole history)
+            return self.search_results
+        if self.search_query is None:
+            return messages
+        return [msg for msg in messages if self.search_query.matches(msg)]
+
+    def startSearch(self):
+        """Starts searching for the current search text and filter on the worker thread"""
+        self.search_generation += 1
+        if not (self.current_search or self.current_filter):
+            self.search_query = None
+            self.search_results = None
+            self.loadMessages(scroll_to_bottom=True)
+            return
 
-            filtered_messages.append(msg)
+        current_user = self.getCurrentUser()
+        user = current_user if self.current_filter == 1 else None  # Only my messages
+        exclude_user = current_user if self.current_filter == 2 else None  # Only other messages
+        self.search_query = SearchQuery(self.current_search, user, exclude_user)
+
+        # The previous results stay visible until the first batch arrives
+        self.search_received = False
+        self.updateStatus("Searching...")
+        self.search_pool.start(SearchTask(self, self.search_generation, self.current_search, user, exclude_user))
+
+    def onSearchResults(self, generation, batch, finished):
+        """Shows a batch of search results (newest batch first)"""
+        if generation != self.search_generation:
+            # Result of a cancelled search
+            return
+
+        first = not self.search_received
+        self.search_received = True
+        if batch is None:
+            # Searching is not supported by the backend, filter the loaded messages
+            self.search_results = None
+        elif first:
+            self.search_results = list(batch)
+        else:
+            self.search_results[0:0] = batch
 
-        return filtered_messages
+        if first or batch:
+            self.loadMessages(scroll_to_bottom=first)
+        if finished:
+            count = len(self.applySearchAndFilter(self.messages))
+            self.updateStatus(f"{count} messages found")
 
     def searchMessages(self):
         """Searches messages"""
-        self.current_search = self.searchInput.text()
-        self.loadMessages()
+        self.searchTimer.stop()
+        search = self.searchInput.text()
+        if search == self.current_search and self.search_query is not None:
+            return
+        self.current_search = search
+        self.startSearch()
 
     def clearSearch(self):
         """Clears search and filters"""
         self.searchInput.clear()
         self.filterCombo.setCurrentIndex(0)
+        self.searchTimer.stop()
         self.current_search = ""
         self.current_filter = 0
-        self.loadMessages()
+        self.startSearch()
 
     def filterMessages(self, index):
         """Changes filter type"""
         self.current_filter = index
-        self.loadMessages()
+        self.startSearch()
 
     def scrollToBottom(self):
         """Scrolls to bottom"""
-        QTimer = QtCore.QTimer
-        QTimer.singleShot(100, lambda: self.scrollArea.verticalScrollBar().setValue(
-            self.scrollArea.verticalScrollBar().maximum()
-        ))
-
-    def saveMessage(self, message):
-        """Saves message to JSON file"""
-        max_retries = 5
-        retry_count = 0
-
-        while retry_count < max_retries:
+        QtCore.QTimer.singleShot(100, self.messageView.scrollToBottom)
+
+    def createMessage(self, message):
+        """Creates a new message record with a unique id"""
+        return {
+            "id": uuid.uuid4().hex,
+            "user": self.getCurrentUser(),
+            "message": message,
+            "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        }
+
+    def queueMessage(self, message):
+        """Queues message in the outbox, it is shown as pending until it has been written"""
+        new_message = self.createMessage(message)
+        self.pending_messages[new_message["id"]] = dict(new_message, status="pending")
+        try:
+            self.outbox.enqueue(new_message)
+        except Exception as e:
+            del self.pending_messages[new_message["id"]]
+            self.updateStatus(f"Message Could Not Be Queued: {str(e)}")
+            return False
+
+        self.updateStatus("Sending Message...")
+        if self.chatWatcher is not None:
+            self.chatWatcher.notifyActivity()
+        return True
+
+    def deliverMessage(self, message):
+        """Writes a queued message and its notifications (runs on the outbox thread)"""
+        # Raises if the message could not be stored, shared scripts don't notify
+        seq = self.backend.appendMessage(message, notify="[SCRIPT_DATA]" not in message["message"])
+
+        # Tell the other sessions on the LAN to read the store now
+        if self.beacon is not None and not self.backend.pushes_updates:
+            self.beacon.sendNewMessage(message["id"], seq)
+
+    def onBeaconPacket(self, packet):
+        """Handles a beacon from another session on the LAN"""
+        if packet.get("type") == "message":
+            if isinstance(packet.get("seq"), int) and packet["seq"] <= self.last_seq:
+                # Already read
+                return
+            # Hint: a new message is in the store, read it now instead of at the next poll
+            self.checkForUpdates()
+        elif packet.get("type") == "presence" and packet.get("user_id"):
+            self.beacon_peers[packet["user_id"]] = (packet.get("user", ""), time.time())
+
+    def onBackendEvent(self, event):
+        """Handles an event pushed by the backend"""
+        kind = event.get("type")
+        if kind == "reload":
+            # Connected: the most recent page of the history
+            messages = event["messages"]
+            self.messages = messages
+            self.history_start = event["start"]
+            self.history_complete = event["complete"]
+            self.last_seq = self.read_seq = lastSeq(messages)
+            for msg in messages:
+                self.pending_messages.pop(msg.get("id"), None)
+            self.loadMessages(scroll_to_bottom=True)
+
+        elif kind == "messages":
+            self.applyNewMessages((event["messages"], False, None))
+
+        elif kind == "history":
+            self.applyOlderMessages((event["before"], event["messages"], event["start"], event["complete"]))
+
+        elif kind == "users":
+            self.updateOnlineUsers(self.fetchOnlineUsers())
+
+        elif kind == "notifications":
+            self.displayNotifications(event["notifications"])
+
+    def checkBeaconHealth(self, result=None):
+        """Polls the chat files less often while beacons deliver the new-message hints"""
+        if self.beacon is None or self.chatWatcher is None:
+            return
+        healthy = self.beacon.isHealthy()
+        self.chatWatcher.setMinInterval(5000 if healthy else 500)
+
+    def onMessageSent(self, message_id):
+        """Called when the outbox has written a message"""
+        # Read our own message back, this replaces the pending entry
+        self.checkForUpdates()
+        self.updateStatus("Message Sent")
+
+    def onMessageFailed(self, message_id, error):
+        """Called when the outbox could not write a message"""
+        if message_id in self.pending_messages:
+            self.pending_messages[message_id]["status"] = "failed"
+            self.loadMessages()
+        # The message stays in the outbox and is retried until it is written
+        self.updateStatus(f"Message Could Not Be Saved, Retrying: {error}")
+
+    def fetchAbandonedOutbox(self, context=None):
+        """
+        Claims the outbox messages of sessions that are no longer running and looks up which
+        of them were stored before the session stopped (scheduler thread)
+
+        Returns:
+            tuple: (claimed messages, ids already in the store or None if unknown)
+        """
+        claimed = self.outbox.claimAbandoned()
+        if not claimed:
+            return claimed, set()
+        return claimed, self.backend.storedIds([message["id"] for message in claimed])
+
+    def replayOutbox(self, result=None):
+        """Resends the messages left in the outbox by sessions that are no longer running"""
+        if result is None:
             try:
-                # Wait a bit before locking file (to avoid race condition)
-                time.sleep(random.uniform(0.1, 0.5))
-
-                # Load existing messages or create new list
-                messages = []
-                if os.path.exists(self.chat_file):
-                    with open(self.chat_file, 'r', encoding='utf-8') as file:
-                        messages = json.load(file)
-
-                # Add new message
-                current_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                new_message = {
-                    "user": self.getCurrentUser(),
-                    "message": message,
-                    "timestamp": current_time
-                }
-                messages.append(new_message)
-
-                # Save to file
-                with open(self.chat_file, 'w', encoding='utf-8') as file:
-                    json.dump(messages, file, ensure_ascii=False, indent=4)
-
-                self.updateStatus("Message Sent")
-                return True
-
+                result = self.fetchAbandonedOutbox()
             except Exception as e:
-                retry_count += 1
-                if retry_count >= max_retries:
-                    self.updateStatus(f"Message Could Not Be Saved: {str(e)}")
-                    return False
-                time.sleep(random.uniform(0.5, 1.0))  # Wait a bit longer before retrying
+                print(f"Error reading outbox: {str(e)}")
+                return
+
+        claimed, stored = result
+        if not claimed:
+            return
+
+        # The whole history is checked, the loaded page only holds the latest messages. The
+        # relay can't be asked, but it doesn't store a message id twice.
+        delivered = {msg.get("id") for msg in self.messages} | (stored or set())
+        replay = []
+        for message in claimed:
+            if message["id"] in delivered:
+                # Written before the crash, only the outbox entry was left behind
+                self.outbox.discard(message["id"])
+            else:
+                self.pending_messages[message["id"]] = dict(message, status="pending")
+                replay.append(message)
 
-        return False
+        if replay:
+            self.outbox.replay(replay)
+            self.loadMessages()
+            self.updateStatus(f"Resending {len(replay)} queued messages")
 
     def sendMessage(self):
         """Message sending function"""
         message = self.messageInput.toPlainText()
         if message.strip():
-            self.updateStatus("Sending Message...")
-            # Save message
-            if self.saveMessage(message):
-                # Create notification
-                self.createNotification(message)
-                # Update and show messages
-                self.loadMessages()
+            # Message is written in the background and shown as pending right away
+            if self.queueMessage(message):
+                self.loadMessages(scroll_to_bottom=True)
                 # Clear message area
                 self.messageInput.clear()
 
-    def createNotification(self, message):
-        """Creates notification for other users"""
-        try:
-            # Load existing notifications
-            notifications = {}
-            if os.path.exists(self.notifications_file):
-                try:
-                    with open(self.notifications_file, 'r', encoding='utf-8') as file:
-                        notifications = json.load(file)
-                except:
-                    notifications = {}
-
-            # Get active users from presence file
-            active_users = []
-            if os.path.exists(self.presence_file):
-                try:
-                    with open(self.presence_file, 'r', encoding='utf-8') as file:
-                        presence_data = json.load(file)
-                        # Get all active users except ourselves
-                        for uid, data in presence_data.items():
-                            if uid != self.user_id:
-                                active_users.append(uid)
-                except:
-                    pass
-
-            # Create notification for each active user
-            current_time = time.time()
-            sender_name = self.getCurrentUser()
-            message_preview = message[:50] + "..." if len(message) > 50 else message
-
-            for user_id in active_users:
-                if user_id not in notifications:
-                    notifications[user_id] = []
-
-                # Add notification
-                notifications[user_id].append({
-                    "timestamp": current_time,
-                    "sender": sender_name,
-                    "message": message_preview,
-                    "read": False
-                })
-
-            # Save notifications
-            with open(self.notifications_file, 'w', encoding='utf-8') as file:
-                json.dump(notifications, file, ensure_ascii=False)
+    def fetchNotifications(self, context=None):
+        """Takes our unread notifications and marks them as read (scheduler thread)"""
+        return self.backend.takeNotifications(context)
 
-        except Exception as e:
-            print(f"Error creating notification: {str(e)}")
-            self.updateStatus(f"Error creating notification: {str(e)}")
-
-    def checkNotifications(self):
-        """Checks for new notifications"""
+    def unreadCount(self):
+        """Returns the number of messages from others after the read cursor"""
+        count = 0
+        current_user = self.getCurrentUser()
+        for msg in reversed(self.messages):
+            seq = msg.get("seq")
+            if not isinstance(seq, int) or seq <= self.read_seq:
+                break
+            if msg.get("user") != current_user:
+                count += 1
+        return count
+
+    def displayNotifications(self, unread_notifications):
+        """Shows the notifications fetched by the scheduler"""
         try:
-            if not os.path.exists(self.notifications_file):
-                return
-
-            # Load notifications
-            notifications = {}
-            try:
-                with open(self.notifications_file, 'r', encoding='utf-8') as file:
-                    notifications = json.load(file)
-            except:
-                return
-
-            # My notifications
-            my_notifications = notifications.get(self.user_id, [])
-
-            # Filter unread notifications
-            unread_notifications = [n for n in my_notifications if not n.get("read", False)]
-
             if unread_notifications:
-                # Show notification
-                count = len(unread_notifications)
+                # Show notification (messages from others after the last seen one)
+                count = max(len(unread_notifications), self.unreadCount())
 
                 # Update tab title
                 self.tabWidget.setTabText(0, f"Messages ({count} new)")
@@ -1555,17 +1574,8 @@ class NukeChat(QtWidgets.QWidget):
                                               duration=5000)
                     toast.show()
 
-                # Mark notifications as read
-                for notification in my_notifications:
-                    notification["read"] = True
-
-                # Save updated notifications
-                notifications[self.user_id] = my_notifications
-                with open(self.notifications_file, 'w', encoding='utf-8') as file:
-                    json.dump(notifications, file, ensure_ascii=False)
-
         except Exception as e:
-            print(f"Error checking notifications: {str(e)}")
-            self.updateStatus(f"Error checking notifications: {str(e)}")
+            print(f"Error showing notifications: {str(e)}")
+            self.updateStatus(f"Error showing notifications: {str(e)}")
 
     panels.registerWidgetAsPanel('NukeChat', 'NukeChat', 'uk.co.thefoundry.NukeChat')
@@ -0,0 +1,699 @@
+"""
+NukeChatBackend.py
+
+This module contains the storage/transport backends of NukeChat. The chat panel only
+talks to the ChatBackend interface (append, read since, history pages, presence and
+notifications), so the way messages travel between sessions can be swapped by config
+without touching UI code:
+
+    files   Append-only journal, presence folder and notifications.json in the shared
+            folder (default)
+    sqlite  SQLite store (db/nukechat.db), for a single host or a local disk
+    relay   Relay server that pushes messages, presence and notifications (NukeChatRelay.py)
+
+The backend is selected with NUKECHAT_BACKEND. The older switches still work:
+NUKECHAT_STORE=sqlite selects "sqlite", NUKECHAT_RELAY=host:port selects "relay".
+
+Backends can be benchmarked against each other outside of Nuke (stdlib only):
+
+    python NukeChatBackend.py [--backend files|sqlite|relay|all] [--count 200] [--folder <dir>]
+"""
+
+import os
+import sys
+import time
+import uuid
+import shutil
+import datetime
+import argparse
+import tempfile
+from NukeChatStorage import (MessageJournal, JournalTailReader, PresenceDirectory, SQLiteStore,
+                             updateJsonFile, readJson)
+from NukeChatRelay import RelayClient, RELAY_PORT
+from NukeChatSearch import SearchIndex, SearchQuery
+
+BACKENDS = ("files", "sqlite", "relay")
+# Notifications older than this are dropped from notifications.json (seconds)
+NOTIFICATION_MAX_AGE = 24 * 60 * 60
+
+
+def newestFirstBatches(items, first=100, largest=3200):
+    """Splits a list (oldest first) into batches from its end, each twice as large as the previous"""
+    end = len(items)
+    size = first
+    while end > 0:
+        start = max(0, end - size)
+        yield items[start:end]
+        end = start
+        size = min(size * 2, largest)
+
+
+def notificationPreview(message):
+    """Returns the shortened message text shown in notifications"""
+    return message[:50] + "..." if len(message) > 50 else message
+
+
+def lastSeq(messages, default=0):
+    """Returns the highest sequence number of the messages (default if none has one)"""
+    for message in reversed(messages):
+        if isinstance(message.get("seq"), int):
+            return max(default, message["seq"])
+    return default
+
+
+class ChatBackend:
+    """
+    Interface of a NukeChat backend
+
+    Stored messages carry a unique "id" and a monotonic "seq", which readers use as cursor.
+    History page cursors ("start") are only meaningful to the backend that produced them
+    (journal byte offsets, sequence numbers). Methods can be called from the scheduler and
+    outbox threads.
+    """
+
+    name = ""
+    # True if messages, presence and notifications are pushed through the event callback,
+    # the panel then doesn't poll the backend
+    pushes_updates = False
+
+    def __init__(self, network_folder, user_id, user, callback=None, page_size=100):
+        """
+        Initializes the backend (call start() before use)
+
+        Args:
+            network_folder (str): Shared "db" folder
+            user_id (str): Unique ID of the session
+            user (callable): Returns the current user name
+            callback (callable, optional): Receives pushed events (dict with a "type"), called
+                on a background thread. Only used by backends that push updates:
+                {"type": "reload", "messages", "start", "complete"} - replaces the history
+                {"type": "messages", "messages"} - new messages
+                {"type": "history", "before", "messages", "start", "complete"} - older page
+                {"type": "users", "users"} - active users ({user_id: {"user", ...}})
+                {"type": "notifications", "notifications"} - unread notifications
+            page_size (int): Number of messages per history page
+        """
+        self.network_folder = network_folder
+        self.user_id = user_id
+        self.user = user
+        self.callback = callback
+        self.page_size = page_size
+
+    def start(self):
+        """Connects or opens the storage"""
+
+    def close(self):
+        """Releases connections and files"""
+
+    def watchedFile(self):
+        """Returns the file that changes when a message is added (None if nothing to watch)"""
+        return None
+
+    # Messages
+
+    def appendMessage(self, message, notify=False):
+        """
+        Stores a message, raises on failure
+
+        Args:
+            message (dict): Message record ({"id", "user", "message", "timestamp"})
+            notify (bool): Also send a notification to the other active users
+
+        Returns:
+            int: Sequence number of the message (None if the backend has none)
+        """
+        raise NotImplementedError
+
+    def storedIds(self, message_ids):
+        """
+        Returns which of the message ids are already stored anywhere in the history
+
+        Returns:
+            set: The stored ids, None if the backend can't look them up
+        """
+        return None
+
+    def readLatest(self):
+        """
+        Reads the most recent page and continues readSince() after it
+
+        Returns:
+            tuple: (messages, start, complete), None if the page is pushed as "reload" event
+        """
+        raise NotImplementedError
+
+    def readSince(self):
+        """
+        Reads the messages added since the previous read (the backend keeps the cursor)
+
+        Returns:
+            tuple: (messages, reset, start) - if reset is True the history was replaced and
+                messages is its most recent page starting at start
+        """
+        return [], False, None
+
+    def readPage(self, start):
+        """
+        Reads the page of messages before a history cursor
+
+        Returns:
+            tuple: (messages, start, complete), None if the page is pushed as "history" event
+        """
+        raise NotImplementedError
+
+    def queryMessages(self, search="", user=None, exclude_user=None):
+        """
+        Returns all messages of the whole history matching a query, None if not supported
+
+        Args:
+            search (str): Search box text (see NukeChatSearch for the syntax)
+            user (str, optional): Only messages of this user
+            exclude_user (str, optional): Only messages not sent by this user
+        """
+        return None
+
+    def queryMessageBatches(self, search="", user=None, exclude_user=None):
+        """
+        Like queryMessages, but returns the matches in batches so the first ones can be
+        shown before all are read
+
+        Returns:
+            iterator: Lists of messages (each oldest first), the newest batch first; None if
+                searching is not supported
+        """
+        messages = self.queryMessages(search, user, exclude_user)
+        return None if messages is None else newestFirstBatches(messages)
+
+    # Presence
+
+    def heartbeat(self):
+        """Reports that this session is online"""
+
+    def userChanged(self):
+        """Called on the GUI thread after the user name was changed (the next heartbeat reports it)"""
+
+    def activeUsers(self):
+        """Returns {user_id: {"user", "last_seen"}} of the sessions that are online"""
+        return {}
+
+    # Notifications
+
+    def notify(self, message, seq=None):
+        """Adds a notification about a message (text, sequence number) to every other active user"""
+
+    def takeNotifications(self, context=None):
+        """Returns the notifications added since the previous call"""
+        return []
+
+
+class FileBackend(ChatBackend):
+    """Journal, presence folder and notifications.json in the shared folder"""
+
+    name = "files"
+
+    def __init__(self, network_folder, user_id, user, callback=None, page_size=100):
+        super(FileBackend, self).__init__(network_folder, user_id, user, callback, page_size)
+        self.chat_file = os.path.join(network_folder, "nukechat_messages.jsonl")
+        # Old JSON array history, migrated into the journal on first start
+        self.legacy_chat_file = os.path.join(network_folder, "nukechat_messages.json")
+        self.notifications_file = os.path.join(network_folder, "notifications.json")
+        self.journal = None
+        self.journal_reader = None
+        # Sequence number of the last message read
+        self.last_seq = 0
+        # Message sequence number of the last notification returned
+        self.notification_seq = 0
+        # One heartbeat file per session, so sessions never overwrite each other's presence
+        self.presence = PresenceDirectory(os.path.join(network_folder, "presence"))
+        # Full-text index of the journal, loaded or built by the first search
+        self.search_index = SearchIndex(os.path.join(network_folder, "nukechat_search.json"))
+
+    def start(self):
+        self.journal = MessageJournal(self.chat_file, self.legacy_chat_file)
+        self.journal.ensureExists()
+        # Reads only newly appended messages
+        self.journal_reader = JournalTailReader(self.journal)
+
+    def close(self):
+        self.presence.leave(self.user_id)
+        if self.search_index.dirty:
+            try:
+                self.search_index.save()
+            except Exception as e:
+                print(f"Error saving search index: {str(e)}")
+
+    def watchedFile(self):
+        return self.chat_file
+
+    def appendMessage(self, message, notify=False):
+        # Append only the new message under the journal lock, the rest of the history
+        # is not rewritten
+        seq = self.journal.appendMessage(message)
+        if notify:
+            self.notify(message["message"], seq)
+        return seq
+
+    def storedIds(self, message_ids):
+        return self.journal.findIds(message_ids)
+
+    def readLatest(self):
+        messages, start = self.journal_reader.readLatest(self.page_size)
+        self.last_seq = lastSeq(messages, self.last_seq)
+        return messages, start, start == 0
+
+    def readSince(self):
+        if not os.path.exists(self.chat_file):
+            self.journal.ensureExists()
+
+        # Only the bytes appended since the previous check are read and parsed
+        messages = self.journal_reader.readNew()
+        if self.journal_reader.was_reset:
+            if self.last_seq:
+                # Journal was replaced: resume after the last message read, by sequence number
+                end_offset = self.journal_reader.seekEnd()
+                messages, found = self.journal.readSinceSeq(self.last_seq, end_offset, self.page_size)
+                if found:
+                    self.last_seq = lastSeq(messages, self.last_seq)
+                    return messages, False, None
+
+            # Start over with its most recent page
+            messages, start = self.journal_reader.readLatest(self.page_size)
+            self.last_seq = lastSeq(messages)
+            return messages, True, start
+
+        self.last_seq = lastSeq(messages, self.last_seq)
+        if messages and self.search_index.loaded:
+            # Keep a loaded index up to date as messages arrive (saved by the next search, not
+            # on the scheduler thread)
+            self.search_index.update(self.journal, save=False)
+        return messages, False, None
+
+    def readPage(self, start):
+        messages, new_start, _ = self.journal.readPage(start, self.page_size)
+        return messages, new_start, new_start == 0
+
+    def queryMessages(self, search="", user=None, exclude_user=None):
+        # Only the messages found in the index are read from the journal
+        query = SearchQuery(search, user, exclude_user)
+        self.search_index.update(self.journal)
+        return self.journal.readAt(self.search_index.search(query))
+
+    def queryMessageBatches(self, search="", user=None, exclude_user=None):
+        # The index answers at once, the matching messages are read batch by batch
+        query = SearchQuery(search, user, exclude_user)
+        self.search_index.update(self.journal)
+        offsets = self.search_index.search(query)
+        return (self.journal.readAt(batch) for batch in newestFirstBatches(offsets))
+
+    def heartbeat(self):
+        # Touches our own heartbeat file, no shared file is rewritten
+        self.presence.heartbeat(self.user_id, self.user())
+
+    def activeUsers(self):
+        # A single scan of the presence folder, active within 30 seconds
+        return self.presence.activeUsers()
+
+    def notify(self, message, seq=None):
+        try:
+            recipients = [uid for uid in self.presence.activeUsers() if uid != self.user_id]
+            if not recipients:
+                return
+
+            current_time = time.time()
+            notification = {
+                "timestamp": current_time,
+                "sender": self.user(),
+                "message": notificationPreview(message),
+                "read": False
+            }
+            if seq is not None:
+                # Recipients keep a cursor instead of marking notifications as read
+                notification["seq"] = seq
+
+            def update(notifications):
+                for user_id in recipients:
+                    notifications.setdefault(user_id, []).append(dict(notification))
+
+                # Drop old notifications (sessions that are gone never come back)
+                for user_id in list(notifications):
+                    items = [n for n in notifications[user_id]
+                             if current_time - n.get("timestamp", 0) < NOTIFICATION_MAX_AGE]
+                    if items:
+                        notifications[user_id] = items
+                    else:
+                        del notifications[user_id]
+
+            # Locked read-modify-write
+            updateJsonFile(self.notifications_file, update)
+        except Exception as e:
+            # Notifications are best effort, the message itself has been written
+            print(f"Error creating notification: {str(e)}")
+
+    def takeNotifications(self, context=None):
+        # Read once per scheduler tick
+        if context is not None:
+            notifications = context.readJson(self.notifications_file, {})
+        else:
+            notifications = readJson(self.notifications_file, {})
+
+        # Notifications with a sequence number are taken by cursor, the file is only read
+        mine = notifications.get(self.user_id, [])
+        unread = [n for n in mine if isinstance(n.get("seq"), int) and n["seq"] > self.notification_seq]
+        self.notification_seq = max([self.notification_seq] + [n["seq"] for n in unread])
+
+        if not any("seq" not in n and not n.get("read", False) for n in mine):
+            return unread
+
+        def update(notifications):
+            # Re-read under the lock: take what is unread now and mark it as read
+            legacy = [n for n in notifications.get(self.user_id, [])
+                      if "seq" not in n and not n.get("read", False)]
+            for notification in legacy:
+                notification["read"] = True
+            return legacy
+
+        # Notifications of sessions without sequence numbers are marked as read
+        unread += updateJsonFile(self.notifications_file, update)
+        if context is not None:
+            context.invalidate(self.notifications_file)
+        return unread
+
+
+class SQLiteBackend(ChatBackend):
+    """SQLite store in the shared folder (WAL mode on a local disk, rollback journal on a network mount)"""
+
+    name = "sqlite"
+
+    def __init__(self, network_folder, user_id, user, callback=None, page_size=100):
+        super(SQLiteBackend, self).__init__(network_folder, user_id, user, callback, page_size)
+        self.db_file = os.path.join(network_folder, "nukechat.db")
+        self.store = None
+        self.last_seq = 0
+        # Id of the last notification returned
+        self.notification_id = 0
+
+    def start(self):
+        is_new = not os.path.exists(self.db_file)
+        self.store = SQLiteStore(self.db_file)
+        if is_new:
+            # Import the history of the JSON files once, when the database is created. The old
+            # JSON array history is migrated into the journal first (and kept as backup); if
+            # that fails it is imported directly.
+            chat_file = os.path.join(self.network_folder, "nukechat_messages.jsonl")
+            legacy_chat_file = os.path.join(self.network_folder, "nukechat_messages.json")
+            MessageJournal(chat_file, legacy_chat_file)
+            if not os.path.exists(chat_file):
+                chat_file = legacy_chat_file
+            imported = self.store.importJsonFiles(
+                chat_file,
+                os.path.join(self.network_folder, "presence.json"),
+                os.path.join(self.network_folder, "notifications.json"))
+            print(f"NukeChat SQLite store created: {self.db_file} {imported}")
+
+    def close(self):
+        if self.store is not None:
+            self.store.close()
+
+    def watchedFile(self):
+        # Writers append to the write-ahead log in WAL mode, otherwise they change the database
+        if self.store is not None and self.store.journal_mode != "WAL":
+            return self.db_file
+        return self.db_file + "-wal"
+
+    def appendMessage(self, message, notify=False):
+        # SQLite serializes concurrent writers itself
+        seq = self.store.appendMessage(message)
+        if notify:
+            self.notify(message["message"])
+        return seq
+
+    def storedIds(self, message_ids):
+        # One indexed lookup per id
+        return {message_id for message_id in message_ids if self.store.findMessage(message_id) is not None}
+
+    def readLatest(self):
+        messages = self.store.readPage(None, self.page_size)
+        if messages:
+            self.last_seq = messages[-1]["seq"]
+        start = messages[0]["seq"] if messages else 0
+        return messages, start, len(messages) < self.page_size
+
+    def readSince(self):
+        messages = self.store.readSince(self.last_seq)
+        if messages:
+            self.last_seq = messages[-1]["seq"]
+        return messages, False, None
+
+    def readPage(self, start):
+        messages = self.store.readPage(start, self.page_size)
+        new_start = messages[0]["seq"] if messages else start
+        return messages, new_start, len(messages) < self.page_size
+
+    def queryMessages(self, search="", user=None, exclude_user=None):
+        # The store narrows the messages down with its indexes and the most selective word,
+        # the query then checks the word prefixes and the terms of shared scripts
+        query = SearchQuery(search, user, exclude_user)
+        words = query.wordTerms()
+        searches = [max(words, key=len)] if words else []
+        if query.terms:
+            # Shared scripts are encoded, their terms are checked after decoding
+            searches.append("[SCRIPT_DATA]")
+        found = {}
+        for term in searches or [""]:
+            for msg in self.store.queryMessages(search=term, user=user, exclude_user=exclude_user,
+                                                since=query.since):
+                found[msg["seq"]] = msg
+        return [found[seq] for seq in sorted(found) if query.matches(found[seq])]
+
+    def heartbeat(self):
+        self.store.updatePresence(self.user_id, self.user())
+
+    def activeUsers(self):
+        return self.store.activeUsers()
+
+    def notify(self, message, seq=None):
+        try:
+            # All active users except ourselves, written in one transaction
+            recipients = [uid for uid in self.store.activeUsers() if uid != self.user_id]
+            self.store.createNotifications(recipients, self.user(), notificationPreview(message))
+        except Exception as e:
+            print(f"Error creating notification: {str(e)}")
+
+    def takeNotifications(self, context=None):
+        # Read by cursor, no write transaction
+        notifications, self.notification_id = self.store.readNotificationsSince(
+            self.user_id, self.notification_id)
+        return notifications
+
+
+class RelayBackend(ChatBackend):
+    """Relay server connection, everything is pushed by the relay"""
+
+    name = "relay"
+    pushes_updates = True
+
+    def __init__(self, network_folder, user_id, user, callback=None, page_size=100, address=None):
+        """
+        Initializes the relay backend
+
+        Args:
+            address (str): "host:port" of the relay (NUKECHAT_RELAY if not given)
+        """
+        super(RelayBackend, self).__init__(network_folder, user_id, user, callback, page_size)
+        address = address or os.environ.get("NUKECHAT_RELAY", "") or "127.0.0.1"
+        host, _, port = address.partition(":")
+        self.users = {}
+        self.client = RelayClient(host, int(port or RELAY_PORT), user_id, user, self._onPacket, page_size)
+
+    def start(self):
+        # The relay sends the recent messages in its welcome packet
+        self.client.start()
+
+    def close(self):
+        self.client.close()
+
+    def appendMessage(self, message, notify=False):
+        # The relay stores the message and pushes it and the notification to everyone
+        return self.client.sendMessage(message, notify=notify)
+
+    def readLatest(self):
+        # Pushed as "reload" once connected
+        return None
+
+    def readPage(self, start):
+        # Answered with a "history" event
+        self.client.requestHistory(start, self.page_size)
+        return None
+
+    def userChanged(self):
+        # Show the new name to the other clients
+        try:
+            self.client.updatePresence()
+        except ConnectionError:
+            pass
+
+    def activeUsers(self):
+        return dict(self.users)
+
+    def _emit(self, event):
+        if self.callback is not None:
+            self.callback(event)
+
+    def _onPacket(self, packet):
+        """Translates relay packets into backend events (relay client thread)"""
+        op = packet.get("op")
+        if op == "welcome":
+            messages = packet["messages"]
+            if packet.get("resumed"):
+                # Reconnected: the messages missed while disconnected
+                self._emit({"type": "messages", "messages": messages})
+            else:
+                self._emit({"type": "reload", "messages": messages,
+                            "start": messages[0]["seq"] if messages else 0,
+                            "complete": bool(packet.get("complete"))})
+
+        elif op == "message":
+            self._emit({"type": "messages", "messages": [packet["message"]]})
+
+        elif op == "history":
+            messages = packet["messages"]
+            self._emit({"type": "history", "before": packet.get("before"), "messages": messages,
+                        "start": messages[0]["seq"] if messages else packet.get("before"),
+                        "complete": bool(packet.get("complete"))})
+
+        elif op == "presence":
+            self.users = packet.get("users", {})
+            self._emit({"type": "users", "users": self.activeUsers()})
+
+        elif op == "notification":
+            self._emit({"type": "notifications", "notifications": [packet["notification"]]})
+
+
+def backendName():
+    """Returns the name of the configured backend (NUKECHAT_BACKEND, or the older switches)"""
+    name = os.environ.get("NUKECHAT_BACKEND", "").strip().lower()
+    if name:
+        return name
+    if os.environ.get("NUKECHAT_RELAY", ""):
+        return "relay"
+    if os.environ.get("NUKECHAT_STORE", "").lower() == "sqlite":
+        return "sqlite"
+    return "files"
+
+
+def createBackend(network_folder, user_id, user, callback=None, page_size=100, name=None):
+    """
+    Creates and starts a backend, falls back to the file backend if it can't be opened
+
+    Args:
+        network_folder (str): Shared "db" folder
+        user_id (str): Unique ID of the session
+        user (callable): Returns the current user name
+        callback (callable, optional): Receives pushed events (see ChatBackend)
+        page_size (int): Number of messages per history page
+        name (str, optional): Backend name, the configured backend if not given
+
+    Returns:
+        ChatBackend: The started backend
+    """
+    name = name or backendName()
+    classes = {"files": FileBackend, "sqlite": SQLiteBackend, "relay": RelayBackend}
+    if name not in classes:
+        print(f"Unknown NukeChat backend '{name}', using files")
+        name = "files"
+
+    backend = classes[name](network_folder, user_id, user, callback, page_size)
+    try:
+        backend.start()
+    except Exception as e:
+        if name == "files":
+            raise
+        print(f"Error opening the {name} backend, using files: {str(e)}")
+        backend = FileBackend(network_folder, user_id, user, callback, page_size)
+        backend.start()
+    return backend
+
+
+def _timeCall(timings, key, function, *args):
+    """Calls function and records its duration in timings[key] (ms)"""
+    start = time.perf_counter()
+    result = function(*args)
+    timings.setdefault(key, []).append((time.perf_counter() - start) * 1000.0)
+    return result
+
+
+def benchmarkBackend(backend, count=200):
+    """
+    Measures the main operations of a started backend with benchmark messages
+
+    Args:
+        backend (ChatBackend): Started backend (its folder receives the benchmark messages)
+        count (int): Number of messages to append
+
+    Returns:
+        dict: {operation: (mean ms, 95th percentile ms, calls)}
+    """
+    timings = {}
+    for index in range(count):
+        message = {
+            "id": uuid.uuid4().hex,
+            "user": backend.user(),
+            "message": f"benchmark message {index} " + "x" * (index % 200),
+            "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        }
+        _timeCall(timings, "appendMessage", backend.appendMessage, message)
+        if not backend.pushes_updates:
+            _timeCall(timings, "readSince", backend.readSince)
+
+    for _ in range(20):
+        _timeCall(timings, "heartbeat", backend.heartbeat)
+        _timeCall(timings, "activeUsers", backend.activeUsers)
+        if not backend.pushes_updates:
+            _timeCall(timings, "readLatest", backend.readLatest)
+            _timeCall(timings, "readSince (idle)", backend.readSince)
+            _timeCall(timings, "queryMessages", backend.queryMessages, "message 1")
+            _timeCall(timings, "takeNotifications", backend.takeNotifications)
+
+    results = {}
+    for key, values in timings.items():
+        values = sorted(values)
+        results[key] = (sum(values) / len(values), values[min(len(values) - 1, int(len(values) * 0.95))],
+                        len(values))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the NukeChat backends")
+    parser.add_argument("--backend", default="all", choices=BACKENDS + ("all",))
+    parser.add_argument("--count", type=int, default=200, help="Number of messages to append")
+    parser.add_argument("--folder", help="Folder for the benchmark data (a temporary folder if not given)")
+    parser.add_argument("--relay", help="host:port of a running relay (NUKECHAT_RELAY if not given)")
+    args = parser.parse_args()
+
+    names = [name for name in BACKENDS if name != "relay" or args.relay or os.environ.get("NUKECHAT_RELAY")]
+    if args.backend != "all":
+        names = [args.backend]
+
+    for name in names:
+        folder = args.folder or tempfile.mkdtemp(prefix=f"nukechat_{name}_")
+        try:
+            if name == "relay":
+                backend = RelayBackend(folder, "benchmark", lambda: "benchmark", address=args.relay)
+                backend.start()
+            else:
+                backend = createBackend(folder, "benchmark", lambda: "benchmark", name=name)
+            try:
+                results = benchmarkBackend(backend, args.count)
+            finally:
+                backend.close()
+        finally:
+            if not args.folder:
+                shutil.rmtree(folder, ignore_errors=True)
+
+        print(f"\n{name} ({args.count} messages)")
+        for key, (mean, p95, calls) in results.items():
+            print(f"  {key:<20} mean {mean:8.3f} ms   p95 {p95:8.3f} ms   ({calls} calls)")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
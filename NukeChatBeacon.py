@@ -0,0 +1,195 @@
+"""
+NukeChatBeacon.py
+
+This module provides an optional LAN transport for NukeChat. Small UDP multicast
+datagrams announce presence and "new message" hints, so other sessions read the chat
+store right when something changed instead of waiting for the next poll. The shared
+folder stays the source of truth: if UDP is blocked, sessions never see their own
+beacons, report the beacon as unhealthy and NukeChat keeps polling the files.
+
+Several sessions on one machine can share the port (SO_REUSEADDR), so the beacon can
+be tested on loopback by running this file in a few terminals:
+
+    python NukeChatBeacon.py [channel]
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import struct
+import hashlib
+import threading
+
+MULTICAST_GROUP = "239.255.43.21"
+MULTICAST_PORT = 45454
+# Largest datagram that is sent or accepted
+MAX_PACKET_SIZE = 1024
+
+
+def channelForFolder(folder):
+    """Returns a channel name for a chat folder, so separate chats on one LAN don't mix"""
+    return hashlib.md5(os.path.normcase(os.path.abspath(folder)).encode("utf-8")).hexdigest()[:12]
+
+
+class Beacon:
+    """Sends and receives presence and new-message beacons over UDP multicast"""
+
+    # Seconds without an echo of our own beacons after which UDP is considered blocked
+    HEALTH_TIMEOUT = 15
+
+    def __init__(self, channel, callback, group=MULTICAST_GROUP, port=MULTICAST_PORT, ttl=1):
+        """
+        Initializes the beacon (call start() to open the sockets)
+
+        Args:
+            channel (str): Only beacons of the same channel are delivered
+            callback (callable): Called on the receiver thread with each packet (dict)
+                from another session
+            group (str): Multicast group address
+            port (int): UDP port
+            ttl (int): Multicast TTL (1 keeps beacons in the local network)
+        """
+        self.channel = channel
+        self.callback = callback
+        self.group = group
+        self.port = port
+        self.ttl = ttl
+        self.sender_id = f"{socket.gethostname()}:{os.getpid()}:{id(self)}"
+
+        self.send_socket = None
+        self.receive_socket = None
+        self._thread = None
+        self._running = False
+
+        # Health: our own beacons come back through multicast loopback if UDP works
+        self.first_sent = None
+        self.last_echo = None
+
+    def start(self):
+        """
+        Opens the sockets and starts the receiver thread
+
+        Returns:
+            bool: False if UDP multicast is not available (use file polling only)
+        """
+        try:
+            receive_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+            receive_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if hasattr(socket, "SO_REUSEPORT"):
+                try:
+                    receive_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+                except OSError:
+                    pass
+            receive_socket.bind(("", self.port))
+            membership = struct.pack("4sl", socket.inet_aton(self.group), socket.INADDR_ANY)
+            receive_socket.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+            receive_socket.settimeout(1.0)
+
+            send_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+            send_socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, self.ttl)
+            send_socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+        except OSError as e:
+            print(f"NukeChat beacon not available, using file polling only: {str(e)}")
+            return False
+
+        self.receive_socket = receive_socket
+        self.send_socket = send_socket
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="NukeChatBeacon", daemon=True)
+        self._thread.start()
+        return True
+
+    def close(self):
+        """Stops the receiver thread and closes the sockets"""
+        self._running = False
+        for sock in (self.send_socket, self.receive_socket):
+            if sock is not None:
+                try:
+                    sock.close()
+                except OSError:
+                    pass
+        self.send_socket = self.receive_socket = None
+
+    def isHealthy(self):
+        """Returns True while our own beacons are received (UDP multicast works)"""
+        if self.send_socket is None or self.first_sent is None:
+            return False
+        now = time.time()
+        if self.last_echo is None:
+            # Give the first beacons some time to come back
+            return now - self.first_sent < self.HEALTH_TIMEOUT
+        return now - self.last_echo < self.HEALTH_TIMEOUT
+
+    def sendPresence(self, user_id, user):
+        """Announces that a session is online"""
+        return self._send({"type": "presence", "user_id": user_id, "user": user})
+
+    def sendNewMessage(self, message_id, seq=None):
+        """Announces that a message was written to the chat store"""
+        return self._send({"type": "message", "id": message_id, "seq": seq})
+
+    def _send(self, packet):
+        """Sends a packet, returns False if it could not be sent"""
+        if self.send_socket is None:
+            return False
+        packet = dict(packet, v=1, channel=self.channel, sender=self.sender_id, time=time.time())
+        data = json.dumps(packet, ensure_ascii=False).encode("utf-8")
+        if len(data) > MAX_PACKET_SIZE:
+            return False
+        try:
+            self.send_socket.sendto(data, (self.group, self.port))
+        except OSError:
+            return False
+        if self.first_sent is None:
+            self.first_sent = time.time()
+        return True
+
+    def _run(self):
+        """Receiver thread: passes packets of our channel from other sessions to the callback"""
+        while self._running:
+            try:
+                data, _ = self.receive_socket.recvfrom(MAX_PACKET_SIZE)
+            except socket.timeout:
+                continue
+            except (OSError, AttributeError):
+                break
+
+            try:
+                packet = json.loads(data.decode("utf-8"))
+            except ValueError:
+                continue
+            if not isinstance(packet, dict) or packet.get("v") != 1 or packet.get("channel") != self.channel:
+                continue
+
+            if packet.get("sender") == self.sender_id:
+                self.last_echo = time.time()
+                continue
+
+            try:
+                self.callback(packet)
+            except Exception as e:
+                print(f"NukeChat beacon error: {str(e)}")
+
+
+if __name__ == "__main__":
+    # Loopback test: run in several terminals, each prints the beacons of the others
+    channel = sys.argv[1] if len(sys.argv) > 1 else "test"
+    beacon = Beacon(channel, lambda packet: print(json.dumps(packet)))
+    if not beacon.start():
+        sys.exit(1)
+
+    name = f"{socket.gethostname()}-{os.getpid()}"
+    print(f"Beacon {beacon.sender_id} on {beacon.group}:{beacon.port}, channel '{channel}'")
+    count = 0
+    try:
+        while True:
+            beacon.sendPresence(name, name)
+            if count % 3 == 0:
+                beacon.sendNewMessage(f"{name}-{count}", count)
+            count += 1
+            time.sleep(2)
+            print(f"healthy: {beacon.isHealthy()}")
+    except KeyboardInterrupt:
+        beacon.close()
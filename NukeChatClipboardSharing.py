@@ -12,6 +12,8 @@ import json
 import base64
 import os
 import re
+import sys
+from collections import OrderedDict
 
 
 class ScriptBubbleWidget(QtWidgets.QWidget):
@@ -157,9 +159,103 @@ class ScriptBubbleWidget(QtWidgets.QWidget):
         return node_count
 
 
+# Only the beginning of a text is looked at when classifying it
+MAX_CLASSIFY_CHARS = 65536
+# Confidence from which a text is treated as a Nuke script
+SCRIPT_CONFIDENCE = 0.5
+# Top-level lines that aren't Nuke script structure after which classifying stops
+MAX_FOREIGN_LINES = 20
+
+# "Blur {" - start of a node block
+NODE_HEADER_PATTERN = re.compile(r"[A-Za-z_][\w.]*\s*\{$")
+# " size 10" - knob of a node (one space of indentation)
+KNOB_PATTERN = re.compile(r" [A-Za-z_]\w*(\s|$)")
+# Stack commands between nodes
+STACK_PATTERN = re.compile(r"(push (\$\w+|0)|set \w+ \[stack \d+\]|end_group|add_layer \{.*\})$")
+VERSION_PATTERN = re.compile(r"version \d+\.\d+")
+
+
+def nukeScriptConfidence(text, max_chars=MAX_CLASSIFY_CHARS):
+    """
+    Estimates how likely a text is a Nuke script (.nk) in a single pass
+
+    Only the first max_chars characters are read, and reading stops as soon as the
+    result is certain or the text turned out to be something else (logs, code, encoded
+    images), so the cost doesn't depend on the size of the text.
+
+    Args:
+        text (str): Text to classify, e.g. the clipboard content
+        max_chars (int): Number of characters looked at
+
+    Returns:
+        float: Confidence between 0.0 (not a script) and 1.0 (certainly a script)
+    """
+    score = 0.0
+    structure = 0  # Top-level lines that are script structure
+    foreign = 0  # Top-level lines that are not
+    depth = 0  # Brace depth inside a node block
+    knobs = set()  # Knobs of the current node
+
+    for line in text[:max_chars].splitlines():
+        if depth > 0:
+            if depth == 1:
+                if line.strip() == "}":
+                    # Complete node; name and position are written by Nuke for every node
+                    if knobs:
+                        score += 0.3
+                        if knobs & {"name", "xpos", "ypos"}:
+                            score += 0.2
+                    depth = 0
+                    if score >= 1.0:
+                        break
+                    continue
+                if KNOB_PATTERN.match(line):
+                    knobs.add(line.split(None, 1)[0])
+            depth += line.count("{") - line.count("}")
+            depth = max(depth, 0)
+            continue
+
+        stripped = line.strip()
+        if not stripped or stripped.startswith("#"):
+            continue
+
+        if stripped.startswith("set cut_paste_input"):
+            score += 0.5
+            structure += 1
+        elif VERSION_PATTERN.match(stripped):
+            score += 0.15
+            structure += 1
+        elif STACK_PATTERN.match(stripped):
+            score += 0.15
+            structure += 1
+        elif NODE_HEADER_PATTERN.match(stripped):
+            structure += 1
+            depth = 1
+            knobs = set()
+        else:
+            foreign += 1
+            if foreign >= MAX_FOREIGN_LINES and score < SCRIPT_CONFIDENCE:
+                break
+
+        if score >= 1.0:
+            break
+
+    confidence = min(score, 1.0)
+    if foreign:
+        # Text around the script (e.g. pasted into a message) lowers the confidence
+        confidence *= structure / float(structure + foreign)
+    return confidence
+
+
 class ClipboardHandler(QtCore.QObject):
     """Monitors clipboard changes and identifies Nuke script parts"""
 
+    # Emitted when the clipboard changed, True if it now holds a Nuke script
+    scriptAvailabilityChanged = QtCore.Signal(bool)
+
+    # Number of clipboard contents whose classification is remembered
+    CACHE_SIZE = 32
+
     def __init__(self, parent=None):
         super(ClipboardHandler, self).__init__(parent)
         self.parent = parent
@@ -167,52 +263,77 @@ class ClipboardHandler(QtCore.QObject):
         # Get reference to the clipboard object
         self.clipboard = QtWidgets.QApplication.clipboard()
 
+        # Confidence per clipboard content (length, hash of the beginning), so copying the same
+        # content again doesn't scan it again
+        self._classified = OrderedDict()
+        # Result for the current clipboard content, None until the clipboard is checked
+        self.has_script = None
+        # Confidence that the current clipboard content is a Nuke script (0.0 - 1.0)
+        self.script_confidence = 0.0
+
+        # The clipboard is only looked at when its content changes
+        self.clipboard.dataChanged.connect(self.onClipboardChanged)
+        if sys.platform == "darwin":
+            # On macOS changes made by other applications are only reported on activation
+            QtWidgets.QApplication.instance().applicationStateChanged.connect(self.onApplicationStateChanged)
+
+    def onClipboardChanged(self):
+        """Classifies the new clipboard content and reports if a script became (un)available"""
+        self.has_script = None
+        self.scriptAvailabilityChanged.emit(self.checkClipboard())
+
+    def onApplicationStateChanged(self, state):
+        """Checks the clipboard again when the application is activated (macOS)"""
+        if state == QtCore.Qt.ApplicationActive:
+            self.onClipboardChanged()
+
     def checkClipboard(self):
         """Checks clipboard content and returns True if it's a Nuke script part"""
-        try:
-            # Get text from clipboard
-            clipboard_text = self.clipboard.text()
-
-            # Check if it's a Nuke script part
-            if clipboard_text and self.isNukeScript(clipboard_text):
-                return True
-        except:
-            pass
+        if self.has_script is None:
+            self.script_confidence = self.scriptConfidence(self.clipboardText())
+            self.has_script = self.script_confidence >= SCRIPT_CONFIDENCE
+        return self.has_script
 
-        return False
+    def clipboardText(self):
+        """Returns the clipboard text, or "" if the clipboard holds no text (e.g. an image)"""
+        try:
+            mime_data = self.clipboard.mimeData()
+            if mime_data is None or not mime_data.hasText():
+                return ""
+            return self.clipboard.text()
+        except Exception:
+            return ""
+
+    def classifyText(self, text):
+        """Returns True if text is a Nuke script part, cached per content"""
+        return self.scriptConfidence(text) >= SCRIPT_CONFIDENCE
+
+    def scriptConfidence(self, text):
+        """Returns the confidence that text is a Nuke script (0.0 - 1.0), cached per content"""
+        if not text:
+            return 0.0
+
+        # The confidence only depends on the beginning of the text
+        key = (len(text), hash(text[:MAX_CLASSIFY_CHARS]))
+        result = self._classified.get(key)
+        if result is None:
+            result = nukeScriptConfidence(text)
+            self._classified[key] = result
+            while len(self._classified) > self.CACHE_SIZE:
+                self._classified.popitem(last=False)
+        else:
+            self._classified.move_to_end(key)
+        return result
 
     def isNukeScript(self, text):
         """Checks if the text is a Nuke script part"""
-        # Check for typical signatures of Nuke scripts
-        nuke_indicators = [
-            "set cut_paste_input",
-            "version",
-            "push $",
-            "Blur {",
-            "Grade {",
-            "Transform {",
-            "Merge2 {",
-            "Read {",
-            "Write {",
-            "ColorCorrect {",
-            "xpos",
-            "ypos"
-        ]
-
-        # If the text contains at least a few of these indicators, it's probably a Nuke script
-        indicator_count = 0
-        for indicator in nuke_indicators:
-            if indicator in text:
-                indicator_count += 1
-
-        # Accept as a Nuke script if there are at least 3 indicators
-        return indicator_count >= 3
+        return nukeScriptConfidence(text) >= SCRIPT_CONFIDENCE
 
     def getScriptFromClipboard(self):
         """Gets Nuke script from clipboard and processes it"""
-        clipboard_text = self.clipboard.text()
+        clipboard_text = self.clipboardText()
 
-        if clipboard_text and self.isNukeScript(clipboard_text):
+        if clipboard_text and self.classifyText(clipboard_text):
             # Format as script data
             script_data = {
                 "script": clipboard_text,
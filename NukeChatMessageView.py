@@ -0,0 +1,503 @@
+"""
+NukeChatMessageView.py
+
+This module contains the message list used by NukeChat. Messages are kept in a
+QAbstractListModel and painted by a delegate, so only the visible rows cost anything.
+Script and expression messages get real widgets (persistent editors) only while their
+row is on screen.
+"""
+
+import datetime
+import PySide2.QtCore as QtCore
+import PySide2.QtWidgets as QtWidgets
+import PySide2.QtGui as QtGui
+from NukeChatClipboardSharing import ScriptBubbleWidget, decodeScriptData
+
+
+def messageKey(message):
+    """Returns a key identifying a message (its id, or its content for old messages without one)"""
+    return message.get("id") or (message.get("user"), message.get("timestamp"), message.get("message"))
+
+
+def messageKind(message):
+    """Returns "script", "expression" or "text" depending on the message content"""
+    text = message.get("message", "")
+    if "[SCRIPT_DATA]" in text and "[/SCRIPT_DATA]" in text:
+        return "script"
+    if "[EXPRESSION_DATA]" in text and "[/EXPRESSION_DATA]" in text:
+        return "expression"
+    return "text"
+
+
+def avatarIdForUser(username):
+    """Returns the avatar ID for a username ("Name - (computer_name)" uses the computer name)"""
+    user_parts = username.split(' - ')
+    if len(user_parts) > 1 and user_parts[1].startswith('(') and user_parts[1].endswith(')'):
+        return user_parts[1][1:-1]  # Remove parentheses
+    # Plain username - replace spaces with underscores
+    return username.replace(" ", "_").lower()
+
+
+def _extractTagged(message, start_tag, end_tag):
+    """Returns the text between two tags"""
+    start_idx = message.find(start_tag) + len(start_tag)
+    end_idx = message.find(end_tag)
+    return message[start_idx:end_idx]
+
+
+def _errorLabel(text, parent):
+    """Creates the red label shown when embedded data can't be displayed"""
+    error_label = QtWidgets.QLabel(text, parent)
+    error_label.setStyleSheet("color: #FF6666; background-color: transparent;")
+    return error_label
+
+
+def createEmbeddedWidget(message, parent=None):
+    """Creates the widget for a script or expression message"""
+    kind = messageKind({"message": message})
+    try:
+        if kind == "script":
+            script_data = decodeScriptData(_extractTagged(message, "[SCRIPT_DATA]", "[/SCRIPT_DATA]"))
+            if script_data:
+                return ScriptBubbleWidget(script_data, parent)
+            return _errorLabel("Could not decode script data!", parent)
+
+        from ExpressionHandler import ExpressionBubbleWidget, decodeExpressionData
+        expression_data = decodeExpressionData(
+            _extractTagged(message, "[EXPRESSION_DATA]", "[/EXPRESSION_DATA]"))
+        if expression_data:
+            return ExpressionBubbleWidget(expression_data, parent)
+        return _errorLabel("Could not decode expression data!", parent)
+
+    except Exception as e:
+        label = "Script" if kind == "script" else "Expression"
+        return _errorLabel(f"{label} display error: {str(e)}", parent)
+
+
+class MessageListModel(QtCore.QAbstractListModel):
+    """List model holding the displayed messages"""
+
+    MessageRole = QtCore.Qt.UserRole + 1
+    IsSelfRole = QtCore.Qt.UserRole + 2
+    KindRole = QtCore.Qt.UserRole + 3
+
+    def __init__(self, parent=None):
+        super(MessageListModel, self).__init__(parent)
+        self.messages = []
+        self.current_user = ""
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.messages)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid() or index.row() >= len(self.messages):
+            return None
+
+        message = self.messages[index.row()]
+        if role == QtCore.Qt.DisplayRole:
+            return message.get("message", "")
+        if role == self.MessageRole:
+            return message
+        if role == self.IsSelfRole:
+            return message.get("user") == self.current_user
+        if role == self.KindRole:
+            return messageKind(message)
+        return None
+
+    def setMessages(self, messages, current_user):
+        """Replaces the displayed messages"""
+        self.beginResetModel()
+        self.messages = list(messages)
+        self.current_user = current_user
+        self.endResetModel()
+
+    def updateMessages(self, messages, current_user):
+        """
+        Updates the displayed messages by diffing against the current rows
+
+        Rows of messages that are gone are removed, new messages are inserted and
+        changed messages (e.g. a pending message that got stored) are updated in place,
+        so the view only lays out and paints what actually changed.
+
+        Returns:
+            bool: True if the model had to be reset instead
+        """
+        messages = list(messages)
+        new_keys = [messageKey(msg) for msg in messages]
+        new_key_set = set(new_keys)
+
+        if current_user != self.current_user or len(new_key_set) != len(new_keys):
+            # Ownership of every row changes, or keys are ambiguous
+            self.setMessages(messages, current_user)
+            return True
+
+        # Remove rows of messages that are gone (bottom up, one call per contiguous run)
+        row = len(self.messages) - 1
+        while row >= 0:
+            if messageKey(self.messages[row]) in new_key_set:
+                row -= 1
+                continue
+            last = row
+            while row >= 0 and messageKey(self.messages[row]) not in new_key_set:
+                row -= 1
+            self.beginRemoveRows(QtCore.QModelIndex(), row + 1, last)
+            del self.messages[row + 1:last + 1]
+            self.endRemoveRows()
+
+        # The remaining rows must appear in the same order in the new list
+        old_keys = [messageKey(msg) for msg in self.messages]
+        old_key_set = set(old_keys)
+        if old_keys != [key for key in new_keys if key in old_key_set]:
+            self.setMessages(messages, current_user)
+            return True
+
+        # Insert new messages (one call per contiguous run) and update changed ones
+        row = 0
+        while row < len(messages):
+            if new_keys[row] in old_key_set:
+                # Stored messages never change: rows with the same sequence number are equal
+                seq = messages[row].get("seq")
+                if (seq is None or self.messages[row].get("seq") != seq) and self.messages[row] != messages[row]:
+                    self.messages[row] = messages[row]
+                    index = self.index(row)
+                    self.dataChanged.emit(index, index)
+                row += 1
+                continue
+            first = row
+            while row < len(messages) and new_keys[row] not in old_key_set:
+                row += 1
+            self.beginInsertRows(QtCore.QModelIndex(), first, row - 1)
+            self.messages[first:first] = messages[first:row]
+            self.endInsertRows()
+
+        return False
+
+
+class MessageDelegate(QtWidgets.QStyledItemDelegate):
+    """Paints a message row (avatar, username, time bubble, text) without creating widgets"""
+
+    MARGIN = 9
+    AVATAR_SIZE = 50
+    SPACING = 6
+    HEADER_HEIGHT = 22
+    # Height used for script/expression rows until their widget has been measured
+    EMBEDDED_HEIGHT = 340
+
+    def __init__(self, avatar_manager, parent=None):
+        super(MessageDelegate, self).__init__(parent)
+        self.avatar_manager = avatar_manager
+        # Avatars looked up since the last refresh, so painting doesn't stat the avatar files
+        # (the pixmaps themselves are cached by AvatarManager)
+        self._avatars = {}
+        # Measured heights of embedded widgets and computed row heights
+        self._embedded_heights = {}
+        self._size_cache = {}
+
+        if avatar_manager is not None:
+            avatar_manager.loader.avatarLoaded.connect(self._onAvatarLoaded)
+
+        self.name_font = QtGui.QFont()
+        self.name_font.setBold(True)
+        self.time_font = QtGui.QFont()
+        self.time_font.setPixelSize(10)
+
+    def clearAvatarCache(self):
+        """Forgets the cached avatars (they are loaded again on the next paint)"""
+        self._avatars.clear()
+
+    def clearSizeCache(self):
+        """Forgets the computed row heights"""
+        self._size_cache.clear()
+
+    def avatarPixmap(self, username):
+        """Returns the avatar for a username"""
+        avatar_id = avatarIdForUser(username)
+        pixmap = self._avatars.get(avatar_id)
+        if pixmap is None:
+            if self.avatar_manager is not None:
+                # Placeholder until the avatar is decoded in the background
+                pixmap = self.avatar_manager.request_avatar(avatar_id, self.AVATAR_SIZE)
+            else:
+                pixmap = QtGui.QPixmap(self.AVATAR_SIZE, self.AVATAR_SIZE)
+                pixmap.fill(QtCore.Qt.transparent)
+            self._avatars[avatar_id] = pixmap
+        return pixmap
+
+    def _onAvatarLoaded(self, user_id, size):
+        """Swaps the placeholder for the decoded avatar"""
+        if size != self.AVATAR_SIZE:
+            return
+        self._avatars.pop(user_id, None)
+        view = self.parent()
+        if isinstance(view, QtWidgets.QAbstractItemView):
+            view.viewport().update()
+
+    def _timeText(self, message):
+        """Returns the text and color of the time bubble"""
+        status = message.get("status")
+        if status == "pending":
+            return "Sending...", "#aaaaaa"
+        if status == "failed":
+            return "Not sent", "#FF6666"
+
+        # Only get the time information (timestamp: "YYYY-MM-DD HH:MM:SS" format)
+        timestamp = message.get("timestamp", "")
+        try:
+            dt_obj = datetime.datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S")
+            return dt_obj.strftime("%H:%M"), "#aaaaaa"
+        except Exception:
+            return (timestamp.split(" ")[-1] if " " in timestamp else timestamp), "#aaaaaa"
+
+    def _layout(self, rect, message, is_self):
+        """Calculates the rectangles of a row"""
+        area = rect.adjusted(self.MARGIN, self.MARGIN, -self.MARGIN, -self.MARGIN)
+        content_width = max(area.width() - self.AVATAR_SIZE - self.SPACING, 10)
+
+        # Avatar on the right for our messages, on the left for others
+        if is_self:
+            avatar = QtCore.QRect(area.right() - self.AVATAR_SIZE + 1, area.top(),
+                                  self.AVATAR_SIZE, self.AVATAR_SIZE)
+            content = QtCore.QRect(area.left(), area.top(), content_width, area.height())
+        else:
+            avatar = QtCore.QRect(area.left(), area.top(), self.AVATAR_SIZE, self.AVATAR_SIZE)
+            content = QtCore.QRect(area.left() + self.AVATAR_SIZE + self.SPACING, area.top(),
+                                   content_width, area.height())
+
+        name_width = QtGui.QFontMetrics(self.name_font).horizontalAdvance(message.get("user", "").upper())
+        time_text = self._timeText(message)[0]
+        time_width = QtGui.QFontMetrics(self.time_font).horizontalAdvance(time_text) + 16
+        name_width = min(name_width, max(content.width() - time_width - self.SPACING, 0))
+
+        # Align right for our messages, left for others
+        if is_self:
+            time_bubble = QtCore.QRect(content.right() - time_width + 1, content.top() + 2,
+                                       time_width, self.HEADER_HEIGHT - 4)
+            name = QtCore.QRect(time_bubble.left() - self.SPACING - name_width, content.top(),
+                                name_width, self.HEADER_HEIGHT)
+        else:
+            name = QtCore.QRect(content.left(), content.top(), name_width, self.HEADER_HEIGHT)
+            time_bubble = QtCore.QRect(name.right() + 1 + self.SPACING, content.top() + 2,
+                                       time_width, self.HEADER_HEIGHT - 4)
+
+        body_top = content.top() + self.HEADER_HEIGHT + 4
+        body = QtCore.QRect(content.left(), body_top, content.width(), max(area.bottom() - body_top + 1, 0))
+        return {"avatar": avatar, "name": name, "time": time_bubble, "body": body}
+
+    def _viewWidth(self, option):
+        """Width available for a row"""
+        view = self.parent()
+        if isinstance(view, QtWidgets.QAbstractItemView):
+            return view.viewport().width()
+        return option.rect.width()
+
+    def sizeHint(self, option, index):
+        message = index.data(MessageListModel.MessageRole)
+        if message is None:
+            return QtCore.QSize(0, 0)
+
+        width = self._viewWidth(option)
+        key = messageKey(message)
+        cache_key = (key, width, message.get("status"))
+        cached = self._size_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        kind = index.data(MessageListModel.KindRole)
+        content_width = max(width - 2 * self.MARGIN - self.AVATAR_SIZE - self.SPACING, 10)
+        if kind == "text":
+            text_rect = option.fontMetrics.boundingRect(
+                QtCore.QRect(0, 0, content_width, 100000), QtCore.Qt.TextWordWrap,
+                message.get("message", ""))
+            body_height = text_rect.height()
+        else:
+            body_height = self._embedded_heights.get(key, self.EMBEDDED_HEIGHT)
+
+        height = max(self.AVATAR_SIZE, self.HEADER_HEIGHT + 4 + body_height) + 2 * self.MARGIN
+        size = QtCore.QSize(width, height)
+        self._size_cache[cache_key] = size
+        return size
+
+    def paint(self, painter, option, index):
+        message = index.data(MessageListModel.MessageRole)
+        if message is None:
+            return
+        is_self = index.data(MessageListModel.IsSelfRole)
+        kind = index.data(MessageListModel.KindRole)
+
+        painter.save()
+        painter.setRenderHint(QtGui.QPainter.Antialiasing, True)
+
+        # Make row color alternate - dark gray and slightly darker gray
+        bg_color = "#333333" if index.row() % 2 == 0 else "#2D2D2D"
+        painter.fillRect(option.rect, QtGui.QColor(bg_color))
+
+        rects = self._layout(option.rect, message, is_self)
+
+        # Avatar
+        painter.drawPixmap(rects["avatar"], self.avatarPixmap(message.get("user", "")))
+
+        # Username (without bubble)
+        painter.setFont(self.name_font)
+        painter.setPen(QtGui.QColor("white"))
+        name_text = painter.fontMetrics().elidedText(message.get("user", "").upper(),
+                                                     QtCore.Qt.ElideRight, rects["name"].width())
+        painter.drawText(rects["name"], QtCore.Qt.AlignVCenter | QtCore.Qt.AlignLeft, name_text)
+
+        # Bubble for time info
+        time_text, time_color = self._timeText(message)
+        painter.setPen(QtCore.Qt.NoPen)
+        painter.setBrush(QtGui.QColor("#444444"))
+        painter.drawRoundedRect(rects["time"], 8, 8)
+        painter.setFont(self.time_font)
+        painter.setPen(QtGui.QColor(time_color))
+        painter.drawText(rects["time"], QtCore.Qt.AlignCenter, time_text)
+
+        # Normal text message (script and expression rows get a widget on top of the body)
+        if kind == "text":
+            painter.setFont(option.font)
+            painter.setPen(QtGui.QColor("white"))
+            alignment = QtCore.Qt.AlignRight if is_self else QtCore.Qt.AlignLeft
+            painter.drawText(rects["body"], alignment | QtCore.Qt.AlignTop | QtCore.Qt.TextWordWrap,
+                             message.get("message", ""))
+
+        painter.restore()
+
+    # Embedded widgets for script and expression messages
+
+    def createEditor(self, parent, option, index):
+        message = index.data(MessageListModel.MessageRole)
+        widget = createEmbeddedWidget(message.get("message", ""), parent)
+
+        # Use the real height of the widget for the row
+        key = messageKey(message)
+        height = widget.sizeHint().height()
+        if self._embedded_heights.get(key) != height:
+            self._embedded_heights[key] = height
+            self._size_cache = {k: v for k, v in self._size_cache.items() if k[0] != key}
+            persistent = QtCore.QPersistentModelIndex(index)
+            QtCore.QTimer.singleShot(0, lambda: persistent.isValid() and
+                                     self.sizeHintChanged.emit(QtCore.QModelIndex(persistent)))
+        return widget
+
+    def updateEditorGeometry(self, editor, option, index):
+        message = index.data(MessageListModel.MessageRole)
+        is_self = index.data(MessageListModel.IsSelfRole)
+        body = self._layout(option.rect, message, is_self)["body"]
+
+        # Align right for our messages, left for others
+        width = min(body.width(), max(editor.sizeHint().width(), 300))
+        x = body.right() - width + 1 if is_self else body.left()
+        editor.setGeometry(x, body.top(), width, body.height())
+
+    def setEditorData(self, editor, index):
+        pass
+
+    def setModelData(self, editor, model, index):
+        pass
+
+
+class MessageListView(QtWidgets.QListView):
+    """Message list that only creates widgets for the visible script/expression rows"""
+
+    # Extra rows above and below the visible area that keep their widgets
+    EMBEDDED_MARGIN = 2
+
+    def __init__(self, avatar_manager, parent=None):
+        super(MessageListView, self).__init__(parent)
+        self.message_model = MessageListModel(self)
+        self.setModel(self.message_model)
+        self.message_delegate = MessageDelegate(avatar_manager, self)
+        self.setItemDelegate(self.message_delegate)
+
+        self.setVerticalScrollMode(QtWidgets.QAbstractItemView.ScrollPerPixel)
+        self.setHorizontalScrollBarPolicy(QtCore.Qt.ScrollBarAlwaysOff)
+        self.setSelectionMode(QtWidgets.QAbstractItemView.NoSelection)
+        self.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        self.setResizeMode(QtWidgets.QListView.Adjust)
+        self.setUniformItemSizes(False)
+        self.setSpacing(0)
+        self.setFrameShape(QtWidgets.QFrame.NoFrame)
+
+        # Persistent indexes of the rows that currently have a widget
+        self._embedded = []
+
+        self.verticalScrollBar().valueChanged.connect(self.scheduleEmbeddedUpdate)
+        self.message_model.modelAboutToBeReset.connect(self._forgetEmbedded)
+        self.message_model.modelReset.connect(self.scheduleEmbeddedUpdate)
+        self.message_model.rowsInserted.connect(self.scheduleEmbeddedUpdate)
+        self.message_model.rowsRemoved.connect(self.scheduleEmbeddedUpdate)
+
+        self._embedded_timer = QtCore.QTimer(self)
+        self._embedded_timer.setSingleShot(True)
+        self._embedded_timer.timeout.connect(self.updateEmbeddedWidgets)
+
+    def scheduleEmbeddedUpdate(self, *args):
+        """Updates the embedded widgets once the view has settled"""
+        self._embedded_timer.start(0)
+
+    def resizeEvent(self, event):
+        super(MessageListView, self).resizeEvent(event)
+        self.message_delegate.clearSizeCache()
+        self.scheduleEmbeddedUpdate()
+
+    def _forgetEmbedded(self):
+        """Model reset closes all editors"""
+        self._embedded = []
+
+    def isAtBottom(self):
+        """Returns True if the view is scrolled to the newest message"""
+        scroll_bar = self.verticalScrollBar()
+        return scroll_bar.value() >= scroll_bar.maximum() - 4
+
+    def scrollAnchor(self):
+        """Returns the top visible row and its position, to keep it in place while rows are inserted above"""
+        index = self.indexAt(QtCore.QPoint(1, 1))
+        if not index.isValid():
+            return None
+        return QtCore.QPersistentModelIndex(index), self.visualRect(index).top()
+
+    def restoreScrollAnchor(self, anchor):
+        """Scrolls so that the anchored row is at the same position as before"""
+        if anchor is None or not anchor[0].isValid():
+            return
+        persistent, top = anchor
+        offset = self.visualRect(QtCore.QModelIndex(persistent)).top() - top
+        scroll_bar = self.verticalScrollBar()
+        scroll_bar.setValue(scroll_bar.value() + offset)
+
+    def visibleRows(self):
+        """Returns the first and last visible row (-1, -1 if the view is empty)"""
+        count = self.message_model.rowCount()
+        if count == 0:
+            return -1, -1
+        top = self.indexAt(QtCore.QPoint(1, 1))
+        bottom = self.indexAt(QtCore.QPoint(1, self.viewport().height() - 2))
+        first = top.row() if top.isValid() else 0
+        last = bottom.row() if bottom.isValid() else count - 1
+        return first, last
+
+    def updateEmbeddedWidgets(self):
+        """Opens widgets for visible script/expression rows and closes the others"""
+        first, last = self.visibleRows()
+        if first < 0:
+            return
+        first = max(first - self.EMBEDDED_MARGIN, 0)
+        last = min(last + self.EMBEDDED_MARGIN, self.message_model.rowCount() - 1)
+
+        # Close widgets that scrolled out of view
+        keep = []
+        for persistent in self._embedded:
+            if persistent.isValid() and first <= persistent.row() <= last:
+                keep.append(persistent)
+            elif persistent.isValid():
+                self.closePersistentEditor(QtCore.QModelIndex(persistent))
+        self._embedded = keep
+
+        open_rows = {persistent.row() for persistent in self._embedded}
+        for row in range(first, last + 1):
+            index = self.message_model.index(row)
+            if row not in open_rows and index.data(MessageListModel.KindRole) != "text":
+                self.openPersistentEditor(index)
+                self._embedded.append(QtCore.QPersistentModelIndex(index))
@@ -0,0 +1,198 @@
+"""
+NukeChatOutbox.py
+
+This module provides the outbox used by NukeChat to send messages without blocking
+Nuke's main thread. Messages are persisted to a local outbox file, written to the chat
+store by a background thread and confirmed through Qt signals. Messages that could not
+be written stay in the outbox and are retried with a growing delay. Messages left in the
+outbox by a session that is no longer running are claimed and replayed by another one.
+"""
+
+import os
+import time
+import queue
+import socket
+import threading
+import PySide2.QtCore as QtCore
+from NukeChatStorage import updateJsonFile, processAlive
+
+
+class Outbox(QtCore.QObject):
+    """Send queue drained by a background writer thread"""
+
+    # Emitted with the message id once the message is in the chat store
+    messageSent = QtCore.Signal(str)
+    # Emitted with the message id and the error text if the message could not be written
+    messageFailed = QtCore.Signal(str, str)
+
+    # Seconds after which an entry not touched by its session is considered abandoned (only
+    # used if the owning process can't be checked)
+    ABANDONED_AFTER = 60
+    # Longest wait between two attempts to write a message that keeps failing (seconds)
+    MAX_RETRY_DELAY = 60
+
+    def __init__(self, outbox_file, deliver, parent=None, retries=3):
+        """
+        Initializes the outbox
+
+        Args:
+            outbox_file (str): Local file where queued messages are kept until they are written
+            deliver (callable): Called on the writer thread with a message dict, raises on failure
+            parent (QObject, optional): Parent object
+            retries (int): Number of attempts before a message is reported as failed (it is
+                still retried afterwards)
+        """
+        super(Outbox, self).__init__(parent)
+        self.outbox_file = outbox_file
+        self.deliver = deliver
+        self.retries = retries
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{id(self)}"
+
+        folder = os.path.dirname(self.outbox_file)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+
+        self._queue = queue.Queue()
+        # Failed attempts per message id (only touched by the writer thread)
+        self._attempts = {}
+        self._thread = threading.Thread(target=self._run, name="NukeChatOutbox", daemon=True)
+        self._thread.start()
+
+    def enqueue(self, message):
+        """
+        Persists a message to the outbox and queues it for the writer thread
+
+        Args:
+            message (dict): Message record with a unique "id"
+        """
+        entry = {"owner": self.owner, "touched": time.time(), "message": message}
+
+        def update(entries):
+            entries[message["id"]] = entry
+
+        updateJsonFile(self.outbox_file, update)
+        self._queue.put(message)
+
+    def close(self):
+        """
+        Stops the writer thread
+
+        Messages not written yet stay in the outbox and are released, so the next panel
+        claims them right away.
+        """
+        self._queue.put(None)
+        if not os.path.exists(self.outbox_file):
+            return
+
+        def update(entries):
+            for entry in entries.values():
+                if entry.get("owner") == self.owner:
+                    entry["touched"] = 0
+
+        updateJsonFile(self.outbox_file, update)
+
+    def claimAbandoned(self):
+        """
+        Takes over the messages left in the outbox by sessions that are no longer running
+
+        Returns:
+            list: The claimed message dicts, oldest first (not queued yet)
+        """
+        if not os.path.exists(self.outbox_file):
+            return []
+
+        now = time.time()
+
+        def update(entries):
+            claimed = []
+            for entry in entries.values():
+                if entry.get("owner") != self.owner and self._isAbandoned(entry, now):
+                    entry["owner"] = self.owner
+                    entry["touched"] = now
+                    claimed.append(entry["message"])
+            return claimed
+
+        claimed = updateJsonFile(self.outbox_file, update)
+        return sorted(claimed, key=lambda message: message.get("timestamp", ""))
+
+    def _isAbandoned(self, entry, now):
+        """Returns True if the session owning an outbox entry is no longer running"""
+        host, _, rest = str(entry.get("owner", "")).partition(":")
+        pid = rest.partition(":")[0]
+        if host == socket.gethostname() and pid.isdigit() and int(pid) != os.getpid():
+            return not processAlive(int(pid))
+        # Another machine sharing the home folder, or an earlier panel of this process
+        return now - entry.get("touched", 0) > self.ABANDONED_AFTER
+
+    def replay(self, messages):
+        """Queues already persisted (claimed) messages for the writer thread"""
+        for message in messages:
+            self._queue.put(message)
+
+    def discard(self, message_id):
+        """Removes a message from the outbox file"""
+        def update(entries):
+            entries.pop(message_id, None)
+
+        updateJsonFile(self.outbox_file, update)
+
+    def _touch(self, message_id):
+        """Marks an entry as still being worked on by this session"""
+        def update(entries):
+            if message_id in entries:
+                entries[message_id]["touched"] = time.time()
+
+        updateJsonFile(self.outbox_file, update)
+
+    def _retryLater(self, message, delay):
+        """Queues a message again after delay seconds"""
+        timer = threading.Timer(delay, self._queue.put, (message,))
+        timer.daemon = True
+        timer.start()
+
+    def _run(self):
+        """Writer thread: delivers queued messages one by one"""
+        while True:
+            message = self._queue.get()
+            if message is None:
+                # Closed
+                return
+            message_id = message["id"]
+            error = None
+
+            for attempt in range(self.retries):
+                try:
+                    self.deliver(message)
+                    error = None
+                    break
+                except Exception as e:
+                    error = str(e)
+                    if attempt == self.retries - 1:
+                        break
+                    # Waiting here only delays this message, not Nuke's UI
+                    time.sleep(0.5 * (2 ** attempt))
+                    try:
+                        self._touch(message_id)
+                    except Exception:
+                        pass
+
+            if error is not None:
+                # Keep the entry and retry later, so the message isn't lost while the store is
+                # unreachable. Following messages are not held up meanwhile.
+                failures = self._attempts.get(message_id, 0) + 1
+                self._attempts[message_id] = failures
+                try:
+                    self._touch(message_id)
+                except Exception:
+                    pass
+                self._retryLater(message, min(0.5 * (2 ** (self.retries + failures)), self.MAX_RETRY_DELAY))
+                if failures == 1:
+                    self.messageFailed.emit(message_id, error)
+                continue
+
+            self._attempts.pop(message_id, None)
+            try:
+                self.discard(message_id)
+            except Exception as e:
+                print(f"Error updating outbox: {str(e)}")
+            self.messageSent.emit(message_id)
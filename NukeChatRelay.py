@@ -0,0 +1,430 @@
+"""
+NukeChatRelay.py
+
+This module contains a small relay server for NukeChat and the client used to talk to
+it. Clients keep a TCP connection to the relay, which stores messages in the SQLite
+store and pushes messages, presence and notifications to every connected client right
+away, so no client has to poll the shared folder.
+
+The protocol is newline-delimited JSON. Each client starts with
+{"op": "hello", "user_id", "user", "since"} and receives the messages it missed (or the
+most recent page) in a "welcome" packet before live packets follow.
+
+Run the relay (stdlib only):
+
+    python NukeChatRelay.py [--host 127.0.0.1] [--port 45455] [--db <db folder or :memory:>]
+"""
+
+import os
+import json
+import time
+import socket
+import asyncio
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from NukeChatStorage import SQLiteStore
+
+RELAY_PORT = 45455
+# Longest accepted line (a shared script can be large)
+MAX_LINE_SIZE = 16 * 1024 * 1024
+
+
+def encodePacket(packet):
+    """Converts a packet to one protocol line"""
+    return (json.dumps(packet, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+class RelaySession:
+    """A connected client on the relay server"""
+
+    def __init__(self, writer, queue_size):
+        self.writer = writer
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.user_id = None
+        self.user = None
+        # Live messages are held back until the client has received its backlog
+        self.backlog_sent = False
+        self.held_back = []
+        self.closed = False
+
+    def send(self, packet):
+        """
+        Queues a packet for the client
+
+        Returns:
+            bool: False if the client doesn't keep up (its queue is full) and was dropped
+        """
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait(packet)
+            return True
+        except asyncio.QueueFull:
+            # Backpressure: a slow client is disconnected instead of slowing down everyone.
+            # It reconnects and resumes from its last sequence number.
+            self.close()
+            return False
+
+    def close(self):
+        """Closes the connection"""
+        if not self.closed:
+            self.closed = True
+            self.writer.transport.abort()
+
+
+class RelayServer:
+    """asyncio relay: stores messages and pushes them to all connected clients"""
+
+    def __init__(self, db_file, host="127.0.0.1", port=RELAY_PORT, queue_size=1000, page_size=100):
+        """
+        Initializes the relay server
+
+        Args:
+            db_file (str): SQLite database where messages are persisted (":memory:" for testing)
+            host (str): Address to listen on
+            port (int): TCP port
+            queue_size (int): Packets queued per client before it is dropped as too slow
+            page_size (int): Number of recent messages sent to new clients
+        """
+        self.host = host
+        self.port = port
+        self.queue_size = queue_size
+        self.page_size = page_size
+        self.sessions = set()
+        self.server = None
+        # All store access on one thread, in order (this also lets ":memory:" work, as
+        # SQLiteStore opens one connection per thread)
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.store = self.executor.submit(SQLiteStore, db_file).result()
+
+    async def _store(self, function, *args):
+        """Runs a store call on the store thread"""
+        return await asyncio.get_event_loop().run_in_executor(self.executor, function, *args)
+
+    async def start(self):
+        """Starts listening"""
+        self.server = await asyncio.start_server(self._handleClient, self.host, self.port,
+                                                 limit=MAX_LINE_SIZE)
+        self.port = self.server.sockets[0].getsockname()[1]
+        print(f"NukeChat relay listening on {self.host}:{self.port}")
+
+    async def serve(self):
+        """Starts listening and serves until cancelled"""
+        await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    def onlineUsers(self):
+        """Returns the connected sessions (user_id -> {"user", "last_seen"})"""
+        now = time.time()
+        return {session.user_id: {"user": session.user, "last_seen": now}
+                for session in self.sessions if session.user_id and session.backlog_sent}
+
+    def broadcast(self, packet, exclude=None):
+        """Sends a packet to every connected client"""
+        for session in list(self.sessions):
+            if session is exclude:
+                continue
+            if packet.get("op") == "message" and not session.backlog_sent:
+                session.held_back.append(packet)
+            else:
+                session.send(packet)
+
+    def broadcastPresence(self):
+        """Sends the current online users to every client"""
+        self.broadcast({"op": "presence", "users": self.onlineUsers()})
+
+    async def _handleClient(self, reader, writer):
+        """Serves one client connection"""
+        session = RelaySession(writer, self.queue_size)
+        writer_task = asyncio.ensure_future(self._writeLoop(session))
+        try:
+            hello = json.loads((await reader.readline()).decode("utf-8") or "null")
+            if not isinstance(hello, dict) or hello.get("op") != "hello":
+                return
+            session.user_id = hello.get("user_id")
+            session.user = hello.get("user", "")
+
+            # Register first, so messages sent while the backlog is read are held back
+            # instead of lost
+            self.sessions.add(session)
+            since = hello.get("since")
+            if since is None:
+                limit = int(hello.get("recent", self.page_size))
+                messages = await self._store(self.store.readPage, None, limit)
+                complete = len(messages) < limit
+            else:
+                messages = await self._store(self.store.readSince, int(since))
+                complete = None
+
+            last_seq = messages[-1]["seq"] if messages else int(since or 0)
+            session.send({"op": "welcome", "messages": messages, "complete": complete,
+                          "resumed": since is not None})
+            session.backlog_sent = True
+            for packet in session.held_back:
+                if packet["message"]["seq"] > last_seq:
+                    session.send(packet)
+            session.held_back = []
+            self.broadcastPresence()
+
+            while not session.closed:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    packet = json.loads(line.decode("utf-8"))
+                except ValueError:
+                    session.send({"op": "error", "error": "Invalid packet"})
+                    continue
+                await self._handlePacket(session, packet)
+
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            self.sessions.discard(session)
+            writer_task.cancel()
+            if not session.closed:
+                session.closed = True
+                writer.close()
+            if session.backlog_sent:
+                self.broadcastPresence()
+
+    async def _handlePacket(self, session, packet):
+        """Handles a packet from a client"""
+        op = packet.get("op")
+        if op == "send":
+            message = packet.get("message") or {}
+            try:
+                # A resend after a lost ack must not store the message twice
+                seq = await self._store(self.store.findMessage, message.get("id"))
+                duplicate = seq is not None
+                if not duplicate:
+                    seq = await self._store(self.store.appendMessage, message)
+            except Exception as e:
+                session.send({"op": "ack", "id": message.get("id"), "error": str(e)})
+                return
+
+            session.send({"op": "ack", "id": message.get("id"), "seq": seq})
+            if duplicate:
+                return
+            self.broadcast({"op": "message", "message": dict(message, seq=seq)})
+            if packet.get("notify"):
+                preview = message.get("message", "")
+                preview = preview[:50] + "..." if len(preview) > 50 else preview
+                self.broadcast({"op": "notification", "notification": {
+                    "timestamp": time.time(),
+                    "sender": message.get("user", ""),
+                    "message": preview,
+                    "read": False
+                }}, exclude=session)
+
+        elif op == "history":
+            before = packet.get("before")
+            limit = int(packet.get("limit", self.page_size))
+            messages = await self._store(self.store.readPage, before, limit)
+            session.send({"op": "history", "before": before, "messages": messages,
+                          "complete": len(messages) < limit})
+
+        elif op == "presence":
+            # Name change
+            session.user = packet.get("user", session.user)
+            self.broadcastPresence()
+
+        elif op == "ping":
+            session.send({"op": "pong"})
+
+    async def _writeLoop(self, session):
+        """Writes the queued packets of a client (drain waits while the client is slow)"""
+        try:
+            while True:
+                packet = await session.queue.get()
+                session.writer.write(encodePacket(packet))
+                await session.writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+
+
+class RelayClient:
+    """Connection to a relay server, with automatic reconnect and resume"""
+
+    def __init__(self, host, port, user_id, user, callback, page_size=100):
+        """
+        Initializes the relay client (call start() to connect)
+
+        Args:
+            host (str): Relay host
+            port (int): Relay port
+            user_id (str): Unique ID of the session
+            user (str or callable): User name, or a callable returning it
+            callback (callable): Called on the client thread with every packet except acks
+            page_size (int): Number of recent messages requested on the first connect
+        """
+        self.host = host
+        self.port = port
+        self.user_id = user_id
+        self.user = user
+        self.callback = callback
+        self.page_size = page_size
+
+        # Highest sequence number received, used to resume after a reconnect
+        self.last_seq = None
+        self.connected = threading.Event()
+        self._socket = None
+        self._send_lock = threading.Lock()
+        self._acks = {}
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        """Starts the connection thread"""
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="NukeChatRelay", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """Disconnects and stops reconnecting"""
+        self._running = False
+        self._disconnect()
+
+    def userName(self):
+        """Current user name"""
+        return self.user() if callable(self.user) else self.user
+
+    def sendMessage(self, message, notify=True, timeout=5.0):
+        """
+        Sends a message and waits until the relay has stored it
+
+        Args:
+            message (dict): Message record with a unique "id"
+            notify (bool): Push a notification to the other clients
+            timeout (float): Seconds to wait for the relay
+
+        Returns:
+            int: Sequence number of the message
+
+        Raises:
+            ConnectionError: If the relay is not connected or didn't answer in time
+        """
+        if not self.connected.wait(timeout):
+            raise ConnectionError("Relay not connected")
+
+        waiter = {"event": threading.Event(), "packet": None}
+        self._acks[message["id"]] = waiter
+        try:
+            self._send({"op": "send", "message": message, "notify": notify})
+            if not waiter["event"].wait(timeout):
+                raise ConnectionError("Relay did not confirm the message")
+        finally:
+            self._acks.pop(message["id"], None)
+
+        packet = waiter["packet"]
+        if packet.get("error"):
+            raise ConnectionError(packet["error"])
+        return packet["seq"]
+
+    def requestHistory(self, before, limit=None):
+        """Asks for the messages before a sequence number (answered with a "history" packet)"""
+        self._send({"op": "history", "before": before, "limit": limit or self.page_size})
+
+    def updatePresence(self):
+        """Sends the current user name (after it was changed)"""
+        self._send({"op": "presence", "user": self.userName()})
+
+    def _send(self, packet):
+        """Writes a packet to the relay"""
+        with self._send_lock:
+            if self._socket is None:
+                raise ConnectionError("Relay not connected")
+            self._socket.sendall(encodePacket(packet))
+
+    def _disconnect(self):
+        """Closes the socket"""
+        self.connected.clear()
+        with self._send_lock:
+            if self._socket is not None:
+                try:
+                    # shutdown also ends the read loop, which holds its own file object
+                    self._socket.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                try:
+                    self._socket.close()
+                except OSError:
+                    pass
+                self._socket = None
+
+    def _run(self):
+        """Client thread: connects, reads packets and reconnects with backoff"""
+        delay = 1.0
+        while self._running:
+            try:
+                sock = socket.create_connection((self.host, self.port), timeout=5)
+                sock.settimeout(None)
+                with self._send_lock:
+                    self._socket = sock
+                self._send({"op": "hello", "user_id": self.user_id, "user": self.userName(),
+                            "since": self.last_seq, "recent": self.page_size})
+                self.connected.set()
+                delay = 1.0
+
+                with sock.makefile("rb") as stream:
+                    for line in stream:
+                        self._dispatch(json.loads(line.decode("utf-8")))
+            except (OSError, ValueError) as e:
+                if self._running:
+                    print(f"NukeChat relay connection lost: {str(e)}")
+            finally:
+                self._disconnect()
+
+            if self._running:
+                time.sleep(delay)
+                delay = min(delay * 2, 10.0)
+
+    def _dispatch(self, packet):
+        """Handles a packet from the relay"""
+        op = packet.get("op")
+        if op == "ack":
+            waiter = self._acks.get(packet.get("id"))
+            if waiter is not None:
+                waiter["packet"] = packet
+                waiter["event"].set()
+            return
+
+        if op == "welcome" and packet["messages"]:
+            self.last_seq = max(self.last_seq or 0, packet["messages"][-1]["seq"])
+        elif op == "welcome" and self.last_seq is None:
+            self.last_seq = 0
+        elif op == "message":
+            seq = packet["message"]["seq"]
+            if self.last_seq is not None and seq <= self.last_seq:
+                return
+            self.last_seq = seq
+
+        self.callback(packet)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NukeChat relay server")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on (0.0.0.0 for the LAN)")
+    parser.add_argument("--port", type=int, default=RELAY_PORT, help="TCP port")
+    parser.add_argument("--db", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "db"),
+                        help="db folder (the messages go to nukechat.db) or :memory: for testing")
+    args = parser.parse_args()
+
+    if args.db == ":memory:":
+        db_file = ":memory:"
+    else:
+        if not os.path.exists(args.db):
+            os.makedirs(args.db)
+        db_file = os.path.join(args.db, "nukechat.db")
+
+    server = RelayServer(db_file, args.host, args.port)
+    try:
+        asyncio.run(server.serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+"""
+NukeChatScheduler.py
+
+This module provides the scheduler that runs NukeChat's periodic jobs (message checks,
+notifications, presence, online users, history pages). Instead of one QTimer per job doing
+its own file I/O on the GUI thread, a single timer collects the due jobs into one tick,
+runs their I/O on a background thread and hands the results back to the GUI thread.
+Jobs in the same tick share a read cache, so a file read by several jobs is read once.
+"""
+
+import os
+import time
+import queue
+import threading
+import PySide2.QtCore as QtCore
+from NukeChatStorage import readJson
+
+
+class TickContext:
+    """Read cache shared by the jobs of one scheduler tick"""
+
+    def __init__(self):
+        self._cache = {}
+
+    def readJson(self, path, default=None):
+        """
+        Reads a JSON file once per tick
+
+        The returned data is shared with the other jobs of the tick and must not be modified.
+        """
+        key = ("json", path)
+        if key not in self._cache:
+            self._cache[key] = readJson(path, None)
+        data = self._cache[key]
+        return default if data is None else data
+
+    def stat(self, path):
+        """Returns os.stat of a file once per tick (None if it doesn't exist)"""
+        key = ("stat", path)
+        if key not in self._cache:
+            try:
+                self._cache[key] = os.stat(path)
+            except OSError:
+                self._cache[key] = None
+        return self._cache[key]
+
+    def invalidate(self, path):
+        """Forgets the cached data of a file after a job has written it"""
+        self._cache.pop(("json", path), None)
+        self._cache.pop(("stat", path), None)
+
+
+class ScheduledJob:
+    """A periodic job: I/O part on the worker thread, apply part on the GUI thread"""
+
+    def __init__(self, name, interval, io=None, apply=None):
+        self.name = name
+        self.interval = interval
+        self.io = io
+        self.apply = apply
+        self.enabled = True
+        # Jobs without an interval only run when triggered
+        self.next_run = 0.0 if interval is not None else float("inf")
+
+        # Timing statistics in milliseconds
+        self.runs = 0
+        self.errors = 0
+        self.last_error = None
+        self.io_last = self.io_total = self.io_max = 0.0
+        self.apply_last = self.apply_total = self.apply_max = 0.0
+
+    def intervalSeconds(self):
+        """Current interval in seconds (the interval may be a callable returning ms)"""
+        if self.interval is None:
+            return float("inf")
+        interval = self.interval() if callable(self.interval) else self.interval
+        return interval / 1000.0
+
+
+class IOScheduler(QtCore.QObject):
+    """Runs periodic jobs in batched ticks with their file I/O off the GUI thread"""
+
+    # Internal: a finished batch, delivered to the GUI thread
+    _batchFinished = QtCore.Signal(object)
+
+    def __init__(self, parent=None, tick=250):
+        """
+        Initializes the scheduler
+
+        Args:
+            parent (QObject, optional): Parent object
+            tick (int): How often due jobs are collected (ms)
+        """
+        super(IOScheduler, self).__init__(parent)
+        self.jobs = []
+        self._jobs_by_name = {}
+        self._busy = False
+        self._stopped = False
+
+        self._batchFinished.connect(self._onBatchFinished)
+
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="NukeChatScheduler", daemon=True)
+        self._thread.start()
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.timeout.connect(self._tick)
+        self.timer.start(tick)
+
+    def addJob(self, name, interval, io=None, apply=None):
+        """
+        Registers a periodic job
+
+        Args:
+            name (str): Unique job name (used in statistics and trigger())
+            interval (int or callable): Interval in ms, or a callable returning it
+                (None for a job that only runs when triggered)
+            io (callable, optional): Called on the worker thread with a TickContext, returns a result
+            apply (callable, optional): Called on the GUI thread with the io result
+                (without arguments if the job has no io part)
+        """
+        job = ScheduledJob(name, interval, io, apply)
+        self.jobs.append(job)
+        self._jobs_by_name[name] = job
+        return job
+
+    def setJobEnabled(self, name, enabled):
+        """Enables or disables a job"""
+        self._jobs_by_name[name].enabled = enabled
+
+    def trigger(self, name):
+        """Runs a job as soon as possible instead of waiting for its interval"""
+        self._jobs_by_name[name].next_run = 0.0
+        QtCore.QTimer.singleShot(0, self._tick)
+
+    def stop(self):
+        """Stops running jobs and ends the worker thread"""
+        self._stopped = True
+        self._queue.put(None)
+
+    def stats(self):
+        """Returns the timing statistics of every job (times in ms)"""
+        result = {}
+        for job in self.jobs:
+            runs = max(job.runs, 1)
+            result[job.name] = {
+                "runs": job.runs,
+                "errors": job.errors,
+                "last_error": job.last_error,
+                "io_last": job.io_last,
+                "io_avg": job.io_total / runs,
+                "io_max": job.io_max,
+                "apply_last": job.apply_last,
+                "apply_avg": job.apply_total / runs,
+                "apply_max": job.apply_max,
+            }
+        return result
+
+    def report(self):
+        """Returns the timing statistics as a text table"""
+        lines = [f"{'job':<16}{'runs':>7}{'io avg':>10}{'io max':>10}{'gui avg':>10}{'gui max':>10}"]
+        for name, data in self.stats().items():
+            lines.append(f"{name:<16}{data['runs']:>7}{data['io_avg']:>10.2f}{data['io_max']:>10.2f}"
+                         f"{data['apply_avg']:>10.2f}{data['apply_max']:>10.2f}")
+        return "\n".join(lines)
+
+    def _tick(self):
+        """Collects the due jobs and sends them to the worker thread as one batch"""
+        if self._stopped or self._busy:
+            # Previous batch is still running, overlapping batches would read the same files
+            return
+
+        now = time.time()
+        due = [job for job in self.jobs if job.enabled and job.next_run <= now]
+        if not due:
+            return
+
+        for job in due:
+            job.next_run = now + job.intervalSeconds()
+
+        self._busy = True
+        self._queue.put(due)
+
+    def _run(self):
+        """Worker thread: runs the I/O part of each batch with a shared read cache"""
+        while True:
+            batch = self._queue.get()
+            if batch is None:
+                return
+            context = TickContext()
+            results = []
+            for job in batch:
+                result, error = None, None
+                start = time.perf_counter()
+                if job.io is not None:
+                    try:
+                        result = job.io(context)
+                    except Exception as e:
+                        error = e
+                results.append((job, result, error, (time.perf_counter() - start) * 1000.0))
+            self._batchFinished.emit(results)
+
+    def _onBatchFinished(self, results):
+        """GUI thread: applies the results of a batch and records the timings"""
+        self._busy = False
+        if self._stopped:
+            return
+        for job, result, error, io_time in results:
+            job.runs += 1
+            job.io_last = io_time
+            job.io_total += io_time
+            job.io_max = max(job.io_max, io_time)
+
+            if error is not None:
+                job.errors += 1
+                job.last_error = str(error)
+                print(f"NukeChat job '{job.name}' error: {str(error)}")
+                continue
+
+            if job.apply is None:
+                continue
+
+            start = time.perf_counter()
+            try:
+                if job.io is not None:
+                    job.apply(result)
+                else:
+                    job.apply()
+            except Exception as e:
+                job.errors += 1
+                job.last_error = str(e)
+                print(f"NukeChat job '{job.name}' error: {str(e)}")
+            apply_time = (time.perf_counter() - start) * 1000.0
+            job.apply_last = apply_time
+            job.apply_total += apply_time
+            job.apply_max = max(job.apply_max, apply_time)
+
+        # Jobs triggered while this batch was running
+        if any(job.enabled and job.next_run == 0.0 for job in self.jobs):
+            QtCore.QTimer.singleShot(0, self._tick)
@@ -0,0 +1,459 @@
+"""
+NukeChatSearch.py
+
+This module contains the message search of NukeChat. SearchIndex is an inverted index
+of the message journal (term -> byte offsets of the messages containing it). It is built
+once, updated with the messages appended since, and saved next to the journal, so a new
+session starts with a warm index and a search only reads the matching messages. A session
+only rewrites the saved index if it is behind its own.
+
+Shared Nuke scripts are decoded once when a message is indexed: node classes, node
+names and knob values are added as field terms ("class:grade", "file:/shots/...").
+
+Search box syntax (all parts must match):
+
+    grade comp          messages with words starting with "grade" and "comp"
+    from:john           messages of users whose name contains "john"
+    after:2024-05-01    messages sent on or after a date ("YYYY-MM-DD[ HH:MM:SS]")
+    before:2024-06-01   messages sent before a date
+    class:Tracker4      shared scripts with a node of this class
+    node:Grade1         shared scripts with a node of this name
+    file:/shots/abc     shared scripts reading or writing a path starting with this
+                        (or a file name starting with it)
+    knob:size=10        shared scripts with a knob set to a value (knob:size: knob is set)
+"""
+
+import os
+import re
+import json
+import time
+import base64
+import shlex
+import bisect
+import threading
+from collections import OrderedDict
+from NukeChatStorage import FileLock, atomicWriteJson, readJson
+
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+# Shared scripts are base64 blobs, their text is not indexed
+SCRIPT_PATTERN = re.compile(r"\[SCRIPT_DATA\].*?\[/SCRIPT_DATA\]", re.DOTALL)
+# Longer tokens (hashes, encoded data) are not indexed
+MAX_TERM_LENGTH = 40
+
+# Query operators that search inside shared scripts
+SCRIPT_FIELDS = ("class", "node", "file", "knob")
+# Knobs whose values are file paths
+FILE_KNOBS = {"file", "proxy", "vfield_file", "filename"}
+# Knobs whose values are not indexed (layout only)
+IGNORED_KNOBS = {"xpos", "ypos", "selected"}
+# Longer knob values (curves, embedded data) are not indexed
+MAX_VALUE_LENGTH = 200
+# A node block starts with "Class {" on its own line
+NODE_HEADER = re.compile(r"^\s*([A-Za-z_][\w.]*)\s*\{\s*$")
+# Start of a saved index, read without loading the whole file
+SAVED_HEADER = re.compile(r'\{"version":(\d+),"offset":(\d+),')
+
+
+def tokenize(text):
+    """Returns the set of lowercase terms of a message text"""
+    text = SCRIPT_PATTERN.sub(" ", text)
+    return {term for term in TOKEN_PATTERN.findall(text.lower()) if len(term) <= MAX_TERM_LENGTH}
+
+
+def decodeScriptPayloads(text):
+    """Returns the script data (dict) of every [SCRIPT_DATA] block in a message text"""
+    payloads = []
+    for match in SCRIPT_PATTERN.finditer(text):
+        encoded = match.group(0)[len("[SCRIPT_DATA]"):-len("[/SCRIPT_DATA]")]
+        try:
+            script_data = json.loads(base64.b64decode(encoded.encode("utf-8")).decode("utf-8"))
+        except ValueError:
+            continue
+        if isinstance(script_data, dict):
+            payloads.append(script_data)
+    return payloads
+
+
+def parseNukeScript(script):
+    """
+    Reads the node blocks of a Nuke script (.nk text)
+
+    Returns:
+        list: (node class, {knob: value}) per node; values spanning several lines are
+            left out
+    """
+    nodes = []
+    current = None
+    depth = 0
+    for line in script.splitlines():
+        if current is None:
+            match = NODE_HEADER.match(line)
+            if match:
+                current = (match.group(1), {})
+                depth = 1
+            continue
+
+        if depth == 1:
+            stripped = line.strip()
+            if stripped == "}":
+                nodes.append(current)
+                current = None
+                continue
+            knob, _, value = stripped.partition(" ")
+            value = value.strip()
+            if knob and value and value.count("{") == value.count("}"):
+                current[1][knob] = value
+
+        # Multi-line values are skipped until their braces are closed
+        depth += line.count("{") - line.count("}")
+        if depth <= 0:
+            nodes.append(current)
+            current = None
+
+    return nodes
+
+
+def scriptTerms(script_data):
+    """Returns the field terms and words of a shared script (classes, names, knob values)"""
+    terms = tokenize(str(script_data.get("description", "")))
+    script = script_data.get("script", "")
+    if not isinstance(script, str):
+        return terms
+
+    for node_class, knobs in parseNukeScript(script):
+        terms.add(f"class:{node_class.lower()}")
+        terms.update(tokenize(node_class))
+
+        for knob, value in knobs.items():
+            knob = knob.lower()
+            value = value.strip('"{} ').lower()
+            if knob == "name":
+                terms.add(f"node:{value}")
+                terms.update(tokenize(value))
+            terms.add(f"knob:{knob}")
+            if knob in IGNORED_KNOBS or not value or len(value) > MAX_VALUE_LENGTH:
+                continue
+            terms.add(f"knob:{knob}={value}")
+            if knob in FILE_KNOBS:
+                terms.add(f"file:{value}")
+                terms.add(f"file:{os.path.basename(value)}")
+                terms.update(tokenize(value))
+    return terms
+
+
+def _messageTerms(message):
+    """Returns all terms of a message: its words plus the terms of its shared scripts"""
+    text = message.get("message", "")
+    terms = tokenize(text)
+    if "[SCRIPT_DATA]" in text:
+        for script_data in decodeScriptPayloads(text):
+            terms.update(scriptTerms(script_data))
+    return terms
+
+
+# Terms of recently matched messages, so filtering in memory decodes each script once
+_terms_cache = OrderedDict()
+_terms_cache_lock = threading.Lock()
+TERMS_CACHE_SIZE = 2000
+
+
+def messageTerms(message):
+    """Returns the terms of a message (cached by message id)"""
+    key = message.get("id")
+    if key is None:
+        return _messageTerms(message)
+    with _terms_cache_lock:
+        terms = _terms_cache.get(key)
+        if terms is not None:
+            _terms_cache.move_to_end(key)
+            return terms
+    terms = _messageTerms(message)
+    with _terms_cache_lock:
+        _terms_cache[key] = terms
+        while len(_terms_cache) > TERMS_CACHE_SIZE:
+            _terms_cache.popitem(last=False)
+    return terms
+
+
+class SearchQuery:
+    """A parsed search box query plus the user filter of the panel"""
+
+    def __init__(self, text="", user=None, exclude_user=None):
+        """
+        Parses a query
+
+        Args:
+            text (str): Search box text
+            user (str, optional): Only messages of this user
+            exclude_user (str, optional): Only messages not sent by this user
+        """
+        self.text = text
+        self.user = user
+        self.exclude_user = exclude_user
+        self.terms = []
+        self.from_user = None
+        self.since = None
+        self.until = None
+
+        try:
+            parts = shlex.split(text)
+        except ValueError:
+            # Unbalanced quotes
+            parts = text.split()
+
+        for part in parts:
+            name, _, value = part.partition(":")
+            name = name.lower()
+            if value and name == "from":
+                self.from_user = value.lower()
+            elif value and name == "after":
+                self.since = value
+            elif value and name == "before":
+                self.until = value
+            elif value and name in SCRIPT_FIELDS:
+                term = f"{name}:{value.lower()}"
+                if term not in self.terms:
+                    self.terms.append(term)
+            else:
+                for term in TOKEN_PATTERN.findall(part.lower()):
+                    if term not in self.terms:
+                        self.terms.append(term)
+
+    def wordTerms(self):
+        """Returns the terms that are plain words (not script fields)"""
+        return [term for term in self.terms if ":" not in term]
+
+    def isEmpty(self):
+        """Returns True if the query matches every message"""
+        return not (self.terms or self.from_user or self.since or self.until
+                    or self.user is not None or self.exclude_user is not None)
+
+    def matchesMeta(self, user, timestamp):
+        """Returns True if a message of this user and time passes the filters"""
+        if self.user is not None and user != self.user:
+            return False
+        if self.exclude_user is not None and user == self.exclude_user:
+            return False
+        if self.from_user and self.from_user not in user.lower():
+            return False
+        if self.since and timestamp < self.since:
+            return False
+        if self.until and timestamp >= self.until:
+            return False
+        return True
+
+    def matches(self, message):
+        """Returns True if a message matches the query (without an index)"""
+        if not self.matchesMeta(message.get("user", ""), message.get("timestamp", "")):
+            return False
+        if not self.terms:
+            return True
+        tokens = messageTerms(message)
+        for term in self.terms:
+            if term not in tokens and not any(token.startswith(term) for token in tokens):
+                return False
+        return True
+
+
+def anchorKey(message):
+    """Returns a string identifying a message, used to check that the journal wasn't replaced"""
+    return json.dumps([message.get("id"), message.get("seq"), message.get("user"), message.get("timestamp")])
+
+
+class SearchIndex:
+    """Inverted index of a message journal: term -> offsets of the messages containing it"""
+
+    VERSION = 2
+    # Seconds between saves of an index that was updated (only if the saved one is behind)
+    SAVE_INTERVAL = 300
+
+    def __init__(self, index_file=None):
+        """
+        Initializes an empty index (it is loaded or built by the first update())
+
+        Args:
+            index_file (str, optional): JSON file the index is saved to and loaded from
+        """
+        self.index_file = index_file
+        self.loaded = False
+        self.dirty = False
+        self.last_save = 0
+        self._lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        """Removes all messages from the index"""
+        self.terms = {}
+        # offset -> (user, timestamp), used by the filters
+        self.docs = {}
+        # Journal offset up to which messages are indexed
+        self.offset = 0
+        # (offset, anchorKey) of the last indexed message
+        self.anchor = None
+        self._sorted_terms = None
+
+    def load(self):
+        """Loads the saved index, returns False if there is none or it can't be used"""
+        data = readJson(self.index_file, None)
+        if not isinstance(data, dict) or data.get("version") != self.VERSION:
+            return False
+        try:
+            docs = {int(offset): (user, timestamp) for offset, user, timestamp in data["docs"]}
+            terms = {term: list(offsets) for term, offsets in data["terms"].items()}
+            offset = int(data["offset"])
+            anchor = tuple(data["anchor"]) if data.get("anchor") else None
+        except (KeyError, TypeError, ValueError):
+            return False
+
+        self.docs, self.terms, self.offset, self.anchor = docs, terms, offset, anchor
+        self._sorted_terms = None
+        self.last_save = time.time()
+        return True
+
+    def savedOffset(self):
+        """Returns the journal offset of the saved index (-1 if there is none usable)"""
+        try:
+            with open(self.index_file, 'r', encoding='utf-8') as file:
+                header = file.read(64)
+        except OSError:
+            return -1
+        match = SAVED_HEADER.match(header)
+        if match is None or int(match.group(1)) != self.VERSION:
+            return -1
+        return int(match.group(2))
+
+    def save(self, force=False):
+        """
+        Writes the index next to the journal (other sessions then start with it)
+
+        The shared file is only rewritten if it indexes less of the journal than this
+        session, so sessions don't all rewrite it with the same contents.
+
+        Args:
+            force (bool): Also write if the saved index is not behind (it was rebuilt
+                because the journal was replaced)
+
+        Returns:
+            bool: True if the file was written
+        """
+        with self._lock, FileLock(self.index_file):
+            if not force and self.savedOffset() >= self.offset:
+                # Another session saved it already
+                self.dirty = False
+                self.last_save = time.time()
+                return False
+
+            data = {
+                "version": self.VERSION,
+                "offset": self.offset,
+                "anchor": list(self.anchor) if self.anchor else None,
+                "docs": [[offset, user, timestamp] for offset, (user, timestamp) in self.docs.items()],
+                "terms": self.terms
+            }
+            atomicWriteJson(self.index_file, data, separators=(",", ":"))
+            self.dirty = False
+            self.last_save = time.time()
+            return True
+
+    def addMessage(self, offset, message):
+        """Adds a message that starts at a journal offset"""
+        self.docs[offset] = (message.get("user", ""), message.get("timestamp", ""))
+        for term in _messageTerms(message):
+            postings = self.terms.get(term)
+            if postings is None:
+                self.terms[term] = [offset]
+                if self._sorted_terms is not None:
+                    bisect.insort(self._sorted_terms, term)
+            else:
+                postings.append(offset)
+        self.anchor = (offset, anchorKey(message))
+
+    def update(self, journal, save=True):
+        """
+        Indexes the messages appended to the journal since the last update
+
+        The saved index is loaded on the first call. If the journal was replaced, it is
+        indexed again from the beginning.
+
+        Args:
+            journal (MessageJournal): Journal to index
+            save (bool): Save the index if it was rebuilt or SAVE_INTERVAL has passed
+
+        Returns:
+            int: Number of messages added
+        """
+        with self._lock:
+            first = not self.loaded
+            if first:
+                self.loaded = True
+                if not self.index_file or not self.load():
+                    self.clear()
+
+            try:
+                size = os.path.getsize(journal.journal_file)
+            except OSError:
+                return 0
+            if size == self.offset and not first:
+                # Nothing new - a single stat call
+                return 0
+
+            if size < self.offset or not self._anchorValid(journal):
+                self.clear()
+
+            count = 0
+            rebuilt = self.offset == 0
+            while True:
+                records, offset = journal.readRecords(self.offset)
+                if offset == self.offset:
+                    break
+                for record_offset, message in records:
+                    self.addMessage(record_offset, message)
+                count += len(records)
+                self.offset = offset
+
+            if count:
+                self.dirty = True
+            if save and self.index_file and self.dirty and (rebuilt or time.time() - self.last_save > self.SAVE_INTERVAL):
+                try:
+                    self.save(force=rebuilt)
+                except Exception as e:
+                    print(f"Error saving search index: {str(e)}")
+            return count
+
+    def search(self, query):
+        """Returns the journal offsets of the messages matching a SearchQuery, oldest first"""
+        with self._lock:
+            if query.terms:
+                result = None
+                # Longer terms match fewer messages, start with them
+                for term in sorted(query.terms, key=len, reverse=True):
+                    offsets = self._matchPrefix(term)
+                    result = offsets if result is None else result & offsets
+                    if not result:
+                        return []
+            else:
+                result = self.docs.keys()
+
+            return sorted(offset for offset in result if query.matchesMeta(*self.docs[offset]))
+
+    def _matchPrefix(self, prefix):
+        """Returns the offsets of the messages containing a term that starts with prefix"""
+        if self._sorted_terms is None:
+            self._sorted_terms = sorted(self.terms)
+        offsets = set()
+        index = bisect.bisect_left(self._sorted_terms, prefix)
+        while index < len(self._sorted_terms) and self._sorted_terms[index].startswith(prefix):
+            offsets.update(self.terms[self._sorted_terms[index]])
+            index += 1
+        return offsets
+
+    def _anchorValid(self, journal):
+        """Returns True if the last indexed message is still where it was indexed"""
+        if self.anchor is None:
+            return self.offset == 0
+        offset, key = self.anchor
+        try:
+            messages = journal.readAt([offset])
+        except OSError:
+            return False
+        return bool(messages) and anchorKey(messages[0]) == key
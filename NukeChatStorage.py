@@ -0,0 +1,1167 @@
+"""
+NukeChatStorage.py
+
+This module contains the storage layer used by NukeChat for chat history.
+Messages are kept in an append-only journal (one JSON record per line), so sending
+a message only writes the new record instead of rewriting the whole history. Every
+record gets a unique id and a monotonic sequence number, so readers can resume with
+"messages since N".
+
+Presence is kept as one heartbeat file per session in a shared folder, so sessions
+never write the same file.
+
+An optional SQLite store (WAL mode on local disks) keeps messages, presence and notifications in
+indexed tables and can import the existing JSON files once.
+
+All read-modify-write updates of the shared JSON files go through FileLock and
+atomicWriteJson, so concurrent sessions never lose each other's updates.
+"""
+
+import os
+import sys
+import json
+import uuid
+import hashlib
+import time
+import socket
+import sqlite3
+import threading
+
+
+# File system types that are mounted over the network (Linux /proc/mounts names)
+NETWORK_FILESYSTEMS = {
+    "nfs", "nfs4", "cifs", "smbfs", "smb3", "afpfs", "ncpfs", "9p",
+    "fuse.sshfs", "fuse.gvfsd-fuse", "davfs", "glusterfs", "ceph", "lustre"
+}
+
+
+def isNetworkPath(path):
+    """
+    Returns True if the path is on a network mount
+
+    If the type of the mount can't be determined, the path is treated as a network path,
+    so polling is used as the safe choice.
+    """
+    path = os.path.abspath(path)
+
+    if sys.platform.startswith("win"):
+        if path.startswith("\\\\") or path.startswith("//"):
+            return True  # UNC path
+        try:
+            import ctypes
+            DRIVE_REMOTE = 4
+            root = os.path.splitdrive(path)[0] + "\\"
+            return ctypes.windll.kernel32.GetDriveTypeW(root) == DRIVE_REMOTE
+        except Exception:
+            return True
+
+    try:
+        # Find the mount point with the longest matching prefix
+        best_mount, best_type = "", None
+        with open("/proc/mounts", 'r') as file:
+            for line in file:
+                parts = line.split()
+                if len(parts) < 3:
+                    continue
+                mount_point = parts[1].replace("\\040", " ")
+                if path == mount_point or path.startswith(mount_point.rstrip("/") + "/"):
+                    if len(mount_point) >= len(best_mount):
+                        best_mount, best_type = mount_point, parts[2]
+        return best_type is None or best_type in NETWORK_FILESYSTEMS
+    except Exception:
+        # No /proc/mounts (e.g. macOS)
+        return True
+
+
+class LockTimeout(Exception):
+    """Raised when a file lock could not be acquired in time"""
+
+
+def processAlive(pid):
+    """Returns True if a process with this id is running on this machine"""
+    if pid == os.getpid():
+        return True
+    if sys.platform == "win32":
+        # os.kill(pid, 0) would terminate the process on Windows
+        import ctypes
+        kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+        PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+        STILL_ACTIVE = 259
+        handle = kernel32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+        if not handle:
+            # Access denied: the process exists but belongs to another user
+            return ctypes.get_last_error() == 5
+        try:
+            exit_code = ctypes.c_ulong()
+            if not kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code)):
+                return True
+            return exit_code.value == STILL_ACTIVE
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    except OSError:
+        return False
+    return True
+
+
+class FileLock:
+    """
+    Cross-process advisory lock using a lock file next to the protected file
+
+    The lock file is created with O_EXCL, which is atomic on local disks as well as
+    SMB/NFS shares (unlike fcntl locks on network mounts). A lock file older than
+    stale_after seconds is left over from a crashed session and is removed (unless its
+    owner is still running on this machine).
+    """
+
+    def __init__(self, path, timeout=10.0, stale_after=30.0):
+        """
+        Initializes the lock
+
+        Args:
+            path (str): Path of the file to protect (the lock file is path + ".lock")
+            timeout (float): Seconds to wait for the lock before raising LockTimeout
+            stale_after (float): Age in seconds after which a lock file is considered stale
+        """
+        self.lock_file = f"{path}.lock"
+        self.timeout = timeout
+        self.stale_after = stale_after
+        self.locked = False
+
+    def acquire(self):
+        """Waits until the lock is acquired"""
+        deadline = time.time() + self.timeout
+        delay = 0.005
+        while True:
+            try:
+                fd = os.open(self.lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if self._removeIfStale():
+                    continue
+                if time.time() >= deadline:
+                    raise LockTimeout(f"Could not lock {self.lock_file}")
+                # Only waits while another session holds the lock (usually a few ms)
+                time.sleep(delay)
+                delay = min(delay * 2, 0.05)
+                continue
+
+            try:
+                os.write(fd, f"{socket.gethostname()} {os.getpid()} {time.time()}".encode('utf-8'))
+            finally:
+                os.close(fd)
+            self.locked = True
+            return
+
+    def release(self):
+        """Releases the lock"""
+        if self.locked:
+            self.locked = False
+            try:
+                os.remove(self.lock_file)
+            except OSError:
+                pass
+
+    def _isStale(self, path):
+        """Returns True if a lock file is older than stale_after and its owner is not running"""
+        age = time.time() - os.path.getmtime(path)
+        if age < self.stale_after:
+            return False
+        try:
+            with open(path, 'r', encoding='utf-8') as file:
+                host, pid = file.read().split()[:2]
+        except (OSError, ValueError):
+            return True
+        if host == socket.gethostname() and pid.isdigit():
+            # Held for long by a session that is still running on this machine
+            return not processAlive(int(pid))
+        return True
+
+    def _removeIfStale(self):
+        """Removes the lock file if it was left behind by a crashed session"""
+        try:
+            if not self._isStale(self.lock_file):
+                return False
+        except OSError:
+            # Lock was released in the meantime
+            return True
+
+        # Several sessions can find the same lock stale. Renaming it is atomic, so only one
+        # of them gets it; that one checks again that it didn't take a lock that was
+        # created fresh in the meantime before deleting it.
+        claimed_file = f"{self.lock_file}.{socket.gethostname()}.{os.getpid()}.{threading.get_ident()}.stale"
+        try:
+            os.rename(self.lock_file, claimed_file)
+        except OSError:
+            # Taken by another session (or released)
+            return True
+
+        try:
+            stale = self._isStale(claimed_file)
+        except OSError:
+            stale = True
+        if stale:
+            print(f"Removed stale lock: {self.lock_file}")
+        else:
+            # A live lock: put it back unless the lock was taken again meanwhile
+            try:
+                if sys.platform == "win32":
+                    # Doesn't replace an existing file on Windows
+                    os.rename(claimed_file, self.lock_file)
+                else:
+                    os.link(claimed_file, self.lock_file)
+            except OSError:
+                pass
+        try:
+            os.remove(claimed_file)
+        except OSError:
+            pass
+        return True
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+def replaceFile(temp_file, target_file, attempts=10):
+    """Atomically replaces target_file with temp_file (retries while a reader has it open on Windows)"""
+    for attempt in range(attempts):
+        try:
+            os.replace(temp_file, target_file)
+            return
+        except PermissionError:
+            if attempt == attempts - 1:
+                raise
+            time.sleep(0.02)
+
+
+def atomicWriteJson(path, data, **kwargs):
+    """
+    Writes JSON data to a temporary file and moves it over path
+
+    Readers see either the old or the new file, never a partially written one.
+    """
+    temp_file = f"{path}.{socket.gethostname()}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(temp_file, 'w', encoding='utf-8') as file:
+            json.dump(data, file, ensure_ascii=False, **kwargs)
+        replaceFile(temp_file, path)
+    except Exception:
+        if os.path.exists(temp_file):
+            try:
+                os.remove(temp_file)
+            except OSError:
+                pass
+        raise
+
+
+def updateJsonFile(path, update, default=dict, **kwargs):
+    """
+    Locked read-modify-write of a JSON file
+
+    Args:
+        path (str): JSON file path
+        update (callable): Called with the current data, modifies it in place and returns a result
+        default (callable): Creates the data if the file is missing or damaged
+
+    Returns:
+        The value returned by update
+    """
+    with FileLock(path):
+        data = readJson(path, None)
+        if data is None:
+            data = default()
+        result = update(data)
+        atomicWriteJson(path, data, **kwargs)
+    return result
+
+
+class MessageJournal:
+    """Append-only message journal stored as JSON Lines"""
+
+    def __init__(self, journal_file, legacy_file=None):
+        """
+        Initializes the message journal
+
+        Args:
+            journal_file (str): Path of the journal file (one JSON message per line)
+            legacy_file (str, optional): Path of the old JSON array history file
+        """
+        self.journal_file = journal_file
+        self.legacy_file = legacy_file
+        # ((device, inode, size), seq) of the last message, so appending doesn't re-read it
+        self._last_seq = None
+
+        # Convert the old JSON array history once, the first time the journal is used
+        self.migrateLegacy()
+
+    def migrateLegacy(self):
+        """Copies messages from the old JSON array file into the journal if it doesn't exist yet"""
+        if os.path.exists(self.journal_file):
+            return False
+        if not self.legacy_file or not os.path.exists(self.legacy_file):
+            return False
+
+        try:
+            with open(self.legacy_file, 'r', encoding='utf-8') as file:
+                messages = json.load(file)
+        except Exception as e:
+            print(f"Error reading legacy chat history: {str(e)}")
+            return False
+
+        if not isinstance(messages, list):
+            return False
+
+        # Write to a temporary file first so other sessions never see a half-migrated journal.
+        # The legacy file is left untouched as a backup.
+        temp_file = f"{self.journal_file}.{os.getpid()}.tmp"
+        try:
+            with FileLock(self.journal_file):
+                if os.path.exists(self.journal_file):
+                    # Another session migrated in the meantime
+                    return False
+                with open(temp_file, 'wb') as file:
+                    seq = 0
+                    for message in messages:
+                        if not isinstance(message, dict):
+                            continue
+                        seq += 1
+                        record = dict(message, seq=seq)
+                        record.setdefault("id", uuid.uuid4().hex)
+                        file.write(self._encode(record).encode('utf-8'))
+                replaceFile(temp_file, self.journal_file)
+            print(f"Chat history migrated to journal: {self.journal_file}")
+            return True
+        except Exception as e:
+            print(f"Error migrating chat history: {str(e)}")
+            if os.path.exists(temp_file):
+                try:
+                    os.remove(temp_file)
+                except OSError:
+                    pass
+            return False
+
+    def ensureExists(self):
+        """Creates an empty journal file if it doesn't exist"""
+        if not os.path.exists(self.journal_file):
+            with open(self.journal_file, 'ab'):
+                pass
+
+    def appendMessage(self, message):
+        """
+        Appends a single message to the end of the journal
+
+        Args:
+            message (dict): Message record ({"id", "user", "message", "timestamp"})
+
+        Returns:
+            int: Sequence number of the message (an id is added if the message has none)
+        """
+        # A single write of one complete line in append mode, so the cost doesn't depend
+        # on the size of the history. The lock keeps lines from different sessions from
+        # interleaving on network shares and makes the sequence numbers unique.
+        with FileLock(self.journal_file):
+            record = dict(message, seq=self.lastSeq() + 1)
+            record.setdefault("id", uuid.uuid4().hex)
+            data = self._encode(record).encode('utf-8')
+            with open(self.journal_file, 'ab+') as file:
+                # A crash or a network error can leave a partial last line. End it first,
+                # otherwise the new record would be glued onto it and could not be read.
+                file.seek(0, os.SEEK_END)
+                if file.tell() > 0:
+                    file.seek(-1, os.SEEK_END)
+                    if file.read(1) != b"\n":
+                        data = b"\n" + data
+                file.write(data)
+
+            stat = os.stat(self.journal_file)
+            self._last_seq = ((stat.st_dev, stat.st_ino, stat.st_size), record["seq"])
+        return record["seq"]
+
+    def lastSeq(self):
+        """
+        Returns the sequence number of the last message (0 for an empty journal)
+
+        Records written before sequence numbers existed are counted instead.
+        """
+        try:
+            stat = os.stat(self.journal_file)
+        except OSError:
+            return 0
+
+        key = (stat.st_dev, stat.st_ino, stat.st_size)
+        if self._last_seq is not None and self._last_seq[0] == key:
+            return self._last_seq[1]
+
+        messages, _, _ = self.readPage(None, 1)
+        if messages and isinstance(messages[-1].get("seq"), int):
+            seq = messages[-1]["seq"]
+        else:
+            seq = self._countRecords()
+        self._last_seq = (key, seq)
+        return seq
+
+    def _countRecords(self, block_size=1048576):
+        """Counts the lines of the journal"""
+        count = 0
+        with open(self.journal_file, 'rb') as file:
+            while True:
+                data = file.read(block_size)
+                if not data:
+                    return count
+                count += data.count(b"\n")
+
+    def readAll(self):
+        """Reads and returns all messages in the journal"""
+        messages = []
+        if not os.path.exists(self.journal_file):
+            return messages
+
+        with open(self.journal_file, 'r', encoding='utf-8') as file:
+            for line in file:
+                message = self._decode(line)
+                if message is not None:
+                    messages.append(message)
+        return messages
+
+    def readFrom(self, offset):
+        """
+        Reads the complete messages written after a byte offset
+
+        Args:
+            offset (int): Byte offset where the previous read stopped
+
+        Returns:
+            tuple: (messages, new_offset) - a partially written last line is not consumed
+        """
+        messages = []
+        with open(self.journal_file, 'rb') as file:
+            file.seek(offset)
+            data = file.read()
+
+        # Only consume up to the last complete line
+        end = data.rfind(b"\n")
+        if end < 0:
+            return messages, offset
+
+        for line in data[:end + 1].splitlines():
+            message = self._decode(line.decode('utf-8', errors='replace'))
+            if message is not None:
+                messages.append(message)
+        return messages, offset + end + 1
+
+    def readRecords(self, offset, max_bytes=4194304):
+        """
+        Reads complete messages after a byte offset together with their offsets
+
+        Args:
+            offset (int): Byte offset (at a line start) to read from
+            max_bytes (int): About how many bytes are read per call (a longer line is read whole)
+
+        Returns:
+            tuple: (records, new_offset) - records is a list of (offset, message)
+        """
+        records = []
+        with open(self.journal_file, 'rb') as file:
+            file.seek(offset)
+            data = file.read(max_bytes)
+            end = data.rfind(b"\n")
+            while end < 0:
+                # A single line longer than max_bytes, or nothing complete yet
+                more = file.read(max_bytes)
+                if not more:
+                    return records, offset
+                data += more
+                end = data.rfind(b"\n")
+
+        position = 0
+        while position <= end:
+            line_end = data.find(b"\n", position)
+            message = self._decode(data[position:line_end].decode('utf-8', errors='replace'))
+            if message is not None:
+                records.append((offset + position, message))
+            position = line_end + 1
+        return records, offset + end + 1
+
+    def findIds(self, message_ids):
+        """
+        Returns which of the message ids are in the journal (one pass over the whole file)
+
+        Only lines that contain one of the ids are parsed.
+        """
+        remaining = {str(message_id): f'"{message_id}"'.encode('utf-8') for message_id in message_ids}
+        found = set()
+        if not remaining or not os.path.exists(self.journal_file):
+            return found
+        with open(self.journal_file, 'rb') as file:
+            for line in file:
+                for message_id, token in list(remaining.items()):
+                    if token not in line:
+                        continue
+                    message = self._decode(line.decode('utf-8', errors='replace'))
+                    if message is not None and message.get("id") == message_id:
+                        found.add(message_id)
+                        del remaining[message_id]
+                if not remaining:
+                    break
+        return found
+
+    def readAt(self, offsets):
+        """Reads the messages starting at the given byte offsets, in the given order"""
+        messages = []
+        with open(self.journal_file, 'rb') as file:
+            for offset in offsets:
+                file.seek(offset)
+                message = self._decode(file.readline().decode('utf-8', errors='replace'))
+                if message is not None:
+                    messages.append(message)
+        return messages
+
+    def readPage(self, end_offset=None, limit=100, block_size=65536):
+        """
+        Reads the last messages before a byte offset, reading the journal backwards
+
+        Args:
+            end_offset (int, optional): Byte offset (at a line start) where the page ends,
+                None for the end of the journal
+            limit (int): Maximum number of messages
+            block_size (int): Number of bytes read per step
+
+        Returns:
+            tuple: (messages, start_offset, end_offset) - start_offset is where the first
+                returned message begins (0 once the beginning of the journal is reached)
+        """
+        with open(self.journal_file, 'rb') as file:
+            if end_offset is None:
+                file.seek(0, os.SEEK_END)
+                end_offset = file.tell()
+                trim_partial = True
+            else:
+                trim_partial = False
+
+            # Read blocks from the end until there are enough complete lines
+            position = end_offset
+            data = b""
+            while position > 0 and data.count(b"\n") <= limit:
+                size = min(block_size, position)
+                position -= size
+                file.seek(position)
+                data = file.read(size) + data
+
+        if trim_partial:
+            # A partially written last line is left for the tail reader
+            end_offset = position + data.rfind(b"\n") + 1
+            data = data[:end_offset - position]
+
+        # The first line is incomplete unless the beginning of the journal was reached
+        start = 0
+        if position > 0:
+            start = data.find(b"\n") + 1
+
+        lines = []
+        while start < len(data):
+            end = data.find(b"\n", start)
+            if end < 0:
+                break
+            lines.append((position + start, data[start:end]))
+            start = end + 1
+
+        lines = lines[-limit:] if limit > 0 else []
+        if not lines:
+            return [], 0, end_offset
+
+        messages = []
+        for _, line in lines:
+            message = self._decode(line.decode('utf-8', errors='replace'))
+            if message is not None:
+                messages.append(message)
+
+        return messages, lines[0][0], end_offset
+
+    def readSinceSeq(self, seq, end_offset=None, limit=100):
+        """
+        Reads the messages with a sequence number greater than seq, reading backwards
+
+        Args:
+            seq (int): Sequence number of the last message the reader has
+            end_offset (int, optional): Byte offset where reading ends, None for the end
+            limit (int): Number of messages read per step
+
+        Returns:
+            tuple: (messages, found) - found is False if the beginning of the journal was
+                reached without finding a message up to seq
+        """
+        messages = []
+        while True:
+            page, start, _ = self.readPage(end_offset, limit)
+            for index in range(len(page) - 1, -1, -1):
+                page_seq = page[index].get("seq")
+                if isinstance(page_seq, int) and page_seq <= seq:
+                    return page[index + 1:] + messages, True
+            messages = page + messages
+            if start == 0 or not page:
+                return messages, False
+            end_offset = start
+
+    def _encode(self, message):
+        """Converts a message to a journal line"""
+        return json.dumps(message, ensure_ascii=False) + "\n"
+
+    def _decode(self, line):
+        """Converts a journal line to a message (None for empty or damaged lines)"""
+        line = line.strip()
+        if not line:
+            return None
+        try:
+            message = json.loads(line)
+        except ValueError:
+            # A line that is still being written by another session, or a damaged record
+            return None
+        return message if isinstance(message, dict) else None
+
+
+class JournalTailReader:
+    """Reads only the records added to a journal since the previous read"""
+
+    def __init__(self, journal):
+        """
+        Initializes the tail reader
+
+        Args:
+            journal (MessageJournal): The journal to follow
+        """
+        self.journal = journal
+        self.offset = 0
+        self.file_id = None
+        # True if the last readNew() started over from the beginning of the journal
+        self.was_reset = False
+
+    def readNew(self):
+        """
+        Returns the messages appended since the last call
+
+        The first call returns the whole history. If the journal was replaced or truncated,
+        reading starts over from the beginning and was_reset is set.
+        """
+        self.was_reset = False
+        try:
+            stat = os.stat(self.journal.journal_file)
+        except OSError:
+            return []
+
+        file_id = (stat.st_dev, stat.st_ino)
+        if file_id != self.file_id or stat.st_size < self.offset:
+            self.was_reset = self.file_id is not None
+            self.file_id = file_id
+            self.offset = 0
+
+        # Nothing new - costs a single stat call regardless of history size
+        if stat.st_size == self.offset:
+            return []
+
+        messages, self.offset = self.journal.readFrom(self.offset)
+        return messages
+
+    def readLatest(self, limit=100):
+        """
+        Returns the last messages of the journal and continues reading after them
+
+        Args:
+            limit (int): Maximum number of messages
+
+        Returns:
+            tuple: (messages, start_offset) - start_offset is where the first message begins
+        """
+        self.was_reset = False
+        try:
+            stat = os.stat(self.journal.journal_file)
+        except OSError:
+            return [], 0
+
+        messages, start_offset, self.offset = self.journal.readPage(None, limit)
+        self.file_id = (stat.st_dev, stat.st_ino)
+        return messages, start_offset
+
+    def seekEnd(self):
+        """Continues reading at the current end of the journal and returns that offset"""
+        self.was_reset = False
+        try:
+            stat = os.stat(self.journal.journal_file)
+        except OSError:
+            return 0
+
+        _, _, self.offset = self.journal.readPage(None, 0)
+        self.file_id = (stat.st_dev, stat.st_ino)
+        return self.offset
+
+
+class PresenceDirectory:
+    """Online presence as one heartbeat file per session in a shared folder"""
+
+    # Heartbeat files seen unchanged for this long are deleted by any session (seconds)
+    CLEANUP_AFTER = 600
+
+    def __init__(self, presence_folder, max_age=30):
+        """
+        Initializes the presence folder
+
+        Args:
+            presence_folder (str): Folder for the heartbeat files
+            max_age (int): Seconds after the last heartbeat until a session counts as offline
+        """
+        self.presence_folder = presence_folder
+        self.max_age = max_age
+        # Our own heartbeat files: user_id -> file name
+        self._own_files = {}
+        # User names read from heartbeat files (the name is part of the file name, so a
+        # file only needs to be read the first time it is seen)
+        self._names = {}
+        # file name -> (mtime, local monotonic time when that mtime was first seen)
+        self._unchanged_since = {}
+
+        if not os.path.exists(self.presence_folder):
+            os.makedirs(self.presence_folder, exist_ok=True)
+
+    def _fileName(self, user_id, user):
+        """Heartbeat file name: "<user_id>.<hash of the user name>" """
+        return f"{user_id}.{hashlib.md5(user.encode('utf-8')).hexdigest()[:8]}"
+
+    def heartbeat(self, user_id, user):
+        """
+        Records that a session is online
+
+        Only the mtime of our own file is updated, unless the user name changed.
+
+        Args:
+            user_id (str): Unique ID of the session
+            user (str): Displayed user name
+        """
+        file_name = self._fileName(user_id, user)
+        path = os.path.join(self.presence_folder, file_name)
+
+        if self._own_files.get(user_id) == file_name:
+            try:
+                os.utime(path, None)
+                return
+            except OSError:
+                pass  # Deleted as stale (e.g. after sleep), write it again
+
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(user)
+
+        # User name changed - remove the file with the old name
+        old_file = self._own_files.get(user_id)
+        if old_file and old_file != file_name:
+            self._remove(old_file)
+        self._own_files[user_id] = file_name
+
+    def leave(self, user_id):
+        """Removes the heartbeat of a session"""
+        file_name = self._own_files.pop(user_id, None)
+        if file_name:
+            self._remove(file_name)
+
+    def activeUsers(self):
+        """
+        Returns the sessions with a recent heartbeat from a single folder scan
+
+        Ages are measured against our own latest heartbeat (or the median heartbeat before
+        the first one) instead of the local clock, so clock differences between machines and
+        the file server don't matter. Heartbeats in the future count as current. Files are
+        only deleted after this session saw them unchanged for CLEANUP_AFTER seconds of its
+        own monotonic clock, so no other client's clock can get live files deleted.
+
+        Returns:
+            dict: user_id -> {"user", "last_seen"}
+        """
+        heartbeats = []
+        try:
+            with os.scandir(self.presence_folder) as entries:
+                for entry in entries:
+                    if "." not in entry.name or entry.name.endswith(".tmp"):
+                        continue
+                    try:
+                        heartbeats.append((entry.name, entry.stat().st_mtime))
+                    except OSError:
+                        continue
+        except OSError:
+            return {}
+
+        if not heartbeats:
+            self._unchanged_since.clear()
+            return {}
+
+        mtimes = dict(heartbeats)
+        own = [mtimes[name] for name in self._own_files.values() if name in mtimes]
+        if own:
+            now = max(own)
+        else:
+            ordered = sorted(mtimes.values())
+            now = ordered[len(ordered) // 2]
+
+        monotonic = time.monotonic()
+        unchanged_since = {}
+        active = {}
+        for file_name, mtime in heartbeats:
+            seen_mtime, since = self._unchanged_since.get(file_name, (None, monotonic))
+            if seen_mtime != mtime:
+                since = monotonic
+            if monotonic - since >= self.CLEANUP_AFTER:
+                self._remove(file_name)
+                continue
+            unchanged_since[file_name] = (mtime, since)
+            if now - min(mtime, now) >= self.max_age:
+                continue
+            user = self._readName(file_name)
+            if user is None:
+                continue
+            user_id = file_name.rsplit(".", 1)[0]
+            if user_id not in active or active[user_id]["last_seen"] < mtime:
+                active[user_id] = {"user": user, "last_seen": mtime}
+        self._unchanged_since = unchanged_since
+        return active
+
+    def _readName(self, file_name):
+        """Returns the user name stored in a heartbeat file"""
+        if file_name not in self._names:
+            try:
+                with open(os.path.join(self.presence_folder, file_name), 'r', encoding='utf-8') as file:
+                    user = file.read().strip()
+            except OSError:
+                return None
+            if not user:
+                # Still being written
+                return None
+            self._names[file_name] = user
+        return self._names[file_name]
+
+    def _remove(self, file_name):
+        """Deletes a heartbeat file (it may already be gone)"""
+        self._names.pop(file_name, None)
+        try:
+            os.remove(os.path.join(self.presence_folder, file_name))
+        except OSError:
+            pass
+
+
+class SQLiteStore:
+    """
+    Message, presence and notification store backed by SQLite
+
+    WAL mode is only used for databases on a local disk. WAL keeps its index in shared
+    memory, which doesn't work when the database is opened from several hosts over a
+    network file system, so a database on a network mount uses a rollback journal.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS messages (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            id TEXT,
+            user TEXT NOT NULL,
+            message TEXT NOT NULL,
+            timestamp TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages (timestamp);
+        CREATE INDEX IF NOT EXISTS idx_messages_user ON messages (user, seq);
+
+        CREATE TABLE IF NOT EXISTS presence (
+            user_id TEXT PRIMARY KEY,
+            user TEXT NOT NULL,
+            last_seen REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_presence_last_seen ON presence (last_seen);
+
+        CREATE TABLE IF NOT EXISTS notifications (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            recipient TEXT NOT NULL,
+            timestamp REAL NOT NULL,
+            sender TEXT NOT NULL,
+            message TEXT NOT NULL,
+            read INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS idx_notifications_recipient ON notifications (recipient, read);
+    """
+
+    def __init__(self, db_file, timeout=5.0, journal_mode=None):
+        """
+        Initializes the SQLite store and creates the tables if needed
+
+        Args:
+            db_file (str): Path of the SQLite database file
+            timeout (float): Seconds to wait for another writer before giving up
+            journal_mode (str, optional): "WAL" or "DELETE", by default WAL on local disks
+                and DELETE on network mounts
+        """
+        self.db_file = db_file
+        self.timeout = timeout
+        if journal_mode is None:
+            local = db_file == ":memory:" or not isNetworkPath(os.path.dirname(os.path.abspath(db_file)))
+            journal_mode = "WAL" if local else "DELETE"
+        self.journal_mode = journal_mode
+        # One connection per thread, sqlite3 connections can't be shared between threads
+        self._local = threading.local()
+
+        connection = self._connection()
+        connection.executescript(self.SCHEMA)
+
+        # Databases created before messages had an id
+        columns = [row["name"] for row in connection.execute("PRAGMA table_info(messages)")]
+        if "id" not in columns:
+            connection.execute("ALTER TABLE messages ADD COLUMN id TEXT")
+        connection.execute("CREATE INDEX IF NOT EXISTS idx_messages_id ON messages (id)")
+
+    def _connection(self):
+        """Returns the connection of the current thread, opening it if needed"""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            # isolation_level=None: transactions are opened explicitly with BEGIN IMMEDIATE
+            connection = sqlite3.connect(self.db_file, timeout=self.timeout, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            connection.execute(f"PRAGMA journal_mode={self.journal_mode}")
+            if self.journal_mode == "WAL":
+                # WAL lets readers continue while a writer appends, a commit only needs to
+                # reach the log
+                connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(f"PRAGMA busy_timeout={int(self.timeout * 1000)}")
+            self._local.connection = connection
+        return connection
+
+    def _transaction(self):
+        """Starts a write transaction (waits for other writers through busy_timeout)"""
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        return connection
+
+    def close(self):
+        """Closes the connection of the current thread"""
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    # Messages
+
+    def appendMessage(self, message):
+        """
+        Appends a message
+
+        Args:
+            message (dict): Message record ({"id", "user", "message", "timestamp"})
+
+        Returns:
+            int: Sequence number of the new message
+        """
+        cursor = self._connection().execute(
+            "INSERT INTO messages (id, user, message, timestamp) VALUES (?, ?, ?, ?)",
+            (message.get("id"), message["user"], message["message"], message["timestamp"]))
+        return cursor.lastrowid
+
+    def findMessage(self, message_id):
+        """Returns the sequence number of the message with the given id (None if it isn't stored)"""
+        row = self._connection().execute(
+            "SELECT seq FROM messages WHERE id = ? LIMIT 1", (message_id,)).fetchone()
+        return row["seq"] if row is not None else None
+
+    def readSince(self, seq=0):
+        """Returns the messages with a sequence number greater than seq, oldest first"""
+        rows = self._connection().execute(
+            "SELECT seq, id, user, message, timestamp FROM messages WHERE seq > ? ORDER BY seq",
+            (seq,))
+        return [dict(row) for row in rows]
+
+    def readPage(self, before_seq=None, limit=100):
+        """Returns the last messages with a sequence number lower than before_seq, oldest first"""
+        if before_seq is None:
+            rows = self._connection().execute(
+                "SELECT seq, id, user, message, timestamp FROM messages ORDER BY seq DESC LIMIT ?",
+                (limit,))
+        else:
+            rows = self._connection().execute(
+                "SELECT seq, id, user, message, timestamp FROM messages WHERE seq < ? "
+                "ORDER BY seq DESC LIMIT ?", (before_seq, limit))
+        return [dict(row) for row in reversed(rows.fetchall())]
+
+    def queryMessages(self, search="", user=None, exclude_user=None, since=None, until=None):
+        """
+        Returns the messages matching the given criteria, oldest first
+
+        Args:
+            search (str): Text the message must contain (case-insensitive for ASCII)
+            user (str, optional): Only messages of this user
+            exclude_user (str, optional): Only messages not sent by this user
+            since (str, optional): Minimum timestamp ("YYYY-MM-DD HH:MM:SS")
+            until (str, optional): Maximum timestamp ("YYYY-MM-DD HH:MM:SS")
+        """
+        conditions = []
+        params = []
+        if search:
+            escaped = search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            conditions.append("message LIKE ? ESCAPE '\\'")
+            params.append(f"%{escaped}%")
+        if user is not None:
+            conditions.append("user = ?")
+            params.append(user)
+        if exclude_user is not None:
+            conditions.append("user != ?")
+            params.append(exclude_user)
+        if since is not None:
+            conditions.append("timestamp >= ?")
+            params.append(since)
+        if until is not None:
+            conditions.append("timestamp <= ?")
+            params.append(until)
+
+        query = "SELECT seq, id, user, message, timestamp FROM messages"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY seq"
+        return [dict(row) for row in self._connection().execute(query, params)]
+
+    # Presence
+
+    def updatePresence(self, user_id, user, last_seen=None, max_age=30):
+        """Records the presence of a user and removes records older than max_age seconds"""
+        last_seen = time.time() if last_seen is None else last_seen
+        connection = self._transaction()
+        try:
+            connection.execute(
+                "INSERT OR REPLACE INTO presence (user_id, user, last_seen) VALUES (?, ?, ?)",
+                (user_id, user, last_seen))
+            connection.execute("DELETE FROM presence WHERE last_seen < ?", (last_seen - max_age,))
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+    def activeUsers(self, max_age=30):
+        """Returns {user_id: {"user", "last_seen"}} for users seen in the last max_age seconds"""
+        rows = self._connection().execute(
+            "SELECT user_id, user, last_seen FROM presence WHERE last_seen >= ?",
+            (time.time() - max_age,))
+        return {row["user_id"]: {"user": row["user"], "last_seen": row["last_seen"]} for row in rows}
+
+    # Notifications
+
+    def createNotifications(self, recipients, sender, message, timestamp=None):
+        """Adds the same unread notification for each recipient in a single transaction"""
+        timestamp = time.time() if timestamp is None else timestamp
+        connection = self._transaction()
+        try:
+            connection.executemany(
+                "INSERT INTO notifications (recipient, timestamp, sender, message) VALUES (?, ?, ?, ?)",
+                [(recipient, timestamp, sender, message) for recipient in recipients])
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+    def readNotificationsSince(self, recipient, after_id=0):
+        """
+        Returns the notifications of a recipient added after a notification id (read only)
+
+        Returns:
+            tuple: (notifications, last_id) - last_id is the cursor for the next call
+        """
+        rows = self._connection().execute(
+            "SELECT id, timestamp, sender, message FROM notifications "
+            "WHERE recipient = ? AND id > ? ORDER BY id",
+            (recipient, after_id)).fetchall()
+        last_id = rows[-1]["id"] if rows else after_id
+        return [{"timestamp": row["timestamp"], "sender": row["sender"],
+                 "message": row["message"], "read": False} for row in rows], last_id
+
+    # Import
+
+    def importJsonFiles(self, chat_file=None, presence_file=None, notifications_file=None):
+        """
+        One-shot import of the JSON based storage files
+
+        Messages and notifications are only imported into empty tables, so running
+        the import again doesn't duplicate them.
+
+        Args:
+            chat_file (str, optional): Message journal (.jsonl) or old JSON array file
+            presence_file (str, optional): presence.json
+            notifications_file (str, optional): notifications.json
+
+        Returns:
+            dict: Number of imported records per table
+        """
+        counts = {"messages": 0, "presence": 0, "notifications": 0}
+
+        messages = []
+        if chat_file and os.path.exists(chat_file):
+            if chat_file.endswith(".jsonl"):
+                messages = MessageJournal(chat_file).readAll()
+            else:
+                messages = readJson(chat_file, [])
+        presence = readJson(presence_file, {}) if presence_file else {}
+        notifications = readJson(notifications_file, {}) if notifications_file else {}
+
+        connection = self._transaction()
+        try:
+            has_messages = connection.execute("SELECT 1 FROM messages LIMIT 1").fetchone()
+            if not has_messages:
+                rows = [(msg.get("id"), msg.get("user", ""), msg.get("message", ""), msg.get("timestamp", ""))
+                        for msg in messages if isinstance(msg, dict)]
+                connection.executemany(
+                    "INSERT INTO messages (id, user, message, timestamp) VALUES (?, ?, ?, ?)", rows)
+                counts["messages"] = len(rows)
+
+            for user_id, data in presence.items():
+                connection.execute(
+                    "INSERT OR REPLACE INTO presence (user_id, user, last_seen) VALUES (?, ?, ?)",
+                    (user_id, data.get("user", user_id), data.get("last_seen", 0)))
+                counts["presence"] += 1
+
+            has_notifications = connection.execute("SELECT 1 FROM notifications LIMIT 1").fetchone()
+            for recipient, items in ({} if has_notifications else notifications).items():
+                for item in items:
+                    connection.execute(
+                        "INSERT INTO notifications (recipient, timestamp, sender, message, read) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        (recipient, item.get("timestamp", 0), item.get("sender", ""),
+                         item.get("message", ""), 1 if item.get("read") else 0))
+                    counts["notifications"] += 1
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        return counts
+
+
+def readJson(path, default):
+    """Reads a JSON file, returning default if it is missing or damaged"""
+    if not path or not os.path.exists(path):
+        return default
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except Exception as e:
+        print(f"Error reading {path}: {str(e)}")
+        return default
+
+
+if __name__ == "__main__":
+    # One-shot import of an existing "db" folder: python NukeChatStorage.py <db folder>
+    if len(sys.argv) != 2:
+        print("Usage: python NukeChatStorage.py <db folder>")
+        sys.exit(1)
+
+    db_folder = sys.argv[1]
+    chat_file = os.path.join(db_folder, "nukechat_messages.jsonl")
+    if not os.path.exists(chat_file):
+        chat_file = os.path.join(db_folder, "nukechat_messages.json")
+
+    store = SQLiteStore(os.path.join(db_folder, "nukechat.db"))
+    imported = store.importJsonFiles(chat_file,
+                                     os.path.join(db_folder, "presence.json"),
+                                     os.path.join(db_folder, "notifications.json"))
+    print(f"Imported: {imported}")
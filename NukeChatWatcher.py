@@ -0,0 +1,125 @@
+"""
+NukeChatWatcher.py
+
+This module detects changes of the chat files for NukeChat. Files on local disks are
+watched with QFileSystemWatcher (file system events). Files on network mounts, where
+events are not delivered reliably, are polled with an adaptive interval that backs off
+while the chat is idle and tightens again after activity.
+"""
+
+import os
+import PySide2.QtCore as QtCore
+from NukeChatStorage import isNetworkPath
+
+
+class ChangeWatcher(QtCore.QObject):
+    """Emits changed when a watched file is modified"""
+
+    changed = QtCore.Signal()
+
+    def __init__(self, path, parent=None, min_interval=500, max_interval=10000, force_polling=False,
+                 scheduler=None):
+        """
+        Initializes the watcher
+
+        Args:
+            path (str): File to watch
+            parent (QObject, optional): Parent object
+            min_interval (int): Polling interval right after activity (ms)
+            max_interval (int): Longest polling interval while idle (ms)
+            force_polling (bool): Poll even if file system events are available
+            scheduler (IOScheduler, optional): Runs the polling as a scheduler job (stat off the
+                GUI thread) instead of using an own timer
+        """
+        super(ChangeWatcher, self).__init__(parent)
+        self.path = path
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        self.scheduler = scheduler
+        self.job_name = f"watch:{os.path.basename(path)}"
+        # Number of stat calls made, useful to compare polling and event modes
+        self.stat_calls = 0
+        self.signature = self._signature()
+
+        self.fs_watcher = None
+        if not force_polling and not isNetworkPath(path):
+            self.fs_watcher = QtCore.QFileSystemWatcher(self)
+            self.fs_watcher.fileChanged.connect(self._onFileEvent)
+            self.fs_watcher.directoryChanged.connect(self._onFileEvent)
+            self._watchPaths()
+
+        self.mode = "events" if self.fs_watcher is not None else "polling"
+
+        # In event mode polling is only a slow safety net for missed events
+        self.timer = None
+        if self.scheduler is not None:
+            self.scheduler.addJob(self.job_name, self.currentInterval,
+                                  io=lambda context: self._signature(),
+                                  apply=self._applySignature)
+        else:
+            self.timer = QtCore.QTimer(self)
+            self.timer.setSingleShot(True)
+            self.timer.timeout.connect(self._poll)
+            self.timer.start(self.currentInterval())
+
+    def currentInterval(self):
+        """Returns the current polling interval (ms)"""
+        return self.max_interval if self.fs_watcher is not None else self.interval
+
+    def setMinInterval(self, min_interval):
+        """Changes the shortest polling interval (e.g. while change hints arrive another way)"""
+        self.min_interval = min_interval
+        self.interval = max(self.interval, min_interval)
+
+    def notifyActivity(self):
+        """Called after messages are sent or received - polls at the shortest interval again"""
+        self.interval = self.min_interval
+        if self.fs_watcher is None and self.timer is not None:
+            self.timer.start(self.interval)
+
+    def _signature(self):
+        """Returns (size, mtime, inode) of the file, None if it doesn't exist"""
+        self.stat_calls += 1
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_size, stat.st_mtime_ns, stat.st_ino
+
+    def _applySignature(self, signature):
+        """Compares the file with the last known state, emits changed and adapts the interval"""
+        if self.fs_watcher is not None:
+            self._watchPaths()
+
+        if signature == self.signature:
+            # Back off while nothing happens
+            self.interval = min(int(self.interval * 1.5), self.max_interval)
+            return False
+
+        self.signature = signature
+        self.interval = self.min_interval
+        self.changed.emit()
+        return True
+
+    def _watchPaths(self):
+        """Makes sure the file and its folder are watched (replaced files drop out of the watcher)"""
+        watched = set(self.fs_watcher.files()) | set(self.fs_watcher.directories())
+        folder = os.path.dirname(self.path)
+        if folder not in watched and os.path.isdir(folder):
+            self.fs_watcher.addPath(folder)
+        if self.path not in watched and os.path.exists(self.path):
+            self.fs_watcher.addPath(self.path)
+
+    def _onFileEvent(self, path):
+        """File system event for the file or its folder"""
+        if self.scheduler is not None:
+            # Compare on the scheduler thread
+            self.scheduler.trigger(self.job_name)
+        else:
+            self._applySignature(self._signature())
+
+    def _poll(self):
+        """Timer tick: polls the file and schedules the next tick"""
+        self._applySignature(self._signature())
+        self.timer.start(self.currentInterval())
@@ -0,0 +1,43 @@
+"""
+Tests of NukeChatStorage (stdlib only, run with: python -m pytest tests)
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from NukeChatStorage import MessageJournal, JournalTailReader
+
+
+class MessageJournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix="nukechat_test_")
+        self.journal = MessageJournal(os.path.join(self.folder, "nukechat_messages.jsonl"))
+        self.journal.ensureExists()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def testAppendAfterTornLine(self):
+        self.journal.appendMessage({"user": "a", "message": "a", "timestamp": ""})
+        reader = JournalTailReader(self.journal)
+        reader.readNew()
+
+        # A write interrupted by a crash leaves a partial last line
+        with open(self.journal.journal_file, 'ab') as file:
+            file.write(b'{"user": "b", "message": "tor')
+
+        seq = self.journal.appendMessage({"user": "c", "message": "c", "timestamp": ""})
+
+        self.assertEqual(seq, 2)
+        self.assertEqual([message["message"] for message in self.journal.readAll()], ["a", "c"])
+        self.assertEqual([message["message"] for message in reader.readNew()], ["c"])
+
+
+if __name__ == "__main__":
+    unittest.main()